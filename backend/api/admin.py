@@ -1,8 +1,14 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import PAGE_VAR
+from django.utils import timezone
+
+from . import bookings, payments
 from .models import (
     User, Profile, Category, Skill, Service, Booking, Review,
-    TrustBadge, Message, PaymentTransaction, EscrowTransaction, Location
+    TrustBadge, Message, PaymentTransaction, EscrowTransaction, Location,
+    OutboundEmail, BOOKING_TRANSITIONS
 )
+from .pagination import EstimatedCountPaginator
 
 
 admin.site.site_header = "SkillSwap Admin"
@@ -10,6 +16,39 @@ admin.site.site_title = "SkillSwap Portal"
 admin.site.index_title = "Welcome to SkillSwap Admin Panel"
 
 
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelists that cost the same however many rows the table has.
+
+    Pages are counted with ``estimate_count`` instead of ``COUNT(*)`` (see
+    ``EstimatedCountPaginator``), the unfiltered total isn't counted at all,
+    and subclasses join what ``list_display`` shows with
+    ``list_select_related``.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        try:
+            page = int(request.GET.get(PAGE_VAR, 1))
+        except ValueError:
+            page = 1
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, page_hint=page)
+
+
+def transition_action(name):
+    """An admin action applying ``BOOKING_TRANSITIONS[name]`` to the selected bookings."""
+    target = BOOKING_TRANSITIONS[name].target
+
+    @admin.action(description=f"Move selected bookings to {target.replace('_', ' ')}")
+    def apply(modeladmin, request, queryset):
+        results = bookings.transition_bookings(request.user, name, list(queryset.values_list('pk', flat=True)))
+        moved = sum(result['status'] == 200 for result in results)
+        modeladmin.message_user(request, f"{moved} of {len(results)} bookings moved to {target}.")
+
+    apply.__name__ = f'{name}_bookings'
+    return apply
+
+
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     list_display = ('username', 'email', 'is_provider', 'is_verified', 'is_staff')
@@ -20,8 +59,10 @@ class UserAdmin(admin.ModelAdmin):
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'hourly_rate', 'rating')
+    list_select_related = ('user',)
     search_fields = ('user__username',)
     filter_horizontal = ('skills',)
+    autocomplete_fields = ('user',)
 
 
 @admin.register(Category)
@@ -39,47 +80,93 @@ class SkillAdmin(admin.ModelAdmin):
 class ServiceAdmin(admin.ModelAdmin):
     list_display = ('title', 'provider', 'price', 'service_type', 'payment_type', 'is_active')
     list_filter = ('service_type', 'payment_type', 'is_active')
+    list_select_related = ('provider',)
     search_fields = ('title', 'provider__username')
     filter_horizontal = ('skills',)
+    autocomplete_fields = ('provider',)
 
 
 @admin.register(Booking)
-class BookingAdmin(admin.ModelAdmin):
+class BookingAdmin(LargeTableAdmin):
     list_display = ('id', 'client', 'service', 'status', 'scheduled_date', 'agreed_price')
     list_filter = ('status',)
+    list_select_related = ('client', 'service__provider')
     search_fields = ('client__username', 'service__title')
+    autocomplete_fields = ('client', 'service')
+    # Status changes go through the transition table, like the API's.
+    readonly_fields = ('status',)
+    actions = [transition_action(name) for name in BOOKING_TRANSITIONS]
+
+    def get_readonly_fields(self, request, obj=None):
+        # As in the API, a saved booking can't move to another service.
+        return self.readonly_fields + ('service',) if obj else self.readonly_fields
 
 
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(LargeTableAdmin):
     list_display = ('reviewer', 'provider', 'rating', 'created_at')
+    list_select_related = ('reviewer', 'provider')
     search_fields = ('reviewer__username', 'provider__username')
+    autocomplete_fields = ('reviewer', 'provider')
 
 
 @admin.register(TrustBadge)
 class TrustBadgeAdmin(admin.ModelAdmin):
     list_display = ('user', 'title', 'issuer', 'date_awarded')
+    list_select_related = ('user',)
     search_fields = ('user__username', 'title', 'issuer')
+    autocomplete_fields = ('user',)
 
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
+class MessageAdmin(LargeTableAdmin):
     list_display = ('sender', 'recipient', 'created_at')
+    list_select_related = ('sender', 'recipient')
     search_fields = ('sender__username', 'recipient__username')
+    autocomplete_fields = ('sender', 'recipient')
 
 
 @admin.register(PaymentTransaction)
-class PaymentTransactionAdmin(admin.ModelAdmin):
+class PaymentTransactionAdmin(LargeTableAdmin):
     list_display = ('booking', 'amount', 'status', 'created_at')
     list_filter = ('status',)
+    list_select_related = ('booking__client', 'booking__service')
     search_fields = ('booking__service__title', 'booking__client__username')
+    raw_id_fields = ('booking',)
+    actions = ['release_selected']
+
+    @admin.action(description='Release selected held payments')
+    def release_selected(self, request, queryset):
+        released = payments.release_payments(queryset)
+        self.message_user(request, f"{released} payments released.")
 
 
 @admin.register(EscrowTransaction)
-class EscrowTransactionAdmin(admin.ModelAdmin):
+class EscrowTransactionAdmin(LargeTableAdmin):
     list_display = ('payer', 'receiver', 'amount', 'status', 'created_at')
     list_filter = ('status',)
+    list_select_related = ('payer', 'receiver')
     search_fields = ('payer__username', 'receiver__username')
+    autocomplete_fields = ('payer', 'receiver')
+    actions = ['release_selected', 'refund_selected', 'dispute_selected']
+
+    # Each action is one UPDATE of the selected escrows still pending.
+    @admin.action(description='Release selected pending escrows')
+    def release_selected(self, request, queryset):
+        count = queryset.filter(status='pending').update(
+            status='released', released=True, released_at=timezone.now()
+        )
+        self.message_user(request, f"{count} escrows released.")
+
+    @admin.action(description='Refund selected pending escrows')
+    def refund_selected(self, request, queryset):
+        count = queryset.filter(status='pending').update(status='refunded', refunded_at=timezone.now())
+        self.message_user(request, f"{count} escrows refunded.")
+
+    @admin.action(description='Mark selected pending escrows disputed')
+    def dispute_selected(self, request, queryset):
+        count = queryset.filter(status='pending').update(status='disputed', disputed=True)
+        self.message_user(request, f"{count} escrows marked disputed.")
 
 
 @admin.register(Location)
@@ -87,3 +174,10 @@ class LocationAdmin(admin.ModelAdmin):
     list_display = ('city', 'state', 'country', 'postal_code')
     list_filter = ('country', 'state')
     search_fields = ('city', 'state', 'country')
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject',)
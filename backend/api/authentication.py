@@ -0,0 +1,138 @@
+"""Stateless signed API tokens.
+
+A token is ``<user id>.<token version>.<expiry>.<signature>``, the signature
+being an HMAC (keyed with ``SECRET_KEY``) over the first three parts, so it
+is verified without a database lookup. Bumping ``User.token_version`` (as
+``LogoutView`` does) revokes every token issued before. The current version
+is cached for ``AUTH_TOKEN_VERSION_CACHE_SECONDS``; the user row itself is
+only loaded if the view touches more than ``request.user.pk``.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import F
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.functional import SimpleLazyObject
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+User = get_user_model()
+
+SALT = 'api.authentication.SignedTokenAuthentication'
+COOKIE_NAME = 'token'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def sign(payload):
+    return salted_hmac(SALT, payload, algorithm='sha256').hexdigest()
+
+
+def version_cache_key(user_id):
+    return f'auth:token-version:{user_id}'
+
+
+def token_version(user_id):
+    """The user's current token version (``None`` for unknown users), cached."""
+    key = version_cache_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = User.objects.filter(pk=user_id).values_list('token_version', flat=True).first()
+        if version is not None:
+            cache.set(key, version, settings.AUTH_TOKEN_VERSION_CACHE_SECONDS)
+    return version
+
+
+def issue_token(user, ttl=None):
+    expires = int(time.time()) + (ttl or settings.AUTH_TOKEN_TTL_SECONDS)
+    payload = f'{user.pk}.{user.token_version}.{expires}'
+    return f'{payload}.{sign(payload)}'
+
+
+def revoke_tokens(user):
+    """Invalidate every token issued to ``user`` so far."""
+    User.objects.filter(pk=user.pk).update(token_version=F('token_version') + 1)
+    cache.delete(version_cache_key(user.pk))
+
+
+def is_signed_token(key):
+    return key.count('.') == 3
+
+
+def verify_token(key):
+    """Return the user id ``key`` was issued to, or raise ``AuthenticationFailed``."""
+    try:
+        user_id, version, expires, signature = key.split('.')
+        user_id, version, expires = int(user_id), int(version), int(expires)
+    except ValueError:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    if not constant_time_compare(signature, sign(f'{user_id}.{version}.{expires}')):
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    if expires < time.time():
+        raise exceptions.AuthenticationFailed('Token has expired.')
+    if token_version(user_id) != version:
+        raise exceptions.AuthenticationFailed('Token has been revoked.')
+    return user_id
+
+
+def load_active_user(user_id):
+    user = User.objects.filter(pk=user_id, is_active=True).first()
+    if user is None:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    return user
+
+
+class TokenUser(SimpleLazyObject):
+    """``request.user`` for a verified token: the row is fetched on first real use."""
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id):
+        super().__init__(lambda: load_active_user(user_id))
+        self.__dict__['_user_id'] = user_id
+
+    @property
+    def pk(self):
+        return self.__dict__['_user_id']
+
+    id = pk
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """``Authorization: Token <signed token>``, or the ``token`` cookie set at login.
+
+    Tokens in the old database format are left to ``TokenAuthentication``.
+    """
+    keyword = 'Token'
+
+    def authenticate(self, request):
+        key, from_cookie = self.get_token(request)
+        if not key or not is_signed_token(key):
+            return None
+        if from_cookie:
+            self.check_origin(request)
+        return TokenUser(verify_token(key)), key
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+    def get_token(self, request):
+        auth = get_authorization_header(request).split()
+        if auth and auth[0].lower() == self.keyword.lower().encode():
+            if len(auth) != 2:
+                raise exceptions.AuthenticationFailed('Invalid token header.')
+            try:
+                return auth[1].decode(), False
+            except UnicodeError:
+                raise exceptions.AuthenticationFailed('Invalid token header.')
+        return request.COOKIES.get(COOKIE_NAME), True
+
+    def check_origin(self, request):
+        """Refuse cookie-authenticated writes sent from pages on other origins."""
+        origin = request.headers.get('Origin')
+        if request.method in SAFE_METHODS or not origin:
+            return
+        if origin in settings.CORS_ALLOWED_ORIGINS or origin == f'{request.scheme}://{request.get_host()}':
+            return
+        raise exceptions.AuthenticationFailed('Cross-origin request not allowed with cookie credentials.')
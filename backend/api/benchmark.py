@@ -0,0 +1,273 @@
+"""Endpoint benchmarks.
+
+Replays a weighted mix of requests against the app, either in-process
+through Django's test client or over HTTP against a running server, and
+reports latency percentiles, throughput and SQL queries per request for
+each endpoint. Results can be saved as a JSON baseline and later runs
+compared against it (``manage.py benchmark``). ``compare_serializers``
+times the list serializers against their row serializers
+(``manage.py benchmark --serializers``).
+"""
+import json
+import random
+import time
+import urllib.error
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.renderers import JSONRenderer
+
+from .authentication import issue_token
+from .models import Booking, User
+from .row_serializers import row_serializer
+from .views import BookingViewSet, ServiceViewSet
+
+# ``role`` picks the user the request is authenticated as (None: anonymous).
+Scenario = namedtuple('Scenario', 'name method path role weight body', defaults=(None,))
+
+SCENARIOS = [
+    Scenario('services', 'GET', '/api/services/', 'client', 30),
+    Scenario('services_search', 'GET', '/api/services/?q=design', 'client', 10),
+    Scenario('services_anonymous', 'GET', '/api/services/?ordering=price', None, 10),
+    Scenario('bookings', 'GET', '/api/bookings/', 'client', 15),
+    Scenario('provider_dashboard', 'GET', '/api/dashboard/provider/', 'provider', 10),
+    Scenario('admin_dashboard', 'GET', '/api/dashboard/admin/', 'admin', 5),
+    Scenario('customer_dashboard', 'GET', '/api/dashboard/customer/', 'client', 5),
+    Scenario('login', 'POST', '/api/login/', None, 5, body='login'),
+]
+
+BENCH_ADMIN = 'bench_admin'
+
+
+# --- users ---
+def bench_users():
+    """Pick a provider, a client and an admin from the data, with API tokens.
+
+    The client is a user with bookings and the provider one with services, so
+    their list and dashboard requests do real work. The admin is only used
+    through its token, so it can't log in with a password.
+    """
+    provider = User.objects.filter(is_provider=True, service_count__gt=0).order_by('-service_count', 'id').first()
+    client = User.objects.filter(
+        pk__in=Booking.objects.order_by().values('client_id')[:1]
+    ).first()
+    admin, _ = User.objects.get_or_create(
+        username=BENCH_ADMIN,
+        defaults={
+            'email': f'{BENCH_ADMIN}@example.com', 'password': make_password(None),
+            'is_staff': True, 'is_superuser': True,
+        },
+    )
+    if admin.has_usable_password():
+        # Created by an earlier run with the seeded users' password.
+        admin.set_unusable_password()
+        admin.save(update_fields=['password'])
+    users = {'provider': provider, 'client': client or provider, 'admin': admin}
+    missing = [role for role, user in users.items() if user is None]
+    if missing:
+        raise ValueError(f"No user to benchmark as {', '.join(missing)}; seed some data first.")
+    return {role: (user, issue_token(user)) for role, user in users.items()}
+
+
+# --- transports ---
+class InProcessTransport:
+    """Requests through Django's test client; counts the queries each one runs."""
+    counts_queries = True
+
+    def __init__(self):
+        self.client = Client(raise_request_exception=False)
+
+    def request(self, method, path, headers, body):
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.generic(
+                    method, path, data=json.dumps(body) if body else '',
+                    content_type='application/json', **{f'HTTP_{k.upper()}': v for k, v in headers.items()}
+                )
+        return response.status_code, len(queries)
+
+
+class HttpTransport:
+    """Requests over HTTP to a running server (queries aren't visible from here)."""
+    counts_queries = False
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, headers, body):
+        data = json.dumps(body).encode() if body else None
+        request = urllib.request.Request(
+            self.base_url + path, data=data, method=method,
+            headers={'Content-Type': 'application/json', **headers},
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status, None
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+
+# --- running ---
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values`` (already sorted)."""
+    if not values:
+        return None
+    rank = max(1, round(pct / 100 * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+
+class Benchmark:
+    def __init__(self, transport, scenarios, users, password, seed=None):
+        self.transport = transport
+        self.scenarios = scenarios
+        self.users = users
+        self.password = password
+        self.rng = random.Random(seed)
+
+    def prepare(self, scenario):
+        headers, body = {}, None
+        if scenario.role:
+            headers['Authorization'] = f'Token {self.users[scenario.role][1]}'
+        if scenario.body == 'login':
+            body = {'identifier': self.users['client'][0].username, 'password': self.password}
+        return headers, body
+
+    def call(self, scenario):
+        headers, body = self.prepare(scenario)
+        started = time.perf_counter()
+        status, queries = self.transport.request(scenario.method, scenario.path, headers, body)
+        return scenario.name, time.perf_counter() - started, status, queries
+
+    def run(self, requests, warmup=1, concurrency=1):
+        """Run ``warmup`` unrecorded calls per scenario, then ``requests`` weighted ones."""
+        for scenario in self.scenarios:
+            for _ in range(warmup):
+                self.call(scenario)
+
+        plan = self.rng.choices(self.scenarios, weights=[s.weight for s in self.scenarios], k=requests)
+        started = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(concurrency) as pool:
+                samples = list(pool.map(self.call, plan))
+        else:
+            samples = [self.call(scenario) for scenario in plan]
+        return summarize(samples, time.perf_counter() - started)
+
+
+def summarize(samples, elapsed):
+    """Per-endpoint figures plus a ``total`` row.
+
+    An endpoint's ``rps`` is what one worker would sustain serving only that
+    endpoint (requests / time spent on them); the total is the measured rate.
+    """
+    by_name = {}
+    for name, seconds, status, queries in samples:
+        by_name.setdefault(name, []).append((seconds, status, queries))
+
+    def row(entries, rps):
+        latencies = sorted(seconds * 1000 for seconds, _, _ in entries)
+        queries = [q for _, _, q in entries if q is not None]
+        return {
+            'requests': len(entries),
+            'errors': sum(1 for _, status, _ in entries if status >= 400),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'rps': round(rps, 1),
+            'queries': round(sum(queries) / len(queries), 1) if queries else None,
+        }
+
+    endpoints = {
+        name: row(entries, len(entries) / sum(seconds for seconds, _, _ in entries))
+        for name, entries in sorted(by_name.items())
+    }
+    all_entries = [entry for entries in by_name.values() for entry in entries]
+    if all_entries:
+        endpoints['total'] = row(all_entries, len(all_entries) / elapsed)
+    return endpoints
+
+
+# --- baselines ---
+def save_baseline(path, results, meta):
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'endpoints': results}, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)['endpoints']
+
+
+def compare(results, baseline, max_regression):
+    """Return ``[(endpoint, metric, before, after, change_pct, regressed)]``.
+
+    Latency regresses when it grows by more than ``max_regression`` percent;
+    any increase in queries per request counts as a regression.
+    """
+    rows = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'rps', 'queries'):
+            old, new = before.get(metric), current.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            if metric == 'queries':
+                regressed = new > old
+            elif metric == 'rps':
+                regressed = change < -max_regression
+            else:
+                regressed = change > max_regression
+            rows.append((name, metric, old, new, round(change, 1), regressed))
+    return rows
+
+
+# --- serializers ---
+def serializer_benchmarks():
+    """``{name: (queryset, serializer class)}`` for the lists served by row serializers."""
+    return {
+        name: (view.queryset.order_by('-created_at', '-id'), view.serializer_class)
+        for name, view in (('services', ServiceViewSet), ('bookings', BookingViewSet))
+    }
+
+
+def best_time(function, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def compare_serializers(queryset, serializer_class, rows=10000, repeat=3):
+    """Time ``serializer_class`` and its row serializer over the first ``rows`` rows.
+
+    Both timings include fetching the rows (best of ``repeat``); ``identical``
+    says whether the two render the same JSON.
+    """
+    compiled = row_serializer(serializer_class)
+    drf_seconds, drf_data = best_time(
+        lambda: serializer_class(list(queryset[:rows]), many=True).data, repeat
+    )
+    row_seconds, row_data = best_time(
+        lambda: compiled.serialize(list(compiled.values(queryset)[:rows])), repeat
+    )
+    renderer = JSONRenderer()
+    return {
+        'rows': len(row_data),
+        'drf_ms': round(drf_seconds * 1000, 1),
+        'rows_ms': round(row_seconds * 1000, 1),
+        'speedup': round(drf_seconds / row_seconds, 1) if row_seconds else None,
+        'identical': renderer.render(drf_data) == renderer.render(row_data),
+    }
@@ -0,0 +1,174 @@
+"""Booking writes: status transitions, and bookings created or moved on in bulk.
+
+Status changes follow ``BOOKING_TRANSITIONS`` and are optimistic: a booking
+is read without a lock and written with ``UPDATE ... WHERE status = <read>
+AND version = <read>``, which bumps ``version``. When a concurrent change got
+there first the update matches no row and the caller gets a 409 with the
+booking's current status and version, instead of one write silently undoing
+the other.
+
+A batch is validated with one query for all the services or bookings it
+names, written with one ``bulk_create`` or a few ``UPDATE``s, and reported
+with a result per item, so one bad item doesn't fail the rest. These writes
+skip model signals, so the rollups, platform counters and WebSocket events the
+receivers in ``api.signals`` maintain are applied here.
+"""
+from django.db import transaction
+from django.db.models import F
+from rest_framework import exceptions, status
+from rest_framework.relations import PrimaryKeyRelatedField
+
+from . import realtime, rollups, stats
+from .models import BOOKING_TRANSITIONS as TRANSITIONS, Booking, Service
+from .serializers import BulkBookingSerializer
+
+ROW_FIELDS = ('id', 'status', 'version', 'client_id', 'created_at')
+
+
+class BookingConflict(exceptions.APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The booking was changed by someone else; reload it and try again.'
+    default_code = 'conflict'
+
+    def __init__(self, row=None, detail=None):
+        super().__init__(detail)
+        # The booking as it now is, so the client can retry from there.
+        self.detail = {'detail': self.detail}
+        if row is not None:
+            self.detail.update(booking_status=row['status'], version=row['version'])
+
+
+# --- create ---
+def create_bookings(client, items):
+    """Book each valid item for ``client``; returns one result per item, in order."""
+    checked = [BulkBookingSerializer(data=item) for item in items]
+    service_ids = {s.validated_data['service_id'] for s in checked if s.is_valid()}
+    services = Service.objects.only('id', 'provider_id').in_bulk(service_ids)
+
+    results, created = [None] * len(items), []
+    for index, serializer in enumerate(checked):
+        if not serializer.is_valid():
+            results[index] = {'index': index, 'status': 400, 'errors': serializer.errors}
+            continue
+        data = dict(serializer.validated_data)
+        service = services.get(data.pop('service_id'))
+        if service is None:
+            error = PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+            results[index] = {
+                'index': index, 'status': 400,
+                'errors': {'service_id': [error.format(pk_value=serializer.validated_data['service_id'])]},
+            }
+            continue
+        created.append((index, Booking(client_id=client.pk, service=service, **data)))
+
+    if created:
+        with transaction.atomic():
+            bookings = Booking.objects.bulk_create([booking for _, booking in created])
+            bookings_created(bookings)
+    for index, booking in created:
+        results[index] = {'index': index, 'status': 201, 'id': booking.pk}
+    return results
+
+
+def bookings_created(bookings):
+    """What the post_save receivers do for a new booking, for a bulk-created batch."""
+    rollups.bookings_created(bookings)
+    stats.increment('total_bookings', len(bookings))
+    realtime.publish_bookings([booking.pk for booking in bookings], 'booking.created')
+    for booking in bookings:
+        booking.remember_loaded_values()
+
+
+# --- status transitions ---
+def may_apply(user, row, transition):
+    if user.is_staff:
+        return True
+    return (
+        ('client' in transition.actors and row['client_id'] == user.pk)
+        or ('provider' in transition.actors and row['provider_id'] == user.pk)
+    )
+
+
+def booking_rows(queryset):
+    return queryset.values(*ROW_FIELDS, provider_id=F('service__provider_id'))
+
+
+def transition_booking(user, booking_id, action, version=None):
+    """Apply ``action`` to one booking, unless it changed since it was read.
+
+    ``version``, when given, is the one the caller last saw; a booking since
+    changed is a conflict even if ``action`` would still apply. Returns the
+    booking's new status and version.
+    """
+    transition = TRANSITIONS[action]
+    row = booking_rows(Booking.objects.filter(pk=booking_id)).first()
+    if row is None:
+        raise exceptions.NotFound()
+    if not may_apply(user, row, transition):
+        raise exceptions.PermissionDenied(f'You may not {action} this booking.')
+    if version is not None and version != row['version']:
+        raise BookingConflict(row)
+    if row['status'] not in transition.sources:
+        raise BookingConflict(row, f"Cannot {action} a booking that is {row['status']}.")
+
+    with transaction.atomic():
+        updated = Booking.objects.filter(pk=booking_id, status=row['status'], version=row['version']).update(
+            status=transition.target, version=F('version') + 1
+        )
+        if not updated:
+            current = Booking.objects.filter(pk=booking_id).values('status', 'version').first()
+            if current is None:
+                raise exceptions.NotFound()
+            raise BookingConflict(current)
+        bookings_status_changed([row], transition.target)
+    return {'id': booking_id, 'status': transition.target, 'version': row['version'] + 1}
+
+
+def transition_bookings(user, action, ids):
+    """Apply ``action`` to the bookings in ``ids``; returns one result per distinct id.
+
+    The rows are locked while the batch is checked, so the conditional
+    updates only miss if another writer ignored the lock; the whole batch is
+    then a conflict, and rolled back.
+    """
+    transition = TRANSITIONS[action]
+    ids = list(dict.fromkeys(ids))
+    results, changed = [], []
+    with transaction.atomic():
+        rows = {
+            row['id']: row
+            for row in booking_rows(Booking.objects.select_for_update(of=('self',)).filter(pk__in=ids))
+        }
+        for pk in ids:
+            row = rows.get(pk)
+            if row is None:
+                results.append({'id': pk, 'status': 404, 'error': 'Not found.'})
+            elif not may_apply(user, row, transition):
+                results.append({'id': pk, 'status': 403, 'error': f'You may not {action} this booking.'})
+            elif row['status'] not in transition.sources:
+                results.append({'id': pk, 'status': 409, 'error': f"Cannot {action} a booking that is {row['status']}."})
+            else:
+                results.append({'id': pk, 'status': 200, 'booking_status': transition.target})
+                changed.append(row)
+
+        if changed:
+            # One conditional UPDATE per (status, version) pair in the batch.
+            groups = {}
+            for row in changed:
+                groups.setdefault((row['status'], row['version']), []).append(row['id'])
+            for (old_status, version), pks in groups.items():
+                updated = Booking.objects.filter(pk__in=pks, status=old_status, version=version).update(
+                    status=transition.target, version=F('version') + 1
+                )
+                if updated != len(pks):
+                    raise BookingConflict()
+            bookings_status_changed(changed, transition.target)
+    return results
+
+
+def bookings_status_changed(rows, new_status):
+    """What the ``booking_status_changed`` receivers do, for a batch of booking rows."""
+    rollups.bookings_status_changed(
+        (row['provider_id'], row['created_at'], row['status'], new_status) for row in rows
+    )
+    realtime.publish_bookings([row['id'] for row in rows], 'booking.status_changed')
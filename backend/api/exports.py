@@ -0,0 +1,154 @@
+"""Streamed finance exports: bookings, payment transactions and escrows.
+
+``/api/exports/<name>/`` (admins only) and ``manage.py export <name>`` write
+every row of an export as CSV or JSON Lines, optionally limited to a
+``created_at`` range, with the related user and service fields joined in.
+Rows are read with ``.iterator()`` in chunks of ``STREAM_BATCH_SIZE`` and
+written out a chunk at a time, so memory use stays flat however many rows
+there are.
+"""
+import csv
+import io
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import renderers
+from .models import Booking, EscrowTransaction, PaymentTransaction
+from .row_serializers import batches
+
+# ``columns`` are ``values_list`` lookups; the header of each is the lookup
+# with ``__`` written as ``_``.
+Export = namedtuple('Export', 'model columns')
+
+EXPORTS = {
+    'bookings': Export(Booking, (
+        'id', 'created_at', 'status', 'scheduled_date', 'agreed_price', 'is_barter', 'location',
+        'client_id', 'client__username', 'client__email',
+        'service_id', 'service__title', 'service__price', 'service__payment_type',
+        'service__provider_id', 'service__provider__username', 'service__provider__email',
+    )),
+    'transactions': Export(PaymentTransaction, (
+        'id', 'created_at', 'status', 'amount',
+        'booking_id', 'booking__status', 'booking__client_id', 'booking__client__username',
+        'booking__service_id', 'booking__service__title',
+        'booking__service__provider_id', 'booking__service__provider__username',
+    )),
+    'escrows': Export(EscrowTransaction, (
+        'id', 'created_at', 'status', 'amount', 'released', 'released_at', 'refunded_at', 'disputed',
+        'payer_id', 'payer__username', 'payer__email',
+        'receiver_id', 'receiver__username', 'receiver__email',
+        'service_id', 'description',
+    )),
+}
+
+FILE_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+# Spreadsheets run CSV cells starting with these as formulas.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def parse_bound(value, end=False):
+    """An ISO 8601 date or datetime as an aware datetime; a date ``end`` is the next midnight."""
+    day = parse_date(value)
+    if day is not None:
+        parsed = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    else:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f'{value!r} is not an ISO 8601 date or datetime.')
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def created_between(start=None, end=None):
+    """``created_at`` lookups for a ``start``/``end`` range; both ends are included.
+
+    A date covers the whole day. Raises ``ValueError`` for unparsable values.
+    """
+    lookups = {}
+    if start:
+        lookups['created_at__gte'] = parse_bound(start)
+    if end:
+        lookup = 'created_at__lt' if parse_date(end) is not None else 'created_at__lte'
+        lookups[lookup] = parse_bound(end, end=True)
+    return lookups
+
+
+def escape_formula(value):
+    """User text as a CSV cell: a leading ``'`` keeps spreadsheets from running it."""
+    return f"'{value}" if value.startswith(FORMULA_PREFIXES) else value
+
+
+def converter(model, lookup, file_type):
+    """How to write the values of ``lookup``: decimals, UUIDs and dates as strings.
+
+    In CSV, text is escaped with ``escape_formula``.
+    """
+    *path, name = lookup.split('__')
+    for step in path:
+        model = model._meta.get_field(step).related_model
+    field = model._meta.get_field(name)
+    if isinstance(field, models.DateField):
+        return lambda value: value.isoformat()
+    if isinstance(field, (models.DecimalField, models.UUIDField)):
+        return str
+    if file_type == 'csv' and isinstance(field, (models.CharField, models.TextField)):
+        return escape_formula
+    return None
+
+
+def converted(rows, converters):
+    slots = [(index, convert) for index, convert in enumerate(converters) if convert is not None]
+    for row in rows:
+        row = list(row)
+        for index, convert in slots:
+            if row[index] is not None:
+                row[index] = convert(row[index])
+        yield row
+
+
+def csv_chunks(headers, row_batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for batch in row_batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # No rows: just the header.
+        yield buffer.getvalue().encode()
+
+
+def jsonl_chunks(headers, row_batches):
+    for batch in row_batches:
+        yield b''.join(renderers.encode(dict(zip(headers, row))) + b'\n' for row in batch)
+
+
+WRITERS = {'csv': csv_chunks, 'jsonl': jsonl_chunks}
+
+
+def stream(name, file_type, lookups=None):
+    """Export ``name`` as ``file_type``: an iterator of byte chunks, one per batch of rows."""
+    export = EXPORTS[name]
+    size = settings.STREAM_BATCH_SIZE
+    rows = (
+        export.model._default_manager.filter(**(lookups or {}))
+        .order_by('pk')
+        .values_list(*export.columns)
+        .iterator(chunk_size=size)
+    )
+    converters = [converter(export.model, column, file_type) for column in export.columns]
+    headers = [column.replace('__', '_') for column in export.columns]
+    return WRITERS[file_type](headers, batches(converted(rows, converters), size))
+
+
+def filename(name, file_type):
+    return f'{name}-{timezone.now():%Y%m%d}.{file_type}'
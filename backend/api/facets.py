@@ -0,0 +1,102 @@
+"""Facet counts for the service list (``/api/services/?facets=true``).
+
+Counts describe the services matching the current filters and take one
+grouped query per dimension, however many values there are:
+
+* service type, payment type and the price histogram share one query
+  grouped by ``(service_type, payment_type, price bucket)``;
+* skills and categories each take one query over the skills through table.
+"""
+from django.conf import settings
+from django.db.models import Case, Count, IntegerField, Max, Min, Value, When
+
+from .models import PAYMENT_TYPES, SERVICE_TYPES, Service
+
+# Most skills/categories returned, highest counts first.
+MAX_FACET_VALUES = 50
+UNPRICED = -1
+
+
+def price_bucket(bounds):
+    """Expression numbering the price bucket; bucket ``i`` is ``[bounds[i], bounds[i + 1])``."""
+    return Case(
+        When(price__isnull=True, then=Value(UNPRICED)),
+        *[When(price__lt=upper, then=Value(i)) for i, upper in enumerate(bounds[1:])],
+        default=Value(len(bounds) - 1),
+        output_field=IntegerField(),
+    )
+
+
+def choice_counts(choices, counts):
+    return [
+        {'value': value, 'label': label, 'count': counts.get(value, 0)}
+        for value, label in choices
+    ]
+
+
+def type_and_price_facets(services, bounds):
+    rows = (
+        services.annotate(bucket=price_bucket(bounds))
+        .values('service_type', 'payment_type', 'bucket')
+        .annotate(n=Count('id'), low=Min('price'), high=Max('price'))
+        .order_by()
+    )
+    service_types, payment_types, buckets = {}, {}, {}
+    low = high = None
+    for row in rows:
+        service_types[row['service_type']] = service_types.get(row['service_type'], 0) + row['n']
+        payment_types[row['payment_type']] = payment_types.get(row['payment_type'], 0) + row['n']
+        buckets[row['bucket']] = buckets.get(row['bucket'], 0) + row['n']
+        if row['low'] is not None:
+            low = row['low'] if low is None else min(low, row['low'])
+            high = row['high'] if high is None else max(high, row['high'])
+
+    edges = list(bounds) + [None]
+    return {
+        'service_type': choice_counts(SERVICE_TYPES, service_types),
+        'payment_type': choice_counts(PAYMENT_TYPES, payment_types),
+        'price': {
+            'min': low,
+            'max': high,
+            'buckets': [
+                {'min': edges[i], 'max': edges[i + 1], 'count': buckets.get(i, 0)}
+                for i in range(len(bounds))
+            ],
+            'unpriced': buckets.get(UNPRICED, 0),
+        },
+    }
+
+
+def skill_facets(links):
+    rows = (
+        links.values('skill_id', 'skill__name')
+        .annotate(n=Count('service_id'))
+        .order_by('-n', 'skill__name')[:MAX_FACET_VALUES]
+    )
+    return [{'id': row['skill_id'], 'name': row['skill__name'], 'count': row['n']} for row in rows]
+
+
+def category_facets(links):
+    rows = (
+        links.values('skill__category_id', 'skill__category__name')
+        .annotate(n=Count('service_id', distinct=True))
+        .order_by('-n', 'skill__category__name')[:MAX_FACET_VALUES]
+    )
+    return [
+        {'id': row['skill__category_id'], 'name': row['skill__category__name'], 'count': row['n']}
+        for row in rows
+    ]
+
+
+def facet_counts(queryset):
+    """Facet counts over the services in ``queryset`` (already filtered)."""
+    # Filter by id so ranking/distance annotations, ordering and DISTINCT on
+    # the list queryset don't leak into the GROUP BY queries.
+    ids = queryset.order_by().values('pk')
+    services = Service.objects.filter(pk__in=ids)
+    links = Service.skills.through.objects.filter(service_id__in=ids)
+
+    facets = type_and_price_facets(services, settings.SERVICE_PRICE_BUCKETS)
+    facets['skills'] = skill_facets(links)
+    facets['categories'] = category_facets(links)
+    return facets
@@ -1,16 +1,102 @@
 # filters.py
 import django_filters
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
 from .models import Service
+from .utils import geo
+from . import search
 
 class ServiceFilter(django_filters.FilterSet):
     min_price = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
     max_price = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
     location = django_filters.CharFilter(field_name='provider__location', lookup_expr='icontains')
     skill = django_filters.CharFilter(method='filter_by_skill')
+    category = django_filters.NumberFilter(method='filter_by_category')
 
     class Meta:
         model = Service
         fields = ['service_type', 'payment_type']
 
+    # Semi-joins on the through table instead of JOIN + DISTINCT, so the
+    # filtered queryset can still be grouped for facet counts.
     def filter_by_skill(self, queryset, name, value):
-        return queryset.filter(skills__name__icontains=value).distinct() 
+        links = Service.skills.through.objects.filter(skill__name__icontains=value)
+        return queryset.filter(pk__in=links.values('service_id'))
+
+    def filter_by_category(self, queryset, name, value):
+        links = Service.skills.through.objects.filter(skill__category_id=value)
+        return queryset.filter(pk__in=links.values('service_id'))
+
+
+class FullTextSearchFilter(BaseFilterBackend):
+    """Ranked full-text search on ``?q=``; results come back best match first."""
+    search_param = 'q'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return search.search_services(queryset, query)
+
+
+class ProximityFilter(BaseFilterBackend):
+    """``?lat=&lng=&radius_km=`` filtering, nearest first.
+
+    Candidates are narrowed by geohash cell and bounding box on the service's
+    own ``Service.location`` (not the provider's address) before the exact
+    haversine distance is computed, and the result is annotated with
+    ``distance_km``. Services without a location are left out.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        if 'lat' not in params and 'lng' not in params:
+            return queryset
+
+        lat = self.parse(params, 'lat', -90, 90)
+        lng = self.parse(params, 'lng', -180, 180)
+        radius = self.parse(
+            params, 'radius_km', 0, settings.GEO_MAX_RADIUS_KM,
+            default=settings.GEO_DEFAULT_RADIUS_KM,
+        )
+
+        box = geo.bounding_box(lat, lng, radius)
+        min_lat, max_lat, min_lng, max_lng = box
+        queryset = queryset.filter(
+            location__latitude__gte=min_lat, location__latitude__lte=max_lat
+        )
+        if min_lng is not None:
+            queryset = queryset.filter(
+                location__longitude__gte=min_lng, location__longitude__lte=max_lng
+            )
+        cells = geo.covering_cells(box)
+        if cells:
+            in_cells = Q()
+            for cell in cells:
+                # A prefix match written as a range so it is an index range
+                # scan on every backend ('~' sorts after every base32 digit).
+                in_cells |= Q(location__geohash__gte=cell, location__geohash__lt=cell + '~')
+            queryset = queryset.filter(in_cells)
+
+        distance = geo.haversine_km('location__latitude', 'location__longitude', lat, lng)
+        return (
+            queryset.annotate(distance_km=distance)
+            .filter(distance_km__lte=radius)
+            .order_by('distance_km', 'id')
+        )
+
+    def parse(self, params, name, low, high, default=None):
+        raw = params.get(name)
+        if raw in (None, ''):
+            if default is None:
+                raise ValidationError({name: 'This parameter is required for proximity search.'})
+            return float(default)
+        try:
+            value = float(raw)
+        except ValueError:
+            raise ValidationError({name: 'A number is required.'})
+        if not low <= value <= high:
+            raise ValidationError({name: f'Must be between {low} and {high}.'})
+        return value
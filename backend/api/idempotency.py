@@ -0,0 +1,144 @@
+"""``Idempotency-Key`` support for the POSTs that move money.
+
+A client retrying a payment or escrow request after a timeout sends the same
+``Idempotency-Key`` header each time. The first request claims the key by
+inserting an ``IdempotencyKey`` row (unique per user and key), runs, and
+stores its response on the row and in the cache. Retries get that response
+back, from the cache without a query, marked ``Idempotent-Replayed: true``.
+
+A duplicate arriving while the first request is still running waits for it,
+polling the row for up to ``IDEMPOTENCY_WAIT_SECONDS``, instead of running
+again; it then replays the result, or answers 409. A key sent again with a
+different request is a 422. Requests that raise or fail with a server error
+store nothing: the key is let go and a retry runs afresh.
+
+Stored responses expire after ``IDEMPOTENCY_KEY_SECONDS``; a request that
+dies in flight holds its key for ``IDEMPOTENCY_LOCK_SECONDS``. Expired rows
+are deleted by ``api.tasks.purge_idempotency_keys``.
+"""
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+
+from . import renderers
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+# A waiting duplicate polls this often at first, backing off to the maximum.
+POLL_SECONDS = 0.05
+MAX_POLL_SECONDS = 0.5
+
+
+def fingerprint(request):
+    """md5 of what makes two requests the same: method, path and body."""
+    parts = [request.method.encode(), request.get_full_path().encode(), request.body]
+    return hashlib.md5(b'\n'.join(parts), usedforsecurity=False).hexdigest()
+
+
+def cache_key(user_id, key):
+    digest = hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+    return f'idempotency:{user_id}:{digest}'
+
+
+def claim(user_id, key, digest):
+    """Claim ``key`` for this request: ``None`` once claimed, else the row of whoever holds it."""
+    lease = timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(user_id=user_id, key=key, fingerprint=digest, expires_at=lease)
+    except IntegrityError:
+        return IdempotencyKey.objects.filter(user_id=user_id, key=key).first()
+    return None
+
+
+def remember(user_id, key, stored, expires_at):
+    """Cache ``(fingerprint, status code, data)`` for ``key`` until the row expires."""
+    timeout = int((expires_at - timezone.now()).total_seconds())
+    if timeout > 0:
+        cache.set(cache_key(user_id, key), stored, timeout)
+
+
+def store(user_id, key, digest, response):
+    # Through JSON, so the cache and the row hold plain types.
+    data = json.loads(renderers.encode(response.data))
+    expires_at = timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_SECONDS)
+    IdempotencyKey.objects.filter(user_id=user_id, key=key).update(
+        status_code=response.status_code, response=data, expires_at=expires_at
+    )
+    remember(user_id, key, (digest, response.status_code, data), expires_at)
+
+
+def release(user_id, key):
+    IdempotencyKey.objects.filter(user_id=user_id, key=key, status_code__isnull=True).delete()
+
+
+def key_reused():
+    return Response({'error': f'{HEADER} was already used for a different request.'}, status=422)
+
+
+def replay(digest, stored):
+    stored_digest, status_code, data = stored
+    if stored_digest != digest:
+        return key_reused()
+    response = Response(data, status=status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def run_once(request, key, handler):
+    """``handler()``'s response, or the one stored for ``key`` by an earlier request."""
+    user_id, digest = request.user.pk, fingerprint(request)
+    stored = cache.get(cache_key(user_id, key))
+    if stored is not None:
+        return replay(digest, stored)
+
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    delay = POLL_SECONDS
+    while (held := claim(user_id, key, digest)) is not None:
+        if held.expires_at <= timezone.now():
+            # An old response, or a request that died in flight: let it go.
+            IdempotencyKey.objects.filter(pk=held.pk, expires_at=held.expires_at).delete()
+            continue
+        if held.status_code is not None:
+            stored = (held.fingerprint, held.status_code, held.response)
+            remember(user_id, key, stored, held.expires_at)
+            return replay(digest, stored)
+        if held.fingerprint != digest:
+            return key_reused()
+        if time.monotonic() >= deadline:
+            return Response({'error': f'A request with this {HEADER} is still in progress.'}, status=409)
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_POLL_SECONDS)
+
+    try:
+        response = handler()
+    except BaseException:
+        release(user_id, key)
+        raise
+    if response.status_code >= 500 or not hasattr(response, 'data'):
+        release(user_id, key)
+    else:
+        store(user_id, key, digest, response)
+    return response
+
+
+def idempotent(method):
+    """Honor ``Idempotency-Key`` on a view method; requests without one run as usual."""
+    @functools.wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None or not request.user.is_authenticated:
+            return method(view, request, *args, **kwargs)
+        if not 0 < len(key) <= MAX_KEY_LENGTH:
+            return Response({'error': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters.'}, status=400)
+        return run_once(request, key, lambda: method(view, request, *args, **kwargs))
+    return wrapper
@@ -0,0 +1,125 @@
+import platform
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from api import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the main API endpoints: latency percentiles, throughput and SQL per request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Measured requests in the mix')
+        parser.add_argument('--warmup', type=int, default=1, help='Unmeasured requests per endpoint first')
+        parser.add_argument('--only', action='append', metavar='NAME',
+                            help='Only run this endpoint (repeatable): '
+                                 + ', '.join(s.name for s in benchmark.SCENARIOS))
+        parser.add_argument('--url', help='Benchmark a running server (e.g. http://localhost:8000) instead of in-process')
+        parser.add_argument('--concurrency', type=int, default=1, help='Parallel clients (with --url only)')
+        parser.add_argument('--password', default='password123', help='Password of the seeded users, for login')
+        parser.add_argument('--seed', type=int, help='Random seed for the request mix and seeded data')
+        parser.add_argument('--seed-data', action='store_true',
+                            help='Replace the database contents with a fresh seed_skillswap dataset first')
+        parser.add_argument('--users', type=int, default=1000, help='Dataset size for --seed-data')
+        parser.add_argument('--bookings', type=int, default=5000, help='Dataset size for --seed-data')
+        parser.add_argument('--save-baseline', metavar='PATH', help='Write the results to PATH as a baseline')
+        parser.add_argument('--baseline', metavar='PATH', help='Compare the results against the baseline at PATH')
+        parser.add_argument('--max-regression', type=float, default=20.0,
+                            help='Latency/throughput change in %% that counts as a regression')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Exit with an error if the comparison finds a regression')
+        parser.add_argument('--serializers', action='store_true',
+                            help='Time the list serializers against their row serializers instead')
+        parser.add_argument('--rows', type=int, default=10000, help='Rows serialized with --serializers')
+
+    def handle(self, *args, **options):
+        scenarios = benchmark.SCENARIOS
+        if options['only']:
+            unknown = set(options['only']) - {s.name for s in scenarios}
+            if unknown:
+                raise CommandError(f"Unknown endpoint(s): {', '.join(sorted(unknown))}")
+            scenarios = [s for s in scenarios if s.name in options['only']]
+
+        if options['url']:
+            transport = benchmark.HttpTransport(options['url'])
+        elif options['concurrency'] > 1:
+            raise CommandError('--concurrency needs --url; in-process requests run one at a time.')
+        else:
+            transport = benchmark.InProcessTransport()
+
+        if options['seed_data']:
+            call_command(
+                'seed_skillswap', users=options['users'], bookings=options['bookings'],
+                seed=options['seed'], stdout=self.stdout,
+            )
+
+        if options['serializers']:
+            self.compare_serializers(options['rows'])
+            return
+
+        try:
+            users = benchmark.bench_users()
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Benchmarking {len(scenarios)} endpoints with {options['requests']} requests "
+            f"({options['url'] or 'in-process'})..."
+        ))
+        results = benchmark.Benchmark(
+            transport, scenarios, users, options['password'], seed=options['seed']
+        ).run(options['requests'], warmup=options['warmup'], concurrency=options['concurrency'])
+        self.print_results(results)
+
+        if options['save_baseline']:
+            benchmark.save_baseline(options['save_baseline'], results, {
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'target': options['url'] or 'in-process',
+                'requests': options['requests'],
+            })
+            self.stdout.write(self.style.SUCCESS(f"✅ Saved baseline to {options['save_baseline']}."))
+
+        if options['baseline']:
+            rows = benchmark.compare(
+                results, benchmark.load_baseline(options['baseline']), options['max_regression']
+            )
+            self.print_comparison(rows)
+            if options['fail_on_regression'] and any(row[-1] for row in rows):
+                raise CommandError('Performance regressed against the baseline.')
+
+    def compare_serializers(self, rows):
+        self.stdout.write(f"{'list':<10} {'rows':>7} {'drf ms':>10} {'rows ms':>10} {'speedup':>8}  identical")
+        for name, (queryset, serializer_class) in benchmark.serializer_benchmarks().items():
+            result = benchmark.compare_serializers(queryset, serializer_class, rows=rows)
+            line = (
+                f"{name:<10} {result['rows']:>7} {result['drf_ms']:>10} {result['rows_ms']:>10} "
+                f"{result['speedup']:>7}x  {'yes' if result['identical'] else 'NO'}"
+            )
+            self.stdout.write(line if result['identical'] else self.style.ERROR(line))
+
+    def print_results(self, results):
+        header = f"{'endpoint':<20} {'reqs':>6} {'errs':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rps':>8} {'queries':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, row in results.items():
+            queries = '-' if row['queries'] is None else row['queries']
+            self.stdout.write(
+                f"{name:<20} {row['requests']:>6} {row['errors']:>5} {row['p50_ms']:>9} "
+                f"{row['p95_ms']:>9} {row['p99_ms']:>9} {row['rps']:>8} {queries:>8}"
+            )
+
+    def print_comparison(self, rows):
+        self.stdout.write('')
+        self.stdout.write(f"{'endpoint':<20} {'metric':<8} {'baseline':>10} {'now':>10} {'change':>9}")
+        for name, metric, old, new, change, regressed in rows:
+            line = f"{name:<20} {metric:<8} {old:>10} {new:>10} {change:>+8}%"
+            self.stdout.write(self.style.ERROR(line + '  REGRESSION') if regressed else line)
+        if any(row[-1] for row in rows):
+            self.stdout.write(self.style.WARNING('⚠️ Regressions found against the baseline.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ No regressions against the baseline.'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import exports
+
+
+class Command(BaseCommand):
+    help = 'Stream bookings, payment transactions or escrows as CSV or JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=list(exports.EXPORTS))
+        parser.add_argument('--file-type', choices=list(exports.FILE_TYPES), default='csv')
+        parser.add_argument('--start', help='First created_at included: an ISO 8601 date or datetime')
+        parser.add_argument('--end', help='Last created_at included: an ISO 8601 date (the whole day) or datetime')
+        parser.add_argument('--output', '-o', metavar='PATH', help='File to write (default: standard output)')
+
+    def handle(self, *args, **options):
+        try:
+            lookups = exports.created_between(options['start'], options['end'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        chunks = exports.stream(options['name'], options['file_type'], lookups)
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending='')
+            return
+        with open(options['output'], 'wb') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f"✅ Wrote {options['output']}"))
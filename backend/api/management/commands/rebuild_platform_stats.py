@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api import stats
+
+
+class Command(BaseCommand):
+    help = 'Recount the admin dashboard platform counters and provider leaderboard'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Recounting platform stats...'))
+        totals = stats.rebuild()
+        for name, value in totals.items():
+            self.stdout.write(f"  {name}: {value}")
+        self.stdout.write(self.style.SUCCESS("✅ Platform stats rebuilt."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api import rollups
+
+
+class Command(BaseCommand):
+    help = 'Backfill or repair the provider dashboard rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--provider', type=int, action='append', dest='providers',
+                            help='Only rebuild this provider id (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Rebuilding provider dashboard rollups...'))
+        count = rollups.rebuild(options['providers'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"✅ Rebuilt rollups for {count} providers."))
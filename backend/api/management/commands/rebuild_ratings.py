@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api import ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute provider ratings and star histograms from reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Recomputing provider ratings...'))
+        count = ratings.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"✅ Updated {count} profiles."))
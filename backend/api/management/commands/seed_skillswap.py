@@ -1,199 +1,378 @@
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+import random
+
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
 from django.core.management.base import BaseCommand
+from django.db.models import Count, Max
 from django.utils import timezone
-from django.contrib.auth import get_user_model
+from faker import Faker
+from rest_framework.authtoken.models import Token
+
+from api import ratings, rollups, search, stats, versions
 from api.models import (
-    Profile, Category, Skill, Service, Booking, Review,
-    TrustBadge, Message, PaymentTransaction, EscrowTransaction, Location
+    BOOKING_STATUS, Profile, Category, Skill, Service, Booking, Review,
+    TrustBadge, Message, PaymentTransaction, EscrowTransaction, Location,
+    ConversationThread, ProviderMonthlyStats, PlatformCounter, IdempotencyKey
 )
-from decimal import Decimal
-import random
-from faker import Faker
+from api.utils.geo import encode_geohash
 
-fake = Faker()
 User = get_user_model()
 
+CATEGORY_NAMES = ['Design', 'Writing', 'Development', 'Marketing', 'Music', 'Fitness']
+SKILLS_PER_CATEGORY = 3
+# Distinct fake texts generated up front; Faker is far too slow to call per row.
+TEXT_POOL_SIZE = 500
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def clear(queryset):
+    """Delete rows with a single DELETE, skipping signals and cascade collection."""
+    queryset._raw_delete(queryset.db)
+
+
 class Command(BaseCommand):
-    help = 'Seed the database with mock data for SkillSwap'
+    help = 'Seed the database with mock data for SkillSwap (scales to millions of rows)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Users to create (every other one is a provider)')
+        parser.add_argument('--services', type=int, help='Services to create (default: 2 per provider)')
+        parser.add_argument('--bookings', type=int, default=10)
+        parser.add_argument('--reviews', type=int, help='Reviews to create (default: --bookings)')
+        parser.add_argument('--messages', type=int, help='Messages to create (default: --bookings)')
+        parser.add_argument('--seed', type=int, help='Random seed, for a reproducible dataset')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT')
 
     def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.fake = Faker()
+        self.fake.seed_instance(options['seed'])
+        self.batch_size = options['batch_size']
+
+        n_users = options['users']
+        n_providers = (n_users + 1) // 2
+        n_services = options['services'] if options['services'] is not None else 2 * n_providers
+        n_bookings = options['bookings']
+        n_reviews = options['reviews'] if options['reviews'] is not None else n_bookings
+        n_messages = options['messages'] if options['messages'] is not None else n_bookings
+
         self.stdout.write(self.style.SUCCESS('Seeding SkillSwap data...'))
+        self.texts = {
+            'paragraph': [self.fake.paragraph() for _ in range(TEXT_POOL_SIZE)],
+            'sentence': [self.fake.sentence() for _ in range(TEXT_POOL_SIZE)],
+            'job': [self.fake.job()[:255] for _ in range(TEXT_POOL_SIZE)],
+            'city': [self.fake.city() for _ in range(TEXT_POOL_SIZE)],
+            'phone': [self.fake.phone_number()[:20] for _ in range(TEXT_POOL_SIZE)],
+        }
 
         # 1. Clean database — delete in proper order
-        EscrowTransaction.objects.all().delete()
-        PaymentTransaction.objects.all().delete()
-        Message.objects.all().delete()
-        TrustBadge.objects.all().delete()
-        Review.objects.all().delete()
-        Booking.objects.all().delete()
-        Service.objects.all().delete()
-        Skill.objects.all().delete()
-        Category.objects.all().delete()
-        Location.objects.all().delete()
-        Profile.objects.all().delete()  # must come before user
-        User.objects.exclude(is_superuser=True).delete()
-
-        # 2. Create Users
-        users = []
-        for i in range(10):
-            is_provider = i % 2 == 0
-            user = User.objects.create_user(
-                username=f"user{i}",
-                email=f"user{i}@example.com",
-                password="password123",
-                is_provider=is_provider,
-                phone=fake.phone_number(),
-                location=fake.city(),
-                is_verified=random.choice([True, False]),
-                community_verified=random.choice([True, False]),
-                video_intro_url="https://www.youtube.com/watch?v=dQw4w9WgXcQ" if is_provider else ""
-            )
-            users.append(user)
+        self.clean()
+        self.stdout.write(self.style.SUCCESS("✅ Cleared existing data."))
 
+        # 2. Users and profiles
+        self.create_users(n_users)
+        users = list(User.objects.exclude(is_superuser=True).order_by('id').values_list('id', 'is_provider'))
+        self.provider_ids = [pk for pk, is_provider in users if is_provider]
+        self.client_ids = [pk for pk, is_provider in users if not is_provider] or self.provider_ids
+        self.user_ids = [pk for pk, _ in users]
         self.stdout.write(self.style.SUCCESS(f"✅ Created {len(users)} users."))
 
-        # 3. Create Profiles
-        for user in users:
-            Profile.objects.get_or_create(
-                user=user,
-                defaults={
-                    "bio": fake.paragraph(),
-                    "languages": "English, French",
-                    "hourly_rate": Decimal(random.randint(20, 100)),
-                    "rating": round(random.uniform(3.0, 5.0), 1)
-                }
-            )
+        self.create_profiles()
         self.stdout.write(self.style.SUCCESS("✅ Created user profiles."))
 
-        # 4. Categories and Skills
-        categories = []
-        cat_names = ['Design', 'Writing', 'Development', 'Marketing', 'Music', 'Fitness']
-        for name in cat_names:
-            cat = Category.objects.create(name=name)
-            categories.append(cat)
-
-        skills = []
-        for cat in categories:
-            for i in range(3):
-                skill = Skill.objects.create(
-                    name=f"{cat.name} Skill {i+1}",
-                    category=cat
-                )
-                skills.append(skill)
-
-        self.stdout.write(self.style.SUCCESS(f"✅ Created {len(categories)} categories and {len(skills)} skills."))
-
-        # 5. Assign skills to profiles
-        for profile in Profile.objects.all():
-            profile.skills.set(random.sample(skills, k=random.randint(1, 4)))
-
-        # 6. Create Services
-        services = []
-        for provider in User.objects.filter(is_provider=True):
-            for _ in range(2):
-                service = Service.objects.create(
-                    provider=provider,
-                    title=fake.job(),
-                    description=fake.paragraph(),
-                    service_type=random.choice(['digital', 'local']),
-                    payment_type=random.choice(['escrow', 'postpay', 'barter']),
-                    price=Decimal(random.randint(30, 150)),
-                    is_active=True
-                )
-                service.skills.set(random.sample(skills, k=random.randint(1, 3)))
-                services.append(service)
+        # 3. Categories, skills and locations
+        categories = Category.objects.bulk_create([Category(name=name) for name in CATEGORY_NAMES])
+        Skill.objects.bulk_create([
+            Skill(name=f"{category.name} Skill {i + 1}", category_id=category.pk)
+            for category in categories for i in range(SKILLS_PER_CATEGORY)
+        ])
+        self.skill_ids = list(Skill.objects.order_by('id').values_list('id', flat=True))
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Created {len(categories)} categories and {len(self.skill_ids)} skills."
+        ))
+
+        self.create_locations(max(5, n_services // 100))
+        self.location_ids = list(Location.objects.order_by('id').values_list('id', flat=True))
+        self.stdout.write(self.style.SUCCESS(f"✅ Created {len(self.location_ids)} locations."))
 
+        self.assign_profile_skills()
+
+        # 4. Services, bookings and payments
+        if self.provider_ids:
+            self.create_services(n_services)
+        services = list(Service.objects.order_by('id').values_list('id', 'price'))
         self.stdout.write(self.style.SUCCESS(f"✅ Created {len(services)} services."))
 
-        # 7. Create Bookings
-        bookings = []
-        clients = User.objects.filter(is_provider=False)
-        for _ in range(10):
-            client = random.choice(clients)
-            service = random.choice(services)
-            booking = Booking.objects.create(
-                client=client,
-                service=service,
-                status=random.choice(['pending', 'accepted', 'in_progress', 'completed', 'cancelled']),
-                scheduled_date=timezone.now() + timezone.timedelta(days=random.randint(1, 30)),
-                message=fake.sentence(),
-                location=fake.city(),
-                agreed_price=service.price,
-                is_barter=random.choice([True, False]),
-                barter_offer=fake.sentence()
-            )
-            bookings.append(booking)
-
-        self.stdout.write(self.style.SUCCESS(f"✅ Created {len(bookings)} bookings."))
-
-        # 8. Create Reviews
-        for _ in range(10):
-            reviewer = random.choice(clients)
-            provider = random.choice(User.objects.filter(is_provider=True))
-            Review.objects.create(
-                reviewer=reviewer,
-                provider=provider,
-                rating=random.randint(3, 5),
-                comment=fake.sentence()
-            )
+        if services:
+            self.create_bookings(n_bookings, services)
+        booking_ids = list(Booking.objects.order_by('id').values_list('id', flat=True))
+        self.stdout.write(self.style.SUCCESS(f"✅ Created {len(booking_ids)} bookings."))
+
+        self.create_payments(self.rng.sample(booking_ids, len(booking_ids) // 2))
+        self.stdout.write(self.style.SUCCESS("✅ Created payment transactions."))
 
+        # 5. Reviews, trust badges, messages and escrows
+        if self.provider_ids:
+            self.create_reviews(n_reviews)
         self.stdout.write(self.style.SUCCESS("✅ Created reviews."))
 
-        # 9. Create Trust Badges
-        for user in random.sample(users, 5):
-            TrustBadge.objects.create(
-                user=user,
-                title="Community Star",
-                issuer="SkillSwap Community",
-                description="Awarded for exceptional service"
+        self.bulk(TrustBadge, (
+            TrustBadge(
+                user_id=user_id, title="Community Star", issuer="SkillSwap Community",
+                description="Awarded for exceptional service",
             )
-
+            for user_id in self.rng.sample(self.user_ids, len(self.user_ids) // 2)
+        ), 'trust badges', len(self.user_ids) // 2)
         self.stdout.write(self.style.SUCCESS("✅ Created trust badges."))
 
-        # 10. Create Messages
-        for _ in range(10):
-            sender, recipient = random.sample(users, 2)
-            Message.objects.create(
-                sender=sender,
-                recipient=recipient,
-                text=fake.sentence()
-            )
+        if len(self.user_ids) >= 2:
+            self.create_messages(n_messages)
+            self.create_escrows(len(self.user_ids) // 2)
+        self.stdout.write(self.style.SUCCESS("✅ Created messages and escrow transactions."))
 
-        self.stdout.write(self.style.SUCCESS("✅ Created messages."))
+        # 6. Derived data: bulk inserts skip the signal receivers that keep it current.
+        self.rebuild_derived()
+        self.stdout.write(self.style.SUCCESS("✅ Rebuilt search index, ratings, rollups and counters."))
+        self.stdout.write(self.style.SUCCESS("🎉 SkillSwap data seeded successfully!"))
 
-        # 11. Create Payment Transactions
-        for booking in random.sample(bookings, 5):
-            PaymentTransaction.objects.create(
-                booking=booking,
-                amount=booking.agreed_price or Decimal("50.00"),
-                status=random.choice(['initiated', 'held', 'released', 'refunded'])
-            )
+    # --- helpers ---
+    def text(self, kind):
+        return self.rng.choice(self.texts[kind])
 
-        self.stdout.write(self.style.SUCCESS("✅ Created payment transactions."))
+    def bulk(self, model, objects, label, total=None):
+        """``bulk_create`` a stream of unsaved ``objects`` one chunk at a time."""
+        done = 0
+        for chunk in chunks(objects, self.batch_size):
+            model.objects.bulk_create(chunk)
+            done += len(chunk)
+            self.stdout.write(f"   {label}: {done}" + (f"/{total}" if total is not None else ""))
 
-        # 12. Create Escrow Transactions
-        for _ in range(5):
-            payer, receiver = random.sample(users, 2)
-            EscrowTransaction.objects.create(
-                payer=payer,
-                receiver=receiver,
-                amount=Decimal(random.randint(50, 200)),
-                description="Escrow for freelance service",
-                status=random.choice(['pending', 'released', 'refunded', 'disputed']),
-                created_at=timezone.now()
+    def clean(self):
+        non_superusers = User.objects.exclude(is_superuser=True)
+        for queryset in [
+            ConversationThread.objects.all(),
+            ProviderMonthlyStats.objects.all(),
+            PlatformCounter.objects.all(),
+            EscrowTransaction.objects.all(),
+            PaymentTransaction.objects.all(),
+            Message.objects.all(),
+            TrustBadge.objects.all(),
+            Review.objects.all(),
+            Booking.objects.all(),
+            Service.skills.through.objects.all(),
+            Service.objects.all(),
+            Profile.skills.through.objects.all(),
+            Skill.objects.all(),
+            Category.objects.all(),
+            Location.objects.all(),
+            Profile.objects.all(),  # must come before user
+            Token.objects.filter(user__in=non_superusers),
+            IdempotencyKey.objects.filter(user__in=non_superusers),
+            LogEntry.objects.filter(user__in=non_superusers),
+            User.groups.through.objects.filter(user__in=non_superusers),
+            User.user_permissions.through.objects.filter(user__in=non_superusers),
+            non_superusers,
+        ]:
+            clear(queryset)
+
+    # --- rows ---
+    def create_users(self, count):
+        password = make_password("password123")  # hashed once, shared by every seeded user
+
+        def users():
+            for i in range(count):
+                is_provider = i % 2 == 0
+                yield User(
+                    username=f"user{i}",
+                    email=f"user{i}@example.com",
+                    password=password,
+                    is_provider=is_provider,
+                    phone=self.text('phone'),
+                    location=self.text('city'),
+                    is_verified=self.rng.random() < 0.5,
+                    community_verified=self.rng.random() < 0.5,
+                    video_intro_url="https://www.youtube.com/watch?v=dQw4w9WgXcQ" if is_provider else "",
+                )
+
+        self.bulk(User, users(), 'users', count)
+
+    def create_profiles(self):
+        self.bulk(Profile, (
+            Profile(
+                user_id=user_id,
+                bio=self.text('paragraph'),
+                languages="English, French",
+                hourly_rate=Decimal(self.rng.randint(20, 100)),
             )
+            for user_id in self.user_ids
+        ), 'profiles', len(self.user_ids))
+
+    def assign_profile_skills(self):
+        Through = Profile.skills.through
+        profiles = Profile.objects.order_by('id').values_list('id', flat=True)
+
+        def rows():
+            for profile_id in profiles.iterator(chunk_size=self.batch_size):
+                for skill_id in self.rng.sample(self.skill_ids, k=self.rng.randint(1, 4)):
+                    yield Through(profile_id=profile_id, skill_id=skill_id)
+
+        self.bulk(Through, rows(), 'profile skills')
+
+    def create_locations(self, count):
+        def locations():
+            for _ in range(count):
+                latitude = Decimal(str(round(self.rng.uniform(-90, 90), 6)))
+                longitude = Decimal(str(round(self.rng.uniform(-180, 180), 6)))
+                yield Location(
+                    city=self.text('city'),
+                    state=self.fake.state(),
+                    country=self.fake.country(),
+                    postal_code=self.fake.postcode(),
+                    latitude=latitude,
+                    longitude=longitude,
+                    geohash=encode_geohash(latitude, longitude),  # Location.save() isn't called
+                )
+
+        self.bulk(Location, locations(), 'locations', count)
+
+    def create_services(self, count):
+        def services():
+            for i in range(count):
+                yield Service(
+                    provider_id=self.provider_ids[i % len(self.provider_ids)],
+                    title=self.text('job'),
+                    description=self.text('paragraph'),
+                    service_type=self.rng.choice(['digital', 'local']),
+                    payment_type=self.rng.choice(['escrow', 'postpay', 'barter']),
+                    price=Decimal(self.rng.randint(30, 150)),
+                    is_active=True,
+                    location_id=self.rng.choice(self.location_ids),
+                )
+
+        self.bulk(Service, services(), 'services', count)
+
+        Through = Service.skills.through
+
+        def rows():
+            service_ids = Service.objects.order_by('id').values_list('id', flat=True)
+            for service_id in service_ids.iterator(chunk_size=self.batch_size):
+                for skill_id in self.rng.sample(self.skill_ids, k=self.rng.randint(1, 3)):
+                    yield Through(service_id=service_id, skill_id=skill_id)
+
+        self.bulk(Through, rows(), 'service skills')
 
-        self.stdout.write(self.style.SUCCESS("✅ Created escrow transactions."))
-
-        # 13. Create Locations
-        for _ in range(5):
-            Location.objects.create(
-                city=fake.city(),
-                state=fake.state(),
-                country=fake.country(),
-                postal_code=fake.postcode(),
-                latitude=round(random.uniform(-90, 90), 6),
-                longitude=round(random.uniform(-180, 180), 6)
+    def create_bookings(self, count, services):
+        statuses = [status for status, _ in BOOKING_STATUS]
+        now = timezone.now()
+
+        def bookings():
+            for _ in range(count):
+                service_id, price = self.rng.choice(services)
+                yield Booking(
+                    client_id=self.rng.choice(self.client_ids),
+                    service_id=service_id,
+                    status=self.rng.choice(statuses),
+                    scheduled_date=now + timedelta(days=self.rng.randint(1, 30)),
+                    message=self.text('sentence'),
+                    location=self.text('city'),
+                    agreed_price=price,
+                    is_barter=self.rng.random() < 0.5,
+                    barter_offer=self.text('sentence'),
+                )
+
+        self.bulk(Booking, bookings(), 'bookings', count)
+
+    def create_payments(self, booking_ids):
+        prices = Booking.objects.filter(id__in=booking_ids)
+
+        def payments():
+            for chunk in chunks(booking_ids, self.batch_size):
+                for booking_id, price in prices.filter(id__in=chunk).order_by('id').values_list('id', 'agreed_price'):
+                    yield PaymentTransaction(
+                        booking_id=booking_id,
+                        amount=price or Decimal("50.00"),
+                        status=self.rng.choice(['initiated', 'held', 'released', 'refunded']),
+                    )
+
+        self.bulk(PaymentTransaction, payments(), 'payments', len(booking_ids))
+
+    def create_reviews(self, count):
+        self.bulk(Review, (
+            Review(
+                reviewer_id=self.rng.choice(self.client_ids),
+                provider_id=self.rng.choice(self.provider_ids),
+                rating=self.rng.randint(3, 5),
+                comment=self.text('sentence'),
             )
+            for _ in range(count)
+        ), 'reviews', count)
 
-        self.stdout.write(self.style.SUCCESS("✅ Created locations."))
-        self.stdout.write(self.style.SUCCESS("🎉 SkillSwap data seeded successfully!"))
+    def create_messages(self, count):
+        def messages():
+            for _ in range(count):
+                sender_id, recipient_id = self.rng.sample(self.user_ids, 2)
+                yield Message(sender_id=sender_id, recipient_id=recipient_id, text=self.text('sentence'))
+
+        self.bulk(Message, messages(), 'messages', count)
+
+    def create_escrows(self, count):
+        now = timezone.now()
+
+        def escrows():
+            for _ in range(count):
+                payer_id, receiver_id = self.rng.sample(self.user_ids, 2)
+                status = self.rng.choice(['pending', 'released', 'refunded', 'disputed'])
+                yield EscrowTransaction(
+                    payer_id=payer_id,
+                    receiver_id=receiver_id,
+                    amount=Decimal(self.rng.randint(50, 200)),
+                    description="Escrow for freelance service",
+                    status=status,
+                    created_at=now,
+                    released_at=now + timedelta(days=7),  # what save() would have scheduled
+                    released=status == 'released',
+                    disputed=status == 'disputed',
+                )
+
+        self.bulk(EscrowTransaction, escrows(), 'escrows', count)
+
+    # --- derived data ---
+    def rebuild_derived(self):
+        search.rebuild_index(batch_size=self.batch_size)
+        ratings.rebuild(batch_size=self.batch_size)
+        rollups.rebuild(batch_size=self.batch_size)
+        stats.rebuild()
+        versions.bump('service', 'skill', 'category', 'location')
+        self.create_threads()
+
+    def create_threads(self):
+        """One inbox thread per side of every conversation; seeded messages count as unread."""
+        threads = {}
+        pairs = (
+            Message.objects.values_list('sender_id', 'recipient_id')
+            .annotate(last_id=Max('id'), last_at=Max('created_at'), n=Count('id'))
+            .order_by()
+        )
+        for sender_id, recipient_id, last_id, last_at, n in pairs.iterator(chunk_size=self.batch_size):
+            for owner_id, counterpart_id, unread in (
+                (sender_id, recipient_id, 0), (recipient_id, sender_id, n)
+            ):
+                thread = threads.get((owner_id, counterpart_id))
+                if thread is None:
+                    threads[owner_id, counterpart_id] = thread = ConversationThread(
+                        owner_id=owner_id, counterpart_id=counterpart_id,
+                        last_message_id=last_id, last_message_at=last_at,
+                    )
+                elif last_id > thread.last_message_id:
+                    thread.last_message_id, thread.last_message_at = last_id, last_at
+                thread.unread_count += unread
+
+        self.bulk(ConversationThread, threads.values(), 'conversation threads', len(threads))
@@ -0,0 +1,164 @@
+"""Per-request timing and SQL instrumentation.
+
+``RequestMetricsMiddleware`` (in ``api.middleware``) samples
+``METRICS_SAMPLE_RATE`` of requests. For a sampled request it:
+
+* measures wall time, SQL query count and SQL time (through
+  ``connection.execute_wrapper``, so it works with ``DEBUG`` off);
+* collects serializer time from views using ``SerializerTimingMixin``;
+* reports them in a ``Server-Timing`` header and records them in the
+  latency histograms below.
+
+``MetricsView`` renders the histograms in the Prometheus text format. They
+live in process memory, so each worker process reports its own.
+"""
+import math
+import threading
+import time
+from contextvars import ContextVar
+
+# The RequestMetrics of the request being handled, if it is sampled.
+current = ContextVar('request_metrics', default=None)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += time.perf_counter() - started
+
+    def server_timing(self, total_seconds):
+        parts = [
+            f'app;dur={total_seconds * 1000:.1f}',
+            f'db;desc="{self.queries} queries";dur={self.db_seconds * 1000:.1f}',
+        ]
+        if self.serializer_seconds:
+            parts.append(f'serializer;dur={self.serializer_seconds * 1000:.1f}')
+        return ', '.join(parts)
+
+
+class Histogram:
+    """A Prometheus histogram: cumulative bucket counts, sum and count per label set."""
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = sorted(self.series.items())
+            for key, values in series:
+                for bound, count in zip(self.buckets, values['buckets']):
+                    lines.append(f'{self.name}_bucket{format_labels(key, le=format_value(bound))} {count}')
+                lines.append(f'{self.name}_bucket{format_labels(key, le="+Inf")} {values["count"]}')
+                lines.append(f'{self.name}_sum{format_labels(key)} {format_value(values["sum"])}')
+                lines.append(f'{self.name}_count{format_labels(key)} {values["count"]}')
+        return lines
+
+    def reset(self):
+        with self.lock:
+            self.series.clear()
+
+
+def format_value(value):
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(key, **extra):
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Wall time spent handling the request.', SECONDS_BUCKETS
+)
+DB_SECONDS = Histogram(
+    'http_request_db_duration_seconds', 'Time spent in SQL queries per request.', SECONDS_BUCKETS
+)
+DB_QUERIES = Histogram(
+    'http_request_db_queries', 'SQL queries run per request.', QUERY_BUCKETS
+)
+SERIALIZER_SECONDS = Histogram(
+    'http_request_serializer_duration_seconds', 'Time spent serializing the response data.', SECONDS_BUCKETS
+)
+HISTOGRAMS = (REQUEST_SECONDS, DB_SECONDS, DB_QUERIES, SERIALIZER_SECONDS)
+
+
+def observe(metrics, total_seconds, view, method):
+    labels = {'view': view, 'method': method}
+    REQUEST_SECONDS.observe(total_seconds, **labels)
+    DB_SECONDS.observe(metrics.db_seconds, **labels)
+    DB_QUERIES.observe(metrics.queries, **labels)
+    if metrics.serializer_seconds:
+        SERIALIZER_SECONDS.observe(metrics.serializer_seconds, **labels)
+
+
+def render():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    for histogram in HISTOGRAMS:
+        histogram.reset()
+
+
+class SerializerTimingMixin:
+    """Add the time a view's serializers spend building output to the request metrics."""
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        metrics = current.get()
+        if metrics is not None:
+            to_representation = serializer.to_representation
+
+            def timed_to_representation(instance):
+                started = time.perf_counter()
+                try:
+                    return to_representation(instance)
+                finally:
+                    metrics.serializer_seconds += time.perf_counter() - started
+
+            serializer.to_representation = timed_to_representation
+        return serializer
@@ -0,0 +1,187 @@
+import random
+from contextlib import ExitStack
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+try:
+    import brotli
+except ImportError:  # responses are gzipped only
+    brotli = None
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import metrics
+from .authentication import is_signed_token, load_active_user, verify_token
+
+
+@database_sync_to_async
+def get_token_user(key):
+    if is_signed_token(key):
+        try:
+            return load_active_user(verify_token(key))
+        except AuthenticationFailed:
+            return AnonymousUser()
+    try:
+        token = Token.objects.select_related('user').get(key=key)
+    except Token.DoesNotExist:
+        return AnonymousUser()
+    return token.user if token.user.is_active else AnonymousUser()
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """Populate ``scope['user']`` for WebSockets from the auth token.
+
+    Browsers can't set headers on a WebSocket handshake, so the token is read
+    from the ``token`` cookie set by ``LoginView`` or a ``?token=`` parameter.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        key = self.get_token(scope)
+        scope['user'] = await get_token_user(key) if key else AnonymousUser()
+        return await super().__call__(scope, receive, send)
+
+    def get_token(self, scope):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        if query.get('token'):
+            return query['token'][0]
+        for name, value in scope.get('headers', []):
+            if name == b'cookie':
+                cookie = SimpleCookie(value.decode('latin-1'))
+                if 'token' in cookie:
+                    return cookie['token'].value
+        return None
+
+
+class RequestMetricsMiddleware:
+    """Time a sample of requests and their SQL; see ``api.metrics``."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+
+        request_metrics = metrics.RequestMetrics()
+        token = metrics.current.set(request_metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(request_metrics.record_query))
+                response = self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+
+        total = request_metrics.elapsed()
+        match = request.resolver_match
+        metrics.observe(request_metrics, total, match.view_name if match else 'unresolved', request.method)
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = request_metrics.server_timing(total)
+        return response
+
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/javascript', 'text/')
+BROTLI_QUALITY = 5
+# Random bytes in the gzip header, as GZipMiddleware does against BREACH.
+GZIP_MAX_RANDOM_BYTES = 100
+
+
+def accepted_encodings(header):
+    """``{coding: q}`` from an Accept-Encoding header."""
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        if not coding:
+            continue
+        q = 1.0
+        name, _, value = params.strip().partition('=')
+        if name.strip() == 'q':
+            try:
+                q = float(value)
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(header):
+    """The best of brotli (if installed) and gzip the client accepts, or ``None``."""
+    accepted = accepted_encodings(header)
+    wildcard = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for coding in ('br', 'gzip') if brotli else ('gzip',):
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def brotli_sequence(sequence):
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    for item in sequence:
+        data = compressor.process(item) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware:
+    """Brotli or gzip, as negotiated, for JSON and text responses.
+
+    Responses under ``COMPRESSION_MIN_BYTES`` are sent as they are;
+    streaming responses are compressed chunk by chunk.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self.compressible(response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if encoding == 'br':
+                response.streaming_content = brotli_sequence(response.streaming_content)
+            else:
+                response.streaming_content = compress_sequence(
+                    response.streaming_content, max_random_bytes=GZIP_MAX_RANDOM_BYTES
+                )
+            del response.headers['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed = brotli.compress(response.content, quality=BROTLI_QUALITY)
+            else:
+                compressed = compress_string(response.content, max_random_bytes=GZIP_MAX_RANDOM_BYTES)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # The compressed body is a different representation: weaken strong ETags.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def compressible(self, response):
+        if response.has_header('Content-Encoding') or getattr(response, 'is_async', False):
+            return False
+        if not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES):
+            return False
+        return response.streaming or len(response.content) >= settings.COMPRESSION_MIN_BYTES
@@ -1,12 +1,37 @@
 from django.contrib.auth.models import AbstractUser, PermissionsMixin, AbstractBaseUser
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
 from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.core.validators import MaxValueValidator, MinValueValidator
+from collections import namedtuple
 from datetime import timedelta
 
+from .utils.geo import encode_geohash
+
+
+class LoadedValuesMixin:
+    """Remember the database values of ``tracked_fields`` so saves can detect changes."""
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_loaded_values()
+        return instance
+
+    def remember_loaded_values(self):
+        # Read __dict__ directly so deferred fields aren't fetched.
+        self._loaded_values = {name: self.__dict__.get(name) for name in self.tracked_fields}
+
+    def loaded_value(self, name):
+        return getattr(self, '_loaded_values', {}).get(name)
+
 
 # 1. User
-class User(AbstractUser, PermissionsMixin):
+class User(LoadedValuesMixin, AbstractUser, PermissionsMixin):
+    tracked_fields = ('is_provider',)
+
     email = models.EmailField(unique=True)
     is_provider = models.BooleanField(default=False)
     phone = models.CharField(max_length=20, blank=True)
@@ -14,10 +39,17 @@ class User(AbstractUser, PermissionsMixin):
     is_verified = models.BooleanField(default=False)
     community_verified = models.BooleanField(default=False)
     video_intro_url = models.URLField(blank=True, null=True)
+    service_count = models.PositiveIntegerField(default=0, editable=False)
+    # Part of every signed API token; bumping it revokes the user's tokens.
+    token_version = models.PositiveIntegerField(default=0, editable=False)
 
     
     REQUIRED_FIELDS = []  # or other required fields
 
+    class Meta(AbstractUser.Meta):
+        # Keeps providers sorted for the admin dashboard leaderboard.
+        indexes = [models.Index(fields=['is_provider', '-service_count'])]
+
     def __str__(self):
         return f"{self.username} ({'Provider' if self.is_provider else 'Client'})"
 
@@ -29,11 +61,23 @@ class Profile(models.Model):
     hourly_rate = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     skills = models.ManyToManyField('Skill', blank=True)
     rating = models.FloatField(default=0.0)
+    # Running totals over received reviews, maintained by api.ratings.
+    rating_sum = models.IntegerField(default=0, editable=False)
+    rating_count = models.IntegerField(default=0, editable=False)
+    rating_1 = models.IntegerField(default=0, editable=False)
+    rating_2 = models.IntegerField(default=0, editable=False)
+    rating_3 = models.IntegerField(default=0, editable=False)
+    rating_4 = models.IntegerField(default=0, editable=False)
+    rating_5 = models.IntegerField(default=0, editable=False)
     profile_picture = models.ImageField(upload_to='profile_pics/', null=True, blank=True)
 
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
+    @property
+    def rating_histogram(self):
+        return {str(stars): getattr(self, f'rating_{stars}') for stars in range(1, 6)}
+
 # 3. Category & Skill
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -62,7 +106,9 @@ PAYMENT_TYPES = [
     ('barter', 'Barter'),
 ]
 
-class Service(models.Model):
+class Service(LoadedValuesMixin, models.Model):
+    tracked_fields = ('provider_id',)
+
     provider = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
     description = models.TextField()
@@ -72,6 +118,10 @@ class Service(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     skills = models.ManyToManyField(Skill)
+    location = models.ForeignKey(
+        'Location', on_delete=models.SET_NULL, null=True, blank=True, related_name='services'
+    )
+    booking_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return f"{self.title} by {self.provider.username}"
@@ -86,7 +136,21 @@ BOOKING_STATUS = [
     ('cancelled', 'Cancelled'),
 ]
 
-class Booking(models.Model):
+# The moves the API allows between BOOKING_STATUS values, by action name.
+# ``actors`` may apply one besides staff: the booking's 'client' and/or the
+# 'provider' of its service.
+BookingTransition = namedtuple('BookingTransition', 'sources target actors')
+
+BOOKING_TRANSITIONS = {
+    'accept': BookingTransition(('pending',), 'accepted', ('provider',)),
+    'start': BookingTransition(('accepted',), 'in_progress', ('provider',)),
+    'complete': BookingTransition(('in_progress',), 'completed', ('provider',)),
+    'cancel': BookingTransition(('pending', 'accepted'), 'cancelled', ('client', 'provider')),
+}
+
+class Booking(LoadedValuesMixin, models.Model):
+    tracked_fields = ('status',)
+
     client = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='client_bookings')
     service = models.ForeignKey(Service, on_delete=models.CASCADE)
     status = models.CharField(max_length=20, choices=BOOKING_STATUS, default='pending')
@@ -97,15 +161,32 @@ class Booking(models.Model):
     is_barter = models.BooleanField(default=False)
     barter_offer = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped by every status change; transitions are written only if it is
+    # unchanged since the booking was read (see ``api.bookings``).
+    version = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return f"Booking {self.id} - {self.client.username} → {self.service.title}"
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        old_status = self.loaded_value('status')
+        if (
+            not self._state.adding and old_status is not None and old_status != self.status
+            and (update_fields is None or 'status' in update_fields)
+        ):
+            self.version += 1
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'version'}
+        super().save(*args, **kwargs)
+
 # 6. Review
-class Review(models.Model):
+class Review(LoadedValuesMixin, models.Model):
+    tracked_fields = ('rating', 'provider_id')
+
     reviewer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='given_reviews')
     provider = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='received_reviews')
-    rating = models.IntegerField()
+    rating = models.IntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])
     comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -131,10 +212,58 @@ class Message(models.Model):
     audio_note = models.FileField(upload_to='audio_notes/', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['sender', 'recipient', 'created_at'])]
+
     def __str__(self):
         return f"Message from {self.sender.username} to {self.recipient.username}"
 
 
+# Conversation threads
+class ConversationThread(models.Model):
+    """One inbox row per (owner, counterpart) pair, maintained as messages are sent."""
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='conversation_threads')
+    counterpart = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_at = models.DateTimeField()
+    unread_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'counterpart'], name='unique_conversation_thread'),
+        ]
+        indexes = [models.Index(fields=['owner', '-last_message_at'])]
+
+    def __str__(self):
+        return f"Conversation of {self.owner_id} with {self.counterpart_id}"
+
+    @classmethod
+    def record(cls, message):
+        """Point both participants' threads at ``message``; the recipient gains an unread."""
+        sides = [(message.sender_id, message.recipient_id, 0)]
+        if message.sender_id != message.recipient_id:
+            sides.append((message.recipient_id, message.sender_id, 1))
+
+        for owner_id, counterpart_id, unread in sides:
+            thread = cls.objects.filter(owner_id=owner_id, counterpart_id=counterpart_id)
+            changes = {
+                'last_message': message,
+                'last_message_at': message.created_at,
+                'unread_count': models.F('unread_count') + unread,
+            }
+            if thread.update(**changes):
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(
+                        owner_id=owner_id, counterpart_id=counterpart_id, last_message=message,
+                        last_message_at=message.created_at, unread_count=unread,
+                    )
+            except IntegrityError:
+                # Another request created the thread first.
+                thread.update(**changes)
+
+
 # 9. PaymentTransaction
 TRANSACTION_STATUS = [
     ('initiated', 'Initiated'),
@@ -143,7 +272,9 @@ TRANSACTION_STATUS = [
     ('refunded', 'Refunded'),
 ]
 
-class PaymentTransaction(models.Model):
+class PaymentTransaction(LoadedValuesMixin, models.Model):
+    tracked_fields = ('status', 'amount')
+
     booking = models.OneToOneField(Booking, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=TRANSACTION_STATUS)
@@ -152,6 +283,61 @@ class PaymentTransaction(models.Model):
     def __str__(self):
         return f"Transaction #{self.booking.id} - {self.status}"
 
+# Provider dashboard rollups
+class ProviderMonthlyStats(models.Model):
+    """Dashboard counters for one provider and month, kept current by ``api.rollups``.
+
+    Bookings and earnings are bucketed by the booking's ``created_at`` month,
+    reviews by the review's.
+    """
+    provider = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='monthly_stats')
+    month = models.DateField(help_text="First day of the month")
+    bookings_pending = models.IntegerField(default=0)
+    bookings_accepted = models.IntegerField(default=0)
+    bookings_in_progress = models.IntegerField(default=0)
+    bookings_completed = models.IntegerField(default=0)
+    bookings_cancelled = models.IntegerField(default=0)
+    earnings = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    review_sum = models.IntegerField(default=0)
+    review_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'month'], name='unique_provider_month'),
+        ]
+
+    def __str__(self):
+        return f"Stats for {self.provider_id} in {self.month:%Y-%m}"
+
+# Platform counters
+class PlatformCounter(models.Model):
+    """A platform-wide total split over several shard rows, summed on read.
+
+    Spreading increments over shards keeps concurrent writers from queueing
+    on one hot row; see ``api.stats``.
+    """
+    name = models.CharField(max_length=50)
+    shard = models.PositiveSmallIntegerField(default=0)
+    value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'shard'], name='unique_counter_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.name}[{self.shard}] = {self.value}"
+
+# Table versions
+class TableVersion(models.Model):
+    """A counter bumped on every write to a table, for ETags; see ``api.versions``."""
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
 # Escrow Transaction
 class EscrowTransaction(models.Model):
     STATUS_CHOICES = [
@@ -175,6 +361,10 @@ class EscrowTransaction(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Due escrows for api.tasks.release_due_escrows.
+            models.Index(fields=['status', 'released_at']),
+        ]
 
     def __str__(self):
         return f"Escrow from {self.payer} to {self.receiver} - {self.status} - ₦{self.amount}"
@@ -196,7 +386,7 @@ class EscrowTransaction(models.Model):
         return self.status == 'pending'
 
     def save(self, *args, **kwargs):
-        if not self.released_at:
+        if self._state.adding and not self.released_at:
             self.released_at = timezone.now() + timedelta(days=7)  # auto release in 7 days
         super().save(*args, **kwargs)
 
@@ -208,6 +398,7 @@ class Location(models.Model):
     postal_code = models.CharField(max_length=20, blank=True, null=True)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -217,3 +408,74 @@ class Location(models.Model):
 
     def __str__(self):
         return f"{self.city}, {self.state or ''}, {self.country}"
+
+    def save(self, *args, **kwargs):
+        # Keep the spatial index column in step with the coordinates.
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = encode_geohash(self.latitude, self.longitude)
+        else:
+            self.geohash = ''
+        super().save(*args, **kwargs)
+
+# Outgoing email
+class OutboundEmail(models.Model):
+    """A queued email, delivered by ``api.tasks.flush_outbox``.
+
+    ``next_attempt_at`` is when the message is next due: a worker pushes it
+    forward while sending and backs it off after a failure.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} - {self.status}"
+
+    def as_message(self):
+        message = EmailMultiAlternatives(self.subject, self.body, self.from_email or None, self.to)
+        if self.html_body:
+            message.attach_alternative(self.html_body, "text/html")
+        return message
+
+# Idempotency keys
+class IdempotencyKey(models.Model):
+    """A client's ``Idempotency-Key`` and the response it got; see ``api.idempotency``.
+
+    ``status_code`` is null while the first request is in flight.
+    ``expires_at`` ends that request's lease on the key, then the stored
+    response's lifetime.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    # md5 of the method, path and body the key was first sent with
+    fingerprint = models.CharField(max_length=32)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.status_code or 'in flight'})"
@@ -0,0 +1,300 @@
+"""Keyset (cursor) pagination for list endpoints.
+
+Pages are addressed by the ordering key of the last row seen instead of an
+offset, so page 1000 costs the same index range scan as page 1 and rows
+inserted while a client is paging never shift or repeat results. The
+ordering key is whatever the queryset is ordered by (for example
+``?ordering=price``, search rank or distance) with the primary key appended
+as a tie-breaker; unordered querysets default to ``(-created_at, -id)``.
+
+Exact ``COUNT(*)`` is skipped unless asked for with ``?count=exact``;
+``?count=estimate`` returns a cheap, capped count instead.
+``EstimatedCountPaginator`` brings the same estimate to Django's page-number
+paginator, for the admin changelists.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured, ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, OrderBy, Q, QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimate_count(queryset, cap=None):
+    """Return ``(count, is_estimate)`` without scanning more than ``cap`` rows.
+
+    Unfiltered tables on PostgreSQL use the planner's row estimate; anything
+    else is counted exactly up to ``cap`` and reported as an estimate beyond it.
+    """
+    cap = cap or settings.PAGINATION_COUNT_ESTIMATE_CAP
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row and row[0] >= 0:
+            return row[0], True
+
+    count = queryset.order_by()[:cap + 1].count()
+    if count > cap:
+        return cap, True
+    return count, False
+
+
+class EstimatedCountPaginator(Paginator):
+    """A ``Paginator`` counting with ``estimate_count``, so no page costs a full ``COUNT(*)``.
+
+    An estimate is raised, by counting no further than the page after
+    ``page_hint`` (the page about to be shown), to cover that next page when
+    its rows exist. Every full page thus links on, however far past the
+    estimate the table goes, and a page costs at most what its offset does.
+    """
+
+    def __init__(self, *args, page_hint=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.page_hint = page_hint
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return super().count
+        count, is_estimate = estimate_count(self.object_list)
+        wanted = (max(self.page_hint, 1) + 1) * self.per_page
+        if is_estimate and count < wanted:
+            count = max(count, self.object_list.order_by()[:wanted].count())
+        return count
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Keep full microsecond precision; DjangoJSONEncoder rounds to milliseconds."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class OrderingKey:
+    """One column of the keyset: a field path, its direction and nullability."""
+
+    def __init__(self, name, descending, nullable):
+        self.name = name
+        self.descending = descending
+        self.nullable = nullable
+
+    def order_by(self, reverse=False):
+        descending = self.descending != reverse
+        if not self.nullable:
+            return f'-{self.name}' if descending else self.name
+        # Pin where NULLs sort so the keyset filter agrees on every backend.
+        if descending:
+            return F(self.name).desc(nulls_last=True)
+        return F(self.name).asc(nulls_first=True)
+
+    def after(self, value, reverse=False):
+        """Q for rows strictly after ``value`` in this column's direction.
+
+        Returns ``None`` when no row can sort after ``value``.
+        """
+        descending = self.descending != reverse
+        if value is None:
+            # NULLs come first ascending / last descending.
+            return None if descending else Q(**{f'{self.name}__isnull': False})
+        lookup = 'lt' if descending else 'gt'
+        after = Q(**{f'{self.name}__{lookup}': value})
+        if self.nullable and descending:
+            after |= Q(**{f'{self.name}__isnull': True})
+        return after
+
+    def equals(self, value):
+        if value is None:
+            return Q(**{f'{self.name}__isnull': True})
+        return Q(**{self.name: value})
+
+    def value(self, row):
+        if isinstance(row, dict):
+            return row[self.name]
+        for attr in self.name.split('__'):
+            row = getattr(row, attr)
+            if row is None:
+                break
+        return row
+
+
+class KeysetPagination(BasePagination):
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    default_ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.keys = self.get_ordering_keys(queryset, view)
+        self.count = self.get_count(queryset, request)
+
+        values, reverse = self.decode_cursor(request)
+        queryset = queryset.order_by(*[key.order_by(reverse) for key in self.keys])
+        if values is not None:
+            try:
+                queryset = queryset.filter(self.after(values, reverse))
+            except (ValidationError, ValueError, TypeError):
+                # A cursor that decodes but holds values of the wrong type.
+                raise NotFound(self.invalid_cursor_message)
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.next_values = self.previous_values = None
+        if rows:
+            if has_more or reverse:
+                self.next_values = [key.value(rows[-1]) for key in self.keys]
+            if (has_more and reverse) or (values is not None and not reverse):
+                self.previous_values = [key.value(rows[0]) for key in self.keys]
+        return rows
+
+    def get_paginated_response(self, data):
+        payload = {}
+        if self.count is not None:
+            payload['count'], payload['count_is_estimate'] = self.count
+        payload['next'] = self.get_next_link()
+        payload['previous'] = self.get_previous_link()
+        payload['results'] = data
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer'},
+                'count_is_estimate': {'type': 'boolean'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param, settings.PAGINATION_DEFAULT_COUNT)
+        if mode == 'exact':
+            return queryset.count(), False
+        if mode == 'estimate':
+            return estimate_count(queryset)
+        return None
+
+    # --- ordering ---
+    def get_ordering_keys(self, queryset, view):
+        opts = queryset.model._meta
+        if queryset.query.order_by:
+            ordering = list(queryset.query.order_by)
+        elif queryset.query.default_ordering and opts.ordering:
+            ordering = list(opts.ordering)
+        else:
+            ordering = getattr(view, 'keyset_ordering', None)
+            if ordering is None:
+                has_created_at = any(f.name == 'created_at' for f in opts.get_fields())
+                ordering = self.default_ordering if has_created_at else ('id',)
+            ordering = list(ordering)
+
+        keys = []
+        for term in ordering:
+            if isinstance(term, OrderBy) and isinstance(term.expression, F):
+                name, descending = term.expression.name, term.descending
+            elif isinstance(term, str) and term != '?':
+                name, descending = term.lstrip('-'), term.startswith('-')
+            else:
+                raise ImproperlyConfigured(f'Cannot paginate by keyset on ordering {term!r}.')
+            if name == 'pk':
+                name = opts.pk.attname
+            keys.append(OrderingKey(name, descending, self.is_nullable(queryset, name)))
+
+        if not any(key.name in ('id', opts.pk.attname) for key in keys):
+            descending = keys[0].descending if keys else False
+            keys.append(OrderingKey(opts.pk.attname, descending, False))
+        return keys
+
+    def is_nullable(self, queryset, name):
+        if name in queryset.query.annotations:
+            return False
+        opts = queryset.model._meta
+        path = name.split('__')
+        try:
+            for part in path[:-1]:
+                field = opts.get_field(part)
+                if field.null:
+                    return True
+                opts = field.related_model._meta
+            return opts.get_field(path[-1]).null
+        except (FieldDoesNotExist, AttributeError):
+            return True
+
+    def after(self, values, reverse):
+        condition, tied = Q(pk__in=[]), Q()
+        for key, value in zip(self.keys, values):
+            after = key.after(value, reverse)
+            if after is not None:
+                condition |= tied & after
+            tied &= key.equals(value)
+        return condition
+
+    # --- cursors ---
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            values, reverse = payload['v'], bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.keys):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_cursor(self, values, reverse):
+        payload = {'v': values}
+        if reverse:
+            payload['r'] = 1
+        raw = json.dumps(payload, cls=CursorEncoder, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.next_values is None:
+            return None
+        return self.encode_cursor(self.next_values, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_values is None:
+            return None
+        return self.encode_cursor(self.previous_values, reverse=True)
+
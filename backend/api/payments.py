@@ -0,0 +1,31 @@
+"""Payment writes in bulk.
+
+``release_payments`` moves many held payments to released with one
+``UPDATE``. That skips the ``post_save`` receivers in ``api.signals``, so the
+earnings rollups and escrow totals they keep are adjusted here, for the
+whole batch at once.
+"""
+from django.db import transaction
+from django.db.models import F
+
+from . import rollups, stats
+from .models import PaymentTransaction
+
+
+def release_payments(queryset):
+    """Release the held payments in ``queryset``; returns how many were released."""
+    with transaction.atomic():
+        rows = list(
+            queryset.filter(status='held').select_for_update(of=('self',))
+            .values('id', 'amount', provider_id=F('booking__service__provider_id'),
+                    booking_created_at=F('booking__created_at'))
+        )
+        if not rows:
+            return 0
+        released = PaymentTransaction.objects.filter(pk__in=[row['id'] for row in rows]).update(status='released')
+        rollups.payments_released(
+            (row['provider_id'], row['booking_created_at'], row['amount']) for row in rows
+        )
+        total = sum(row['amount'] for row in rows)
+        stats.payment_changed('held', total, 'released', total)
+    return released
@@ -0,0 +1,99 @@
+"""Running provider ratings.
+
+Every review write adjusts the provider's ``Profile`` in a single UPDATE:
+the rating sum and count, the 1-5 star histogram and the average in
+``Profile.rating``. ``rebuild`` recomputes them from the reviews in batches
+(``manage.py rebuild_ratings``).
+"""
+from collections import defaultdict
+
+from django.db.models import Avg, Case, Count, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from .models import Profile, Review
+
+STARS = range(1, 6)
+
+
+def adjust(provider_id, added=None, removed=None):
+    """Add the ``added`` rating and/or take away the ``removed`` one."""
+    sum_delta = (added or 0) - (removed or 0)
+    count_delta = (added is not None) - (removed is not None)
+    histogram = defaultdict(int)
+    if added in STARS:
+        histogram[f'rating_{added}'] += 1
+    if removed in STARS:
+        histogram[f'rating_{removed}'] -= 1
+    if not sum_delta and not count_delta and not any(histogram.values()):
+        return
+
+    new_count = F('rating_count') + count_delta
+    # ``rating`` comes first: MySQL evaluates SET clauses left to right with
+    # already-updated values, other backends all use the old row.
+    changes = {
+        'rating': Case(
+            When(rating_count__gt=-count_delta,
+                 then=Cast(F('rating_sum') + sum_delta, FloatField()) / new_count),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ),
+        'rating_sum': F('rating_sum') + sum_delta,
+        'rating_count': new_count,
+    }
+    changes.update({field: F(field) + delta for field, delta in histogram.items() if delta})
+    Profile.objects.filter(user_id=provider_id).update(**changes)
+
+
+def review_saved(review, created):
+    if created:
+        adjust(review.provider_id, added=review.rating)
+        return
+    old_rating = review.loaded_value('rating')
+    old_provider_id = review.loaded_value('provider_id')
+    if old_provider_id is not None and old_provider_id != review.provider_id:
+        # Moved to another provider: the rating goes with it.
+        adjust(old_provider_id, removed=review.rating if old_rating is None else old_rating)
+        adjust(review.provider_id, added=review.rating)
+    elif old_rating is not None and old_rating != review.rating:
+        adjust(review.provider_id, added=review.rating, removed=old_rating)
+
+
+def review_deleted(review):
+    rating = review.loaded_value('rating')
+    adjust(review.provider_id, removed=review.rating if rating is None else rating)
+
+
+def review_total(aggregate, **filters):
+    """Correlated subquery: ``aggregate`` over the profile owner's reviews, 0 without any."""
+    reviews = (
+        Review.objects.filter(provider_id=OuterRef('user_id'), **filters).order_by()
+        .values('provider_id').annotate(total=aggregate).values('total')
+    )
+    return Coalesce(Subquery(reviews), Value(0), output_field=IntegerField())
+
+
+def rebuild(batch_size=1000):
+    """Recompute every profile's rating figures; returns the number of profiles."""
+    changes = {
+        'rating': Coalesce(
+            Subquery(
+                Review.objects.filter(provider_id=OuterRef('user_id')).order_by()
+                .values('provider_id').annotate(average=Avg(Cast('rating', FloatField())))
+                .values('average')
+            ),
+            Value(0.0),
+        ),
+        'rating_sum': review_total(Sum('rating')),
+        'rating_count': review_total(Count('id')),
+    }
+    for stars in STARS:
+        changes[f'rating_{stars}'] = review_total(Count('id'), rating=stars)
+
+    updated, last_id = 0, 0
+    while True:
+        ids = list(Profile.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return updated
+        Profile.objects.filter(id__in=ids).update(**changes)
+        updated += len(ids)
+        last_id = ids[-1]
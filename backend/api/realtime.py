@@ -0,0 +1,62 @@
+"""Push events to connected WebSocket clients.
+
+Every authenticated socket joins its user's group on the channel layer
+(``settings.CHANNEL_LAYERS``); publishing an event fans it out to all of
+that user's open connections. Events are sent after the surrounding
+transaction commits so clients never see rows that were rolled back.
+"""
+import json
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger(__name__)
+
+
+def user_group(user_id):
+    return f'user.{user_id}'
+
+
+def publish(user_ids, event, data):
+    """Send ``{"type": event, "data": data}`` to every socket of ``user_ids`` on commit."""
+    # Round-trip through JSON so the payload only holds plain types that
+    # every channel layer can serialize.
+    data = json.loads(JSONRenderer().render(data))
+    message = {'type': 'event.push', 'event': event, 'data': data}
+    groups = {user_group(user_id) for user_id in user_ids}
+
+    def send():
+        layer = get_channel_layer()
+        if layer is None:
+            return
+        for group in groups:
+            try:
+                async_to_sync(layer.group_send)(group, message)
+            except Exception:
+                logger.exception('Failed to publish %s to %s', event, group)
+
+    transaction.on_commit(send)
+
+
+def publish_message(message):
+    from .serializers import MessageSerializer
+    publish([message.sender_id, message.recipient_id], 'message.created', MessageSerializer(message).data)
+
+
+def publish_booking(booking, event):
+    from .serializers import BookingSerializer
+    publish([booking.client_id, booking.service.provider_id], event, BookingSerializer(booking).data)
+
+
+def publish_bookings(booking_ids, event):
+    """``publish_booking`` for many bookings, serialized together."""
+    from .models import Booking
+    from .row_serializers import row_serializer
+    from .serializers import BookingSerializer
+    serializer = row_serializer(BookingSerializer)
+    rows = list(serializer.values(Booking.objects.filter(pk__in=booking_ids)))
+    for data in serializer.serialize(rows):
+        publish([data['client']['id'], data['service']['provider']['id']], event, data)
@@ -0,0 +1,68 @@
+"""JSON output: a faster renderer and streamed lists.
+
+``FastJSONRenderer`` (opted into with ``FAST_JSON_RENDERER``) encodes with
+orjson when it is installed. Decimals, datetimes and the other types orjson
+doesn't handle the way DRF does go through DRF's encoder, so the bytes match
+``JSONRenderer``'s. Without orjson, or when indented output is asked for, it
+is ``JSONRenderer``.
+
+``stream_json`` writes a list a batch at a time, for the streamed list
+responses (``?stream=true``) whose rows are never all in memory.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # the standard library encoder is used instead
+    orjson = None
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+ENCODER = encoders.JSONEncoder()
+# JSONRenderer escapes these so the output is also valid JavaScript.
+LINE_SEPARATORS = ((b'\xe2\x80\xa8', b'\\u2028'), (b'\xe2\x80\xa9', b'\\u2029'))
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def can_use_orjson():
+    return orjson is not None and api_settings.COMPACT_JSON and api_settings.UNICODE_JSON
+
+
+def encode(data):
+    """``data`` as the compact JSON ``JSONRenderer`` would produce."""
+    if can_use_orjson():
+        output = orjson.dumps(data, default=ENCODER.default, option=ORJSON_OPTIONS)
+    else:
+        output = json.dumps(
+            data, cls=encoders.JSONEncoder, ensure_ascii=not api_settings.UNICODE_JSON,
+            allow_nan=not api_settings.STRICT_JSON,
+            separators=(',', ':') if api_settings.COMPACT_JSON else (', ', ': '),
+        ).encode()
+    for character, escaped in LINE_SEPARATORS:
+        if character in output:
+            output = output.replace(character, escaped)
+    return output
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or not can_use_orjson():
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return encode(data)
+
+
+def stream_json(batches):
+    """Yield a JSON array of the items in ``batches`` (lists), one chunk per batch."""
+    yield b'['
+    separator = b''
+    for batch in batches:
+        if batch:
+            yield separator + b','.join(encode(item) for item in batch)
+            separator = b','
+    yield b']'
@@ -0,0 +1,72 @@
+"""Shared cache of anonymous list responses.
+
+Anonymous browsing of the service list repeats a handful of filter, search
+and ordering combinations, so their response data is kept in the
+``responses`` cache (``RESPONSE_CACHE_BACKEND``). An entry is keyed on the
+normalized query string and on the versions (see ``api.versions``) of the
+tables the response is built from; a write to any of them bumps its version,
+so later requests miss and the stale entries simply expire. A hit costs no
+query once the versions themselves are cached.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from . import versions
+
+CACHE_ALIAS = 'responses'
+
+
+def normalized_query(request):
+    """The query string with parameters (and repeated values) in a fixed order."""
+    return '&'.join(
+        f'{name}={value}'
+        for name, values in sorted(request.query_params.lists())
+        for value in sorted(values)
+    )
+
+
+def cache_key(request, tables):
+    table_versions = versions.current(tables)
+    # The host is part of the key because pagination links are absolute. The
+    # bump times keep counters that restarted (a restored or rolled back
+    # table) from matching old entries.
+    variant = '|'.join([
+        request.build_absolute_uri(request.path),
+        normalized_query(request),
+        *(f'{name}.{version}.{stamp}' for name, (version, stamp) in sorted(table_versions.items())),
+    ])
+    return 'response:' + hashlib.md5(variant.encode(), usedforsecurity=False).hexdigest()
+
+
+class AnonymousListCacheMixin:
+    """Serve ``list`` to anonymous users from the response cache.
+
+    ``cached_tables`` names every table whose rows appear in the output. A
+    view that overrides ``list`` wraps its own body with ``cached_list``.
+    Responses carry ``X-Cache: HIT`` or ``MISS``.
+    """
+    cached_tables = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_list(request, super().list, *args, **kwargs)
+
+    def cached_list(self, request, handler, *args, **kwargs):
+        if request.user.is_authenticated or not settings.RESPONSE_CACHE_SECONDS:
+            return handler(request, *args, **kwargs)
+
+        cache = caches[CACHE_ALIAS]
+        key = cache_key(request, self.cached_tables)
+        data = cache.get(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            cache.set(key, response.data, settings.RESPONSE_CACHE_SECONDS)
+        response['X-Cache'] = 'MISS'
+        return response
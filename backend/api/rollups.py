@@ -0,0 +1,280 @@
+"""Incrementally maintained provider dashboard rollups.
+
+``ProviderMonthlyStats`` holds one row per provider and month with booking
+counts by status, released earnings and review totals. The receivers in
+``api.signals`` apply the delta of every booking, payment and review write,
+so the provider dashboard is a single indexed read. ``rebuild`` recomputes
+rows from the source tables (``manage.py rebuild_provider_stats``).
+"""
+from collections import defaultdict
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from .models import (
+    BOOKING_STATUS, Booking, PaymentTransaction, ProviderMonthlyStats, Review, Service
+)
+
+STATUS_FIELDS = {status: f'bookings_{status}' for status, _ in BOOKING_STATUS}
+
+
+def month_of(value):
+    """First day of ``value``'s month in the current time zone (as TruncMonth does)."""
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date().replace(day=1)
+
+
+def month_start(month):
+    """The aware datetime TruncMonth would have returned for ``month``."""
+    value = datetime.combine(month, time.min)
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+def add(provider_id, month, **deltas):
+    """Add ``deltas`` to a provider's row for ``month``.
+
+    The row is only created for positive deltas: subtracting from a row that
+    doesn't exist means the data predates the rollups (run a rebuild), and
+    creating rows while a provider is being cascade-deleted would fail.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas or provider_id is None:
+        return
+    rows = ProviderMonthlyStats.objects.filter(provider_id=provider_id, month=month)
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if rows.update(**changes) or not any(delta > 0 for delta in deltas.values()):
+        return
+    try:
+        with transaction.atomic():
+            ProviderMonthlyStats.objects.create(provider_id=provider_id, month=month, **deltas)
+    except IntegrityError:
+        rows.update(**changes)
+
+
+def booking_context(booking_id):
+    """Return ``(provider_id, month)`` a booking's figures are filed under."""
+    row = Booking.objects.filter(pk=booking_id).values_list('service__provider_id', 'created_at').first()
+    if row is None:
+        return None, None
+    return row[0], month_of(row[1])
+
+
+def provider_of(booking):
+    if Booking.service.is_cached(booking):
+        return booking.service.provider_id
+    return Service.objects.filter(pk=booking.service_id).values_list('provider_id', flat=True).first()
+
+
+# --- bookings ---
+def booking_created(booking):
+    add(provider_of(booking), month_of(booking.created_at), **{STATUS_FIELDS[booking.status]: 1})
+    Service.objects.filter(pk=booking.service_id).update(booking_count=F('booking_count') + 1)
+
+
+def booking_status_changed(booking, old_status, new_status):
+    deltas = defaultdict(int)
+    if old_status in STATUS_FIELDS:
+        deltas[STATUS_FIELDS[old_status]] -= 1
+    deltas[STATUS_FIELDS[new_status]] += 1
+    add(provider_of(booking), month_of(booking.created_at), **deltas)
+
+
+def bookings_created(bookings):
+    """``booking_created`` for a batch written with ``bulk_create``."""
+    deltas = defaultdict(lambda: defaultdict(int))
+    per_service = defaultdict(int)
+    for booking in bookings:
+        deltas[provider_of(booking), month_of(booking.created_at)][STATUS_FIELDS[booking.status]] += 1
+        per_service[booking.service_id] += 1
+    for (provider_id, month), fields in deltas.items():
+        add(provider_id, month, **fields)
+    for service_id, n in per_service.items():
+        Service.objects.filter(pk=service_id).update(booking_count=F('booking_count') + n)
+
+
+def bookings_status_changed(changes):
+    """``booking_status_changed`` for a batch of ``(provider_id, created_at, old, new)``."""
+    deltas = defaultdict(lambda: defaultdict(int))
+    for provider_id, created_at, old_status, new_status in changes:
+        fields = deltas[provider_id, month_of(created_at)]
+        if old_status in STATUS_FIELDS:
+            fields[STATUS_FIELDS[old_status]] -= 1
+        fields[STATUS_FIELDS[new_status]] += 1
+    for (provider_id, month), fields in deltas.items():
+        add(provider_id, month, **fields)
+
+
+def booking_deleted(booking):
+    # The status counted is the one in the database, not unsaved edits.
+    status = booking.loaded_value('status') or booking.status
+    add(provider_of(booking), month_of(booking.created_at), **{STATUS_FIELDS[status]: -1})
+    Service.objects.filter(pk=booking.service_id, booking_count__gt=0).update(
+        booking_count=F('booking_count') - 1
+    )
+
+
+# --- payments ---
+def released_amount(status, amount):
+    return (amount or Decimal('0')) if status == 'released' else Decimal('0')
+
+
+def payment_saved(payment, created):
+    before = Decimal('0') if created else released_amount(
+        payment.loaded_value('status'), payment.loaded_value('amount')
+    )
+    delta = released_amount(payment.status, Decimal(payment.amount)) - before
+    if delta:
+        provider_id, month = booking_context(payment.booking_id)
+        add(provider_id, month, earnings=delta)
+
+
+def payments_released(payments):
+    """``payment_saved`` for a batch of ``(provider_id, booking created_at, amount)`` just released."""
+    earnings = defaultdict(Decimal)
+    for provider_id, created_at, amount in payments:
+        earnings[provider_id, month_of(created_at)] += amount
+    for (provider_id, month), amount in earnings.items():
+        add(provider_id, month, earnings=amount)
+
+
+def payment_deleted(payment):
+    delta = released_amount(payment.loaded_value('status'), payment.loaded_value('amount'))
+    if delta:
+        provider_id, month = booking_context(payment.booking_id)
+        add(provider_id, month, earnings=-delta)
+
+
+# --- reviews ---
+def review_saved(review, created):
+    if created:
+        add(review.provider_id, month_of(review.created_at), review_sum=review.rating, review_count=1)
+        return
+    month = month_of(review.created_at)
+    old_rating = review.loaded_value('rating')
+    old_provider_id = review.loaded_value('provider_id')
+    if old_provider_id is not None and old_provider_id != review.provider_id:
+        removed = review.rating if old_rating is None else old_rating
+        add(old_provider_id, month, review_sum=-removed, review_count=-1)
+        add(review.provider_id, month, review_sum=review.rating, review_count=1)
+    elif old_rating is not None and old_rating != review.rating:
+        add(review.provider_id, month, review_sum=review.rating - old_rating)
+
+
+def review_deleted(review):
+    rating = review.loaded_value('rating')
+    if rating is None:
+        rating = review.rating
+    add(review.provider_id, month_of(review.created_at), review_sum=-rating, review_count=-1)
+
+
+# --- reads ---
+def provider_dashboard(provider, year=None, month=None):
+    """The provider dashboard figures, read from the provider's rollup rows."""
+    rows = list(ProviderMonthlyStats.objects.filter(provider=provider).order_by('month'))
+    review_sum = sum(row.review_sum for row in rows)
+    review_count = sum(row.review_count for row in rows)
+
+    if year:
+        rows = [row for row in rows if row.month.year == year]
+    if month:
+        rows = [row for row in rows if row.month.month == month]
+
+    by_status = {
+        status: sum(getattr(row, field) for row in rows) for status, field in STATUS_FIELDS.items()
+    }
+    monthly = []
+    for row in rows:
+        count = sum(getattr(row, field) for field in STATUS_FIELDS.values())
+        if count:
+            monthly.append({'month': month_start(row.month), 'count': count})
+
+    services = Service.objects.filter(provider=provider)
+    return {
+        "total_services": services.count(),
+        "total_bookings": sum(by_status.values()),
+        "total_earnings": sum(row.earnings for row in rows) or 0,
+        "average_rating": review_sum / review_count if review_count else 0,
+        "booking_status_breakdown": [
+            {'status': status, 'count': count} for status, count in by_status.items() if count
+        ],
+        "top_services": list(
+            services.order_by('-booking_count', 'id')[:5].values('title', bookings=F('booking_count'))
+        ),
+        "monthly_chart_data": monthly,
+    }
+
+
+# --- repair ---
+def rebuild(provider_ids=None, batch_size=500):
+    """Recompute rollups (and ``Service.booking_count``) from scratch.
+
+    Works through providers in batches of ``batch_size``; returns how many
+    providers were processed.
+    """
+    if provider_ids is None:
+        provider_ids = (
+            Service.objects.order_by().values_list('provider_id', flat=True).distinct()
+            .union(Review.objects.order_by().values_list('provider_id', flat=True).distinct())
+            .union(ProviderMonthlyStats.objects.order_by().values_list('provider_id', flat=True).distinct())
+        )
+    provider_ids = sorted(set(provider_ids))
+    for start in range(0, len(provider_ids), batch_size):
+        with transaction.atomic():
+            rebuild_batch(provider_ids[start:start + batch_size])
+    return len(provider_ids)
+
+
+def rebuild_batch(provider_ids):
+    rows = defaultdict(lambda: defaultdict(int))
+
+    bookings = (
+        Booking.objects.filter(service__provider_id__in=provider_ids)
+        .annotate(bucket=TruncMonth('created_at'))
+        .values_list('service__provider_id', 'bucket', 'status')
+        .annotate(n=Count('id'))
+        .order_by()
+    )
+    for provider_id, bucket, status, n in bookings:
+        rows[provider_id, bucket.date()][STATUS_FIELDS[status]] += n
+
+    earnings = (
+        PaymentTransaction.objects.filter(
+            booking__service__provider_id__in=provider_ids, status='released'
+        )
+        .annotate(bucket=TruncMonth('booking__created_at'))
+        .values_list('booking__service__provider_id', 'bucket')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    for provider_id, bucket, total in earnings:
+        rows[provider_id, bucket.date()]['earnings'] += total
+
+    reviews = (
+        Review.objects.filter(provider_id__in=provider_ids)
+        .annotate(bucket=TruncMonth('created_at'))
+        .values_list('provider_id', 'bucket')
+        .annotate(total=Sum('rating'), n=Count('id'))
+        .order_by()
+    )
+    for provider_id, bucket, total, n in reviews:
+        rows[provider_id, bucket.date()]['review_sum'] += total
+        rows[provider_id, bucket.date()]['review_count'] += n
+
+    ProviderMonthlyStats.objects.filter(provider_id__in=provider_ids).delete()
+    ProviderMonthlyStats.objects.bulk_create([
+        ProviderMonthlyStats(provider_id=provider_id, month=month, **values)
+        for (provider_id, month), values in rows.items()
+    ])
+
+    counts = (
+        Booking.objects.filter(service=OuterRef('pk')).order_by()
+        .values('service').annotate(n=Count('id')).values('n')
+    )
+    Service.objects.filter(provider_id__in=provider_ids).update(
+        booking_count=Coalesce(Subquery(counts), Value(0))
+    )
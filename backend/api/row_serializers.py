@@ -0,0 +1,294 @@
+"""Read-only list output built straight from ``.values()`` rows.
+
+A ``RowSerializer`` compiles a DRF serializer class once into flat field
+mappers, each reading one slot (column) of a ``.values()`` row:
+
+* model fields are copied, or passed through the DRF field's own
+  ``to_representation`` when it formats them (decimals, datetimes);
+* nested to-one serializers read the joined ``<source>__`` columns of the
+  same row;
+* nested ``many=True`` serializers over a forward many-to-many are fetched
+  with one query on the through table per page;
+* ``SerializerMethodField`` methods get a ``RowObject``, so annotations
+  (``distance_km``) read as attributes.
+
+The output matches the serializer's, key for key, without instantiating
+models or serializers per row. Write-only fields are skipped; other field
+kinds raise ``ImproperlyConfigured`` when compiled.
+"""
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db.models import F, ManyToManyField, OrderBy
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from . import metrics, renderers
+
+# Fields whose representation of a database value is the value itself.
+PASSTHROUGH_FIELDS = (
+    serializers.BooleanField, serializers.CharField, serializers.ChoiceField,
+    serializers.IntegerField, serializers.PrimaryKeyRelatedField,
+)
+
+
+class RowObject:
+    """Attribute access to the ``prefix`` columns of a row, for method fields."""
+    __slots__ = ('row', 'prefix')
+
+    def __init__(self, row, prefix):
+        self.row = row
+        self.prefix = prefix
+
+    def __getattr__(self, name):
+        try:
+            return self.row[self.prefix + name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class Column:
+    __slots__ = ('key', 'column', 'convert')
+
+    def __init__(self, key, column, convert=None):
+        self.key = key
+        self.column = column
+        self.convert = convert
+
+    def read(self, row, context):
+        value = row[self.column]
+        if value is None or self.convert is None:
+            return value
+        return self.convert(value)
+
+
+class DateTimeColumn(Column):
+    """An ISO 8601 ``DateTimeField``; the timezone is looked up once per call, not per row."""
+    __slots__ = ('timezone',)
+
+    def __init__(self, key, column, field):
+        super().__init__(key, column, field.to_representation)
+        self.timezone = getattr(field, 'timezone', None)
+
+    def read(self, row, context):
+        value = row[self.column]
+        if not value:
+            return None
+        tz = self.timezone or context['timezone']
+        if tz is None or timezone.is_naive(value):
+            return self.convert(value)
+        value = value.astimezone(tz).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+class Nested:
+    """A to-one nested serializer; ``None`` when the joined row is missing."""
+    __slots__ = ('key', 'column', 'mapper')
+
+    def __init__(self, key, column, mapper):
+        self.key = key
+        self.column = column
+        self.mapper = mapper
+
+    def read(self, row, context):
+        if row[self.column] is None:
+            return None
+        return self.mapper.build(row, context)
+
+
+class NestedMany:
+    """A ``many=True`` nested serializer over a forward many-to-many field."""
+    __slots__ = ('key', 'column', 'mapper', 'through', 'source', 'ordering')
+
+    def __init__(self, key, column, mapper, through, source, ordering):
+        self.key = key
+        self.column = column
+        self.mapper = mapper
+        self.through = through
+        self.source = source
+        self.ordering = ordering
+
+    def read(self, row, context):
+        return list(context[self].get(row[self.column], ()))
+
+    def fetch(self, ids):
+        """``{parent id: [child output]}`` for the parents in ``ids``."""
+        rows = list(
+            self.through.objects.filter(**{f'{self.source}__in': ids})
+            .order_by(*self.ordering)
+            .values(self.source, *self.mapper.columns)
+        )
+        context = self.mapper.prepare(rows)
+        children = {}
+        for row in rows:
+            children.setdefault(row[self.source], []).append(self.mapper.build(row, context))
+        return children
+
+
+class Method:
+    __slots__ = ('key', 'method', 'prefix')
+
+    def __init__(self, key, method, prefix):
+        self.key = key
+        self.method = method
+        self.prefix = prefix
+
+    def read(self, row, context):
+        return self.method(RowObject(row, self.prefix))
+
+
+class RowSerializer:
+    """``serializer_class``'s read output for rows of ``values(*columns)``."""
+
+    def __init__(self, serializer_class, prefix=''):
+        serializer = serializer_class()
+        self.model = serializer.Meta.model
+        self.prefix = prefix
+        self.columns = []
+        self.mappers = []
+        # Many-to-many fields at this level or in nested to-one serializers.
+        self.many = []
+        for field in serializer.fields.values():
+            if not field.write_only:
+                self.mappers.append(self.compile(serializer, field))
+
+    def compile(self, serializer, field):
+        key, source, opts = field.field_name, field.source, self.model._meta
+        if isinstance(field, serializers.SerializerMethodField):
+            return Method(key, getattr(serializer, field.method_name), self.prefix)
+        try:
+            model_field = opts.get_field(source)
+        except FieldDoesNotExist:
+            raise ImproperlyConfigured(f'{type(serializer).__name__}.{key}: no model field {source!r}.')
+
+        if isinstance(field, serializers.ListSerializer):
+            if not isinstance(model_field, ManyToManyField):
+                raise ImproperlyConfigured(f'{type(serializer).__name__}.{key}: only forward many-to-many is supported.')
+            through = model_field.remote_field.through
+            target = model_field.m2m_reverse_field_name()
+            mapper = RowSerializer(type(field.child), prefix=f'{target}__')
+            ordering = [
+                f'-{target}__{name[1:]}' if name.startswith('-') else f'{target}__{name}'
+                for name in mapper.model._meta.ordering or ['pk']
+            ]
+            many = NestedMany(
+                key, self.column(opts.pk.attname), mapper,
+                through, f'{model_field.m2m_field_name()}_id', ordering,
+            )
+            self.many.append(many)
+            return many
+
+        if isinstance(field, serializers.BaseSerializer):
+            mapper = RowSerializer(type(field), prefix=f'{self.prefix}{source}__')
+            self.columns.extend(mapper.columns)
+            self.many.extend(mapper.many)
+            pk_column = f'{mapper.prefix}{mapper.model._meta.pk.attname}'
+            if pk_column not in self.columns:
+                self.columns.append(pk_column)
+            return Nested(key, pk_column, mapper)
+
+        if isinstance(field, serializers.RelatedField):
+            if not isinstance(field, serializers.PrimaryKeyRelatedField):
+                raise ImproperlyConfigured(f'{type(serializer).__name__}.{key}: only primary keys are supported.')
+            return Column(key, self.column(model_field.attname))
+        if isinstance(field, PASSTHROUGH_FIELDS):
+            return Column(key, self.column(source))
+        if isinstance(field, serializers.DateTimeField) and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601:
+            return DateTimeColumn(key, self.column(source), field)
+        return Column(key, self.column(source), field.to_representation)
+
+    def column(self, name):
+        column = self.prefix + name
+        if column not in self.columns:
+            self.columns.append(column)
+        return column
+
+    def values(self, queryset):
+        """``queryset`` as the rows this serializer reads.
+
+        Annotations and ordering columns are kept for method fields and the
+        keyset paginator.
+        """
+        extra = list(queryset.query.annotations)
+        for term in queryset.query.order_by:
+            if isinstance(term, OrderBy) and isinstance(term.expression, F):
+                extra.append(term.expression.name)
+            elif isinstance(term, str) and term != '?':
+                extra.append(term.lstrip('-'))
+        columns = self.columns + [name for name in extra if name not in self.columns and name != 'pk']
+        return queryset.prefetch_related(None).values(*columns)
+
+    def prepare(self, rows):
+        """What ``build`` needs besides the row: the many-to-many children of
+        ``rows`` (keyed by field) and the timezone datetimes are shown in."""
+        context = {'timezone': timezone.get_current_timezone() if settings.USE_TZ else None}
+        for many in self.many:
+            ids = {row[many.column] for row in rows} - {None}
+            context[many] = many.fetch(ids) if ids else {}
+        return context
+
+    def build(self, row, context):
+        return {mapper.key: mapper.read(row, context) for mapper in self.mappers}
+
+    def serialize(self, rows):
+        """The output for ``rows``: one query per many-to-many field, none per row."""
+        context = self.prepare(rows)
+        return [self.build(row, context) for row in rows]
+
+
+_compiled = {}
+
+
+def row_serializer(serializer_class):
+    """The compiled ``RowSerializer`` for ``serializer_class`` (compiled once)."""
+    compiled = _compiled.get(serializer_class)
+    if compiled is None:
+        compiled = _compiled[serializer_class] = RowSerializer(serializer_class)
+    return compiled
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+class RowListMixin:
+    """``list`` from ``.values()`` rows through the view's compiled serializer.
+
+    With ``?stream=true`` the whole list is streamed as a JSON array instead
+    of paginated, ``STREAM_BATCH_SIZE`` rows at a time.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.list_rows(self.filter_queryset(self.get_queryset()))
+
+    def list_rows(self, queryset):
+        serializer = row_serializer(self.get_serializer_class())
+        if self.request.query_params.get('stream', '').lower() in ('1', 'true', 'yes'):
+            return self.stream_rows(serializer, queryset)
+        rows = serializer.values(queryset)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            page = list(rows)
+
+        started = time.perf_counter()
+        data = serializer.serialize(page)
+        request_metrics = metrics.current.get()
+        if request_metrics is not None:
+            request_metrics.serializer_seconds += time.perf_counter() - started
+
+        if self.paginator is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def stream_rows(self, serializer, queryset):
+        size = settings.STREAM_BATCH_SIZE
+        rows = serializer.values(queryset).iterator(chunk_size=size)
+        chunks = renderers.stream_json(serializer.serialize(batch) for batch in batches(rows, size))
+        return StreamingHttpResponse(chunks, content_type='application/json')
@@ -0,0 +1,255 @@
+"""Ranked full-text search over services.
+
+Active services are indexed on title, description, skill names and category
+names in a table that lives outside the ORM:
+
+* SQLite uses an FTS5 virtual table ranked with bm25.
+* PostgreSQL uses a weighted ``tsvector`` table with a GIN index ranked with
+  ``ts_rank_cd``.
+* Any other backend falls back to ``icontains`` matching (unranked).
+
+The index is kept current by the receivers in ``api.signals`` and can be
+rebuilt from scratch with ``manage.py rebuild_search_index``.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, FloatField, Q, Value, When
+
+from .models import Service
+
+SEARCH_TABLE = 'api_service_search'
+
+# Relative weight of each indexed column: title, description, skills, categories.
+COLUMN_WEIGHTS = (10.0, 1.0, 5.0, 3.0)
+
+MAX_TERMS = 10
+
+
+def search_terms(query):
+    """Split raw user input into at most ``MAX_TERMS`` lowercase word tokens."""
+    return re.findall(r'\w+', (query or '').lower())[:MAX_TERMS]
+
+
+def build_documents(service_ids):
+    """Return ``{id: (title, description, skills, categories)}`` for active services."""
+    docs = {}
+    services = Service.objects.filter(pk__in=service_ids, is_active=True)
+    for pk, title, description in services.values_list('id', 'title', 'description'):
+        docs[pk] = [title, description, [], []]
+
+    through = Service.skills.through.objects.filter(service_id__in=list(docs))
+    for service_id, skill, category in through.values_list(
+        'service_id', 'skill__name', 'skill__category__name'
+    ):
+        docs[service_id][2].append(skill)
+        docs[service_id][3].append(category)
+
+    return {
+        pk: (title, description, ' '.join(skills), ' '.join(sorted(set(categories))))
+        for pk, (title, description, skills, categories) in docs.items()
+    }
+
+
+class SearchBackend:
+    """Index maintenance and ranked lookups for one database vendor."""
+
+    def create_index(self, cursor):
+        pass
+
+    def drop_index(self, cursor):
+        pass
+
+    def delete(self, cursor, service_ids):
+        pass
+
+    def insert(self, cursor, documents):
+        pass
+
+    def ranked_ids(self, cursor, terms, limit):
+        """Return ``[(service_id, score)]`` best first; higher scores rank higher."""
+        raise NotImplementedError
+
+    def apply(self, queryset, terms):
+        limit = getattr(settings, 'SEARCH_MAX_RESULTS', 500)
+        with connection.cursor() as cursor:
+            ranked = self.ranked_ids(cursor, terms, limit)
+        if not ranked:
+            return queryset.none()
+        rank = Case(
+            *[When(pk=pk, then=Value(score)) for pk, score in ranked],
+            output_field=FloatField(),
+        )
+        return (
+            queryset.filter(pk__in=[pk for pk, _ in ranked])
+            .annotate(search_rank=rank)
+            .order_by('-search_rank', '-id')
+        )
+
+
+class SQLiteSearchBackend(SearchBackend):
+    def create_index(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "title, description, skills, categories, tokenize='porter unicode61')"
+        )
+        weights = ', '.join(str(w) for w in COLUMN_WEIGHTS)
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rank) VALUES ('rank', %s)",
+            [f'bm25({weights})'],
+        )
+
+    def drop_index(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def delete(self, cursor, service_ids):
+        cursor.executemany(
+            f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(pk,) for pk in service_ids]
+        )
+
+    def insert(self, cursor, documents):
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE}(rowid, title, description, skills, categories) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            [(pk, *doc) for pk, doc in documents.items()],
+        )
+
+    def ranked_ids(self, cursor, terms, limit):
+        # Quote every term so user input can't inject FTS5 query syntax, and
+        # prefix-match it so results show up while the user is still typing.
+        match = ' '.join(f'"{term}"*' for term in terms)
+        cursor.execute(
+            f"SELECT rowid, rank FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+            "ORDER BY rank LIMIT %s",
+            [match, limit],
+        )
+        # bm25 scores are negative with the best match lowest.
+        return [(pk, -rank) for pk, rank in cursor.fetchall()]
+
+
+class PostgreSQLSearchBackend(SearchBackend):
+    DOCUMENT = (
+        "setweight(to_tsvector('english', %s), 'A') || "
+        "setweight(to_tsvector('english', %s), 'D') || "
+        "setweight(to_tsvector('english', %s), 'B') || "
+        "setweight(to_tsvector('english', %s), 'C')"
+    )
+
+    def create_index(self, cursor):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            "service_id bigint PRIMARY KEY REFERENCES api_service(id) ON DELETE CASCADE, "
+            "document tsvector NOT NULL)"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx "
+            f"ON {SEARCH_TABLE} USING GIN (document)"
+        )
+
+    def drop_index(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def delete(self, cursor, service_ids):
+        cursor.execute(
+            f"DELETE FROM {SEARCH_TABLE} WHERE service_id = ANY(%s)", [list(service_ids)]
+        )
+
+    def insert(self, cursor, documents):
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (service_id, document) VALUES (%s, {self.DOCUMENT}) "
+            "ON CONFLICT (service_id) DO UPDATE SET document = EXCLUDED.document",
+            [(pk, *doc) for pk, doc in documents.items()],
+        )
+
+    def ranked_ids(self, cursor, terms, limit):
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        cursor.execute(
+            f"SELECT service_id, ts_rank_cd(document, query) AS score "
+            f"FROM {SEARCH_TABLE}, to_tsquery('english', %s) query "
+            "WHERE document @@ query ORDER BY score DESC LIMIT %s",
+            [tsquery, limit],
+        )
+        return cursor.fetchall()
+
+
+class FallbackSearchBackend(SearchBackend):
+    """No index at all; every term must appear in one of the searched fields."""
+
+    def apply(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(
+                Q(title__icontains=term)
+                | Q(description__icontains=term)
+                | Q(skills__name__icontains=term)
+                | Q(skills__category__name__icontains=term)
+            )
+        return queryset.distinct()
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgreSQLSearchBackend,
+}
+
+
+def get_backend():
+    return BACKENDS.get(connection.vendor, FallbackSearchBackend)()
+
+
+def create_index():
+    with connection.cursor() as cursor:
+        get_backend().create_index(cursor)
+
+
+def index_services(service_ids):
+    """(Re)index the given services; inactive or missing ones are removed."""
+    service_ids = list(service_ids)
+    if not service_ids:
+        return
+    backend = get_backend()
+    documents = build_documents(service_ids)
+    with connection.cursor() as cursor:
+        backend.delete(cursor, service_ids)
+        backend.insert(cursor, documents)
+
+
+def remove_services(service_ids):
+    service_ids = list(service_ids)
+    if service_ids:
+        with connection.cursor() as cursor:
+            get_backend().delete(cursor, service_ids)
+
+
+def rebuild_index(batch_size=1000):
+    """Drop and repopulate the whole index; returns the number of services indexed."""
+    backend = get_backend()
+    with connection.cursor() as cursor:
+        backend.drop_index(cursor)
+        backend.create_index(cursor)
+
+    indexed, last_id = 0, 0
+    active = Service.objects.filter(is_active=True).order_by('id')
+    while True:
+        ids = list(active.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return indexed
+        with connection.cursor() as cursor:
+            backend.insert(cursor, build_documents(ids))
+        indexed += len(ids)
+        last_id = ids[-1]
+
+
+def search_services(queryset, query):
+    """Restrict ``queryset`` to services matching ``query``, best match first."""
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+    return get_backend().apply(queryset, terms)
+
+
+def services_for_skills(skill_ids):
+    """Ids of services tagged with any of ``skill_ids``."""
+    through = Service.skills.through.objects.filter(skill_id__in=skill_ids)
+    return set(through.values_list('service_id', flat=True))
+
@@ -2,7 +2,8 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import (
     Profile, Skill, Category, Service, Booking,
-    Review, TrustBadge, Message, PaymentTransaction, EscrowTransaction, Location
+    Review, TrustBadge, Message, PaymentTransaction, EscrowTransaction, Location,
+    ConversationThread
 )
 
 User = get_user_model()
@@ -41,13 +42,16 @@ class UserSerializer(serializers.ModelSerializer):
 class ProfileSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     skills = serializers.PrimaryKeyRelatedField(queryset=Skill.objects.all(), many=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
 
     class Meta:
         model = Profile
         fields = [
             'id', 'user', 'bio', 'languages',
-            'hourly_rate', 'skills', 'rating', 'profile_picture'
+            'hourly_rate', 'skills', 'rating', 'rating_count',
+            'rating_histogram', 'profile_picture'
         ]
+        read_only_fields = ['rating']
 
 
 # --- 3. CategorySerializer ---
@@ -76,15 +80,22 @@ class ServiceSerializer(serializers.ModelSerializer):
     skill_ids = serializers.PrimaryKeyRelatedField(
         queryset=Skill.objects.all(), many=True, write_only=True, source='skills'
     )
+    distance_km = serializers.SerializerMethodField()
 
     class Meta:
         model = Service
         fields = [
             'id', 'provider', 'title', 'description',
             'service_type', 'payment_type', 'price',
-            'is_active', 'created_at', 'skills', 'skill_ids'
+            'is_active', 'created_at', 'skills', 'skill_ids',
+            'location', 'distance_km'
         ]
 
+    def get_distance_km(self, obj):
+        # Only present when the list was filtered by ?lat=&lng=
+        distance = getattr(obj, 'distance_km', None)
+        return round(distance, 3) if distance is not None else None
+
 
 # --- 6. BookingSerializer ---
 class BookingSerializer(serializers.ModelSerializer):
@@ -99,8 +110,31 @@ class BookingSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'client', 'service', 'service_id',
             'status', 'scheduled_date', 'message', 'location',
-            'agreed_price', 'is_barter', 'barter_offer', 'created_at'
+            'agreed_price', 'is_barter', 'barter_offer', 'created_at', 'version'
         ]
+        # Status changes go through the transition actions (``api.bookings``).
+        read_only_fields = ['status']
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.instance is not None:
+            # A booking stays with its service: the provider rollups count it,
+            # and its payments, under that service's provider.
+            fields['service_id'].read_only = True
+        return fields
+
+    def update(self, instance, validated_data):
+        # Write only the fields sent, so an edit can't put back a status that
+        # a concurrent transition has since changed.
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
+
+
+class BulkBookingSerializer(BookingSerializer):
+    """One item of a bulk create: services are looked up for the whole batch."""
+    service_id = serializers.IntegerField(write_only=True)
 
 
 # --- 7. ReviewSerializer ---
@@ -146,6 +180,27 @@ class MessageSerializer(serializers.ModelSerializer):
             'text', 'audio_note', 'created_at'
         ]
 
+# --- 9b. ConversationSerializer ---
+class MessagePreviewSerializer(serializers.ModelSerializer):
+    PREVIEW_LENGTH = 100
+    text = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Message
+        fields = ['id', 'sender_id', 'text', 'created_at']
+
+    def get_text(self, obj):
+        return obj.text[:self.PREVIEW_LENGTH]
+
+
+class ConversationSerializer(serializers.ModelSerializer):
+    counterpart = UserSerializer(read_only=True)
+    last_message = MessagePreviewSerializer(read_only=True)
+
+    class Meta:
+        model = ConversationThread
+        fields = ['id', 'counterpart', 'last_message', 'last_message_at', 'unread_count']
+
 # --- 10. PaymentTransactionSerializer ---
 class PaymentTransactionSerializer(serializers.ModelSerializer):
     booking = BookingSerializer(read_only=True)
@@ -1,19 +1,205 @@
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from django.utils import timezone
-from .models import EscrowTransaction, User, Profile
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed, post_migrate
+from django.dispatch import Signal, receiver
+from .models import (
+    User, Profile, Service, Skill, Category, Location, Booking, Message,
+    PaymentTransaction, Review
+)
+from . import ratings, realtime, rollups, search, stats, versions
+from .serializers import UserSerializer
 
+# Sent with ``booking``, ``old_status`` and ``new_status`` whenever a booking's
+# status changes, however the change was written.
+booking_status_changed = Signal()
 
 
-@receiver(post_save, sender=EscrowTransaction)
-def auto_release_escrow(sender, instance, **kwargs):
-    if not instance.released and instance.released_at and timezone.now() >= instance.released_at:
-        """Automatically release funds if the escrow is marked as released."""
-        instance.status = 'released'
-        instance.released = True
-        instance.save()
 
 @receiver(post_save, sender=User)
 def create_profile_for_new_user(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
+
+
+# --- Service search index ---
+@receiver(post_migrate)
+def create_search_index(sender, using, **kwargs):
+    if sender.name == 'api':
+        search.create_index()
+
+@receiver(post_save, sender=Service)
+def index_service(sender, instance, **kwargs):
+    search.index_services([instance.pk])
+
+@receiver(post_delete, sender=Service)
+def unindex_service(sender, instance, **kwargs):
+    search.remove_services([instance.pk])
+
+@receiver(m2m_changed, sender=Service.skills.through)
+def reindex_service_skills(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if action == 'pre_clear':
+        # skill.service_set.clear(): the affected services are gone by post_clear.
+        if reverse:
+            instance._search_service_ids = search.services_for_skills([instance.pk])
+    elif not reverse:
+        search.index_services([instance.pk])
+    elif action == 'post_clear':
+        search.index_services(getattr(instance, '_search_service_ids', ()))
+    else:
+        search.index_services(pk_set)
+
+@receiver(post_save, sender=Skill)
+def reindex_skill_services(sender, instance, created, **kwargs):
+    if not created:
+        search.index_services(search.services_for_skills([instance.pk]))
+
+@receiver(post_save, sender=Category)
+def reindex_category_services(sender, instance, created, **kwargs):
+    if not created:
+        skill_ids = instance.skill_set.values_list('id', flat=True)
+        search.index_services(search.services_for_skills(skill_ids))
+
+@receiver(pre_delete, sender=Skill)
+def reindex_after_skill_delete(sender, instance, **kwargs):
+    # The through rows disappear with the skill, so collect the services now
+    # and reindex them once the delete has been committed.
+    service_ids = search.services_for_skills([instance.pk])
+    if service_ids:
+        transaction.on_commit(lambda: search.index_services(service_ids))
+
+
+# --- Table versions (catalog ETags, cached anonymous service lists) ---
+# The provider fields shown with every service.
+PROVIDER_FIELDS = frozenset(UserSerializer.Meta.fields)
+
+@receiver([post_save, post_delete], sender=Service)
+def bump_service_version(sender, **kwargs):
+    versions.bump('service')
+
+@receiver(m2m_changed, sender=Service.skills.through)
+def bump_service_skills_version(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        versions.bump('service')
+
+@receiver(post_save, sender=User)
+def bump_provider_version(sender, instance, created, update_fields=None, **kwargs):
+    # Logins only touch last_login, and users without services aren't listed.
+    if created or (update_fields and not PROVIDER_FIELDS.intersection(update_fields)):
+        return
+    if Service.objects.filter(provider=instance).exists():
+        versions.bump('service')
+
+@receiver([post_save, post_delete], sender=Skill)
+def bump_skill_version(sender, **kwargs):
+    versions.bump('skill')
+
+@receiver([post_save, post_delete], sender=Category)
+def bump_category_version(sender, **kwargs):
+    # Skills are listed with their category's name.
+    versions.bump('category', 'skill')
+
+@receiver([post_save, post_delete], sender=Location)
+def bump_location_version(sender, **kwargs):
+    versions.bump('location')
+
+
+# --- Real-time events ---
+@receiver(post_save, sender=Message)
+def push_new_message(sender, instance, created, **kwargs):
+    if created:
+        realtime.publish_message(instance)
+
+@receiver(post_save, sender=Booking)
+def detect_booking_status_change(sender, instance, created, **kwargs):
+    old_status = instance.loaded_value('status')
+    instance.remember_loaded_values()
+    if created:
+        rollups.booking_created(instance)
+        realtime.publish_booking(instance, 'booking.created')
+    elif old_status != instance.status:
+        booking_status_changed.send(
+            sender=Booking, booking=instance, old_status=old_status, new_status=instance.status
+        )
+
+@receiver(booking_status_changed)
+def push_booking_status(sender, booking, **kwargs):
+    realtime.publish_booking(booking, 'booking.status_changed')
+
+
+# --- Provider dashboard rollups ---
+@receiver(booking_status_changed)
+def roll_up_booking_status(sender, booking, old_status, new_status, **kwargs):
+    rollups.booking_status_changed(booking, old_status, new_status)
+
+@receiver(post_delete, sender=Booking)
+def roll_up_booking_delete(sender, instance, **kwargs):
+    rollups.booking_deleted(instance)
+
+@receiver(post_save, sender=PaymentTransaction)
+def payment_saved(sender, instance, created, **kwargs):
+    rollups.payment_saved(instance, created)
+    if created:
+        stats.payment_changed(None, None, instance.status, instance.amount)
+    else:
+        stats.payment_changed(
+            instance.loaded_value('status'), instance.loaded_value('amount'),
+            instance.status, instance.amount,
+        )
+    instance.remember_loaded_values()
+
+@receiver(post_delete, sender=PaymentTransaction)
+def payment_deleted(sender, instance, **kwargs):
+    rollups.payment_deleted(instance)
+    stats.payment_changed(instance.loaded_value('status'), instance.loaded_value('amount'), None, None)
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    rollups.review_saved(instance, created)
+    ratings.review_saved(instance, created)
+    instance.remember_loaded_values()
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    rollups.review_deleted(instance)
+    ratings.review_deleted(instance)
+
+
+# --- Platform counters ---
+@receiver(post_save, sender=User)
+def count_user(sender, instance, created, **kwargs):
+    if created:
+        stats.increment('total_users', 1)
+        stats.increment('total_providers', int(instance.is_provider))
+    elif instance.loaded_value('is_provider') is not None:
+        stats.increment('total_providers', int(instance.is_provider) - int(instance.loaded_value('is_provider')))
+    instance.remember_loaded_values()
+
+@receiver(post_delete, sender=User)
+def uncount_user(sender, instance, **kwargs):
+    was_provider = instance.loaded_value('is_provider')
+    stats.increment('total_users', -1)
+    stats.increment('total_providers', -int(instance.is_provider if was_provider is None else was_provider))
+
+@receiver(post_save, sender=Service)
+def count_service(sender, instance, created, **kwargs):
+    old_provider_id = instance.loaded_value('provider_id')
+    if created:
+        stats.add_services(instance.provider_id, 1)
+    elif old_provider_id is not None and old_provider_id != instance.provider_id:
+        stats.add_services(old_provider_id, -1)
+        stats.add_services(instance.provider_id, 1)
+    instance.remember_loaded_values()
+
+@receiver(post_delete, sender=Service)
+def uncount_service(sender, instance, **kwargs):
+    stats.add_services(instance.provider_id, -1)
+
+@receiver(post_save, sender=Booking)
+def count_booking(sender, instance, created, **kwargs):
+    if created:
+        stats.increment('total_bookings', 1)
+
+@receiver(post_delete, sender=Booking)
+def uncount_booking(sender, instance, **kwargs):
+    stats.increment('total_bookings', -1)
@@ -0,0 +1,107 @@
+"""Maintained platform counters and the provider leaderboard.
+
+The admin dashboard used to count and sum whole tables on every hit. The
+totals now live in sharded ``PlatformCounter`` rows adjusted by the
+receivers in ``api.signals``, the leaderboard reads the indexed
+``User.service_count`` column, and the assembled payload is cached for
+``ADMIN_DASHBOARD_CACHE_SECONDS``. ``rebuild`` recounts everything
+(``manage.py rebuild_platform_stats``).
+"""
+import random
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Booking, PaymentTransaction, PlatformCounter, Service, User
+
+CACHE_KEY = 'stats:admin-dashboard'
+
+COUNT_COUNTERS = ('total_users', 'total_providers', 'total_services', 'total_bookings')
+AMOUNT_COUNTERS = {'held': 'escrow_held', 'released': 'escrow_released'}
+
+
+def increment(name, delta):
+    if not delta:
+        return
+    shard = random.randrange(settings.PLATFORM_COUNTER_SHARDS)
+    rows = PlatformCounter.objects.filter(name=name, shard=shard)
+    if rows.update(value=F('value') + delta):
+        return
+    try:
+        with transaction.atomic():
+            PlatformCounter.objects.create(name=name, shard=shard, value=delta)
+    except IntegrityError:
+        rows.update(value=F('value') + delta)
+
+
+def add_services(provider_id, delta):
+    increment('total_services', delta)
+    if provider_id is not None:
+        User.objects.filter(pk=provider_id).update(service_count=F('service_count') + delta)
+
+
+def payment_changed(old_status, old_amount, new_status, new_amount):
+    """Move an amount between the held/released totals as a payment changes."""
+    if old_status in AMOUNT_COUNTERS and old_amount is not None:
+        increment(AMOUNT_COUNTERS[old_status], -Decimal(old_amount))
+    if new_status in AMOUNT_COUNTERS and new_amount is not None:
+        increment(AMOUNT_COUNTERS[new_status], Decimal(new_amount))
+
+
+def counters():
+    totals = dict(
+        PlatformCounter.objects.values_list('name').annotate(total=Sum('value')).order_by()
+    )
+    data = {name: int(totals.get(name, 0)) for name in COUNT_COUNTERS}
+    for name in AMOUNT_COUNTERS.values():
+        data[name] = totals.get(name) or 0
+    return data
+
+
+def top_providers(limit=5):
+    return list(
+        User.objects.filter(is_provider=True)
+        .order_by('-service_count', 'id')[:limit]
+        .values('username', num_services=F('service_count'))
+    )
+
+
+def admin_dashboard():
+    """The admin dashboard payload, at most ``ADMIN_DASHBOARD_CACHE_SECONDS`` stale."""
+    data = cache.get(CACHE_KEY)
+    if data is None:
+        data = counters()
+        data['top_providers'] = top_providers()
+        cache.set(CACHE_KEY, data, settings.ADMIN_DASHBOARD_CACHE_SECONDS)
+    return data
+
+
+@transaction.atomic
+def rebuild():
+    """Recount every counter and ``User.service_count`` from the source tables."""
+    totals = {
+        'total_users': User.objects.count(),
+        'total_providers': User.objects.filter(is_provider=True).count(),
+        'total_services': Service.objects.count(),
+        'total_bookings': Booking.objects.count(),
+    }
+    for status, name in AMOUNT_COUNTERS.items():
+        totals[name] = (
+            PaymentTransaction.objects.filter(status=status).aggregate(total=Sum('amount'))['total'] or 0
+        )
+    PlatformCounter.objects.all().delete()
+    PlatformCounter.objects.bulk_create([
+        PlatformCounter(name=name, shard=0, value=value) for name, value in totals.items()
+    ])
+
+    service_counts = (
+        Service.objects.filter(provider=OuterRef('pk')).order_by()
+        .values('provider').annotate(n=Count('id')).values('n')
+    )
+    User.objects.update(service_count=Coalesce(Subquery(service_counts), Value(0)))
+    cache.delete(CACHE_KEY)
+    return totals
@@ -0,0 +1,146 @@
+"""Celery tasks, picked up by ``skillswap.celery``'s autodiscovery.
+
+Run a worker with beat (``celery -A skillswap worker -B``) to get the
+periodic tasks in ``CELERY_BEAT_SCHEDULE``.
+"""
+import logging
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import EscrowTransaction, IdempotencyKey, OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+def release_due_batch(now, batch_size):
+    """Release up to ``batch_size`` escrows due at ``now``; returns how many.
+
+    The due rows are locked, skipping rows another worker already holds, and
+    the update re-checks ``status`` so an escrow is released exactly once
+    even on backends without row locks.
+    """
+    with transaction.atomic():
+        due = (
+            EscrowTransaction.objects
+            .filter(status='pending', disputed=False, released_at__lte=now)
+            .order_by('released_at', 'id')
+            .select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+        )
+        ids = list(due.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return 0
+        return EscrowTransaction.objects.filter(pk__in=ids, status='pending').update(
+            status='released', released=True
+        )
+
+
+@shared_task
+def release_due_escrows(batch_size=None, max_batches=100):
+    """Release every pending escrow whose ``released_at`` has passed."""
+    batch_size = batch_size or settings.ESCROW_RELEASE_BATCH_SIZE
+    now = timezone.now()
+    released = 0
+    for _ in range(max_batches):
+        count = release_due_batch(now, batch_size)
+        released += count
+        if count < batch_size:
+            break
+    return released
+
+
+# --- outgoing email ---
+def claim_emails(now, batch_size):
+    """Lease up to ``batch_size`` due emails to this worker and return them.
+
+    Claimed rows are pushed ``EMAIL_SEND_LEASE_SECONDS`` into the future so no
+    other worker picks them up; if this worker dies they fall due again.
+    """
+    with transaction.atomic():
+        due = (
+            OutboundEmail.objects
+            .filter(status='queued', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')
+            .select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+        )
+        ids = list(due.values_list('id', flat=True)[:batch_size])
+        lease = now + timedelta(seconds=settings.EMAIL_SEND_LEASE_SECONDS)
+        OutboundEmail.objects.filter(pk__in=ids, status='queued', next_attempt_at__lte=now).update(
+            attempts=F('attempts') + 1, next_attempt_at=lease,
+        )
+    return list(OutboundEmail.objects.filter(pk__in=ids, next_attempt_at=lease).order_by('id'))
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=settings.EMAIL_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1))
+
+
+def send_batch(emails):
+    """Send ``emails`` over one SMTP connection; returns ``(sent, failed)``."""
+    sent, failed = [], []
+    with get_connection() as mail:
+        for email in emails:
+            try:
+                mail.send_messages([email.as_message()])
+            except Exception as e:
+                logger.warning(f"Sending email #{email.pk} failed (attempt {email.attempts}): {e}")
+                failed.append((email, str(e)))
+            else:
+                sent.append(email)
+    return sent, failed
+
+
+@shared_task
+def flush_outbox(batch_size=None, max_batches=20):
+    """Deliver due outbox emails, backing off and eventually giving up on failures."""
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    delivered = 0
+    for _ in range(max_batches):
+        now = timezone.now()
+        emails = claim_emails(now, batch_size)
+        if not emails:
+            break
+        try:
+            sent, failed = send_batch(emails)
+        except Exception as e:
+            # Couldn't even connect: every message in the batch failed.
+            logger.warning(f"Could not open an email connection: {e}")
+            sent, failed = [], [(email, str(e)) for email in emails]
+
+        OutboundEmail.objects.filter(pk__in=[email.pk for email in sent]).update(
+            status='sent', sent_at=timezone.now(), last_error=''
+        )
+        for email, error in failed:
+            if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+                changes = {'status': 'failed'}
+            else:
+                changes = {'next_attempt_at': timezone.now() + retry_delay(email.attempts)}
+            OutboundEmail.objects.filter(pk=email.pk).update(last_error=error, **changes)
+
+        delivered += len(sent)
+        if len(emails) < batch_size:
+            break
+    return delivered
+
+
+# --- idempotency keys ---
+@shared_task
+def purge_idempotency_keys(batch_size=1000, max_batches=100):
+    """Delete expired ``IdempotencyKey`` rows; returns how many."""
+    now = timezone.now()
+    purged = 0
+    for _ in range(max_batches):
+        ids = list(
+            IdempotencyKey.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        purged += IdempotencyKey.objects.filter(pk__in=ids, expires_at__lte=now).delete()[0]
+        if len(ids) < batch_size:
+            break
+    return purged
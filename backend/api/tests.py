@@ -1,3 +1,1869 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings as django_settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import Avg, Count, Sum
+from django.db.models.functions import TruncMonth
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from .models import (
+    User, Category, Skill, Service, Booking, Review, TrustBadge,
+    Message, PaymentTransaction, Location, ProviderMonthlyStats, PlatformCounter, Profile,
+    EscrowTransaction, OutboundEmail, ConversationThread, IdempotencyKey
+)
+from .admin import BookingAdmin
+from .authentication import SignedTokenAuthentication, issue_token
+from .middleware import TokenAuthMiddleware
+from .routing import websocket_urlpatterns
+from .row_serializers import RowSerializer
+from .serializers import ProfileSerializer
+from .tasks import flush_outbox, purge_idempotency_keys, release_due_escrows
+from .views import BookingViewSet
+from .utils import geo
+from . import benchmark, bookings, idempotency, metrics, middleware, renderers, rollups, search, stats
+
+
+# Hashing passwords properly dominates test run time and tests nothing here.
+FAST_HASHERS = override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']
+)
+
+
+class FixturesMixin:
+    """Small factory helpers shared by the API test cases."""
+
+    def make_user(self, username, **extra):
+        return User.objects.create_user(
+            username=username, email=f"{username}@example.com",
+            password="password123", **extra
+        )
+
+    def make_skill(self, name='Python', category='Development'):
+        category, _ = Category.objects.get_or_create(name=category)
+        return Skill.objects.create(name=name, category=category)
+
+    def make_service(self, provider, skills=(), **extra):
+        fields = {
+            'title': 'Web development',
+            'description': 'Websites built with Django',
+            'service_type': 'digital',
+            'payment_type': 'escrow',
+            'price': Decimal('50.00'),
+        }
+        fields.update(extra)
+        service = Service.objects.create(provider=provider, **fields)
+        service.skills.set(skills)
+        return service
+
+
+# --- 1. Query counts ---
+@FAST_HASHERS
+class QueryCountTests(FixturesMixin, TestCase):
+    """List endpoints must cost the same number of queries for 1 or N rows."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = self.make_user('admin', is_staff=True, is_superuser=True)
+        self.client.force_authenticate(self.admin)
+        self.counter = 0
+
+    def seed(self, n):
+        for _ in range(n):
+            self.counter += 1
+            i = self.counter
+            provider = self.make_user(f'provider{i}', is_provider=True)
+            client = self.make_user(f'client{i}')
+            skills = [
+                self.make_skill(f'Skill {i}a', f'Category {i}'),
+                self.make_skill(f'Skill {i}b', f'Category {i}b'),
+            ]
+            service = self.make_service(provider, skills)
+            booking = Booking.objects.create(client=client, service=service)
+            PaymentTransaction.objects.create(booking=booking, amount=Decimal('10.00'), status='held')
+            Review.objects.create(reviewer=client, provider=provider, rating=5)
+            Message.objects.create(sender=client, recipient=provider, text='Hi')
+            TrustBadge.objects.create(user=provider, title='Star', issuer='Community')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assertConstantQueries(self, url):
+        self.seed(1)
+        baseline = self.count_queries(url)
+        self.seed(5)
+        self.assertEqual(self.count_queries(url), baseline, url)
+
+    def test_services(self):
+        self.assertConstantQueries('/api/services/')
+
+    def test_bookings(self):
+        self.assertConstantQueries('/api/bookings/')
+
+    def test_reviews(self):
+        self.assertConstantQueries('/api/reviews/')
+
+    def test_messages(self):
+        self.assertConstantQueries('/api/messages/')
+
+    def test_transactions(self):
+        self.assertConstantQueries('/api/transactions/')
+
+    def test_profiles(self):
+        self.assertConstantQueries('/api/profiles/')
+
+    def test_skills(self):
+        self.assertConstantQueries('/api/skills/')
+
+    def test_badges(self):
+        self.assertConstantQueries('/api/badges/')
+
+
+# --- 2. Full-text search ---
+@FAST_HASHERS
+class ServiceSearchTests(FixturesMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.provider = self.make_user('provider', is_provider=True)
+
+    def search(self, q):
+        response = self.client.get('/api/services/', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [row['title'] for row in response.data['results']]
+
+    def test_ranks_title_matches_first(self):
+        self.make_service(self.provider, title='Logo design', description='Branding work')
+        self.make_service(self.provider, title='Copywriting', description='I also do design')
+        self.make_service(self.provider, title='Plumbing', description='Fix leaks')
+        self.assertEqual(self.search('design'), ['Logo design', 'Copywriting'])
+
+    def test_prefix_and_all_terms(self):
+        self.make_service(self.provider, title='Django development', description='APIs')
+        self.make_service(self.provider, title='Django tutoring', description='Lessons')
+        self.assertEqual(self.search('djan dev'), ['Django development'])
+
+    def test_hostile_query_syntax_is_quoted(self):
+        self.make_service(self.provider, title='Guitar lessons')
+        self.assertEqual(self.search('guitar" OR NEAR(*'), [])
+        self.assertEqual(self.search('"guitar"'), ['Guitar lessons'])
+
+    def test_index_follows_skill_and_category_changes(self):
+        service = self.make_service(self.provider, title='Sessions', description='Weekly')
+        skill = self.make_skill('Yoga', 'Fitness')
+        self.assertEqual(self.search('yoga'), [])
+
+        service.skills.add(skill)
+        self.assertEqual(self.search('yoga'), ['Sessions'])
+        self.assertEqual(self.search('fitness'), ['Sessions'])
+
+        skill.name = 'Pilates'
+        skill.save()
+        self.assertEqual(self.search('yoga'), [])
+        self.assertEqual(self.search('pilates'), ['Sessions'])
+
+        skill.category.name = 'Wellness'
+        skill.category.save()
+        self.assertEqual(self.search('wellness'), ['Sessions'])
+
+        skill.service_set.clear()
+        self.assertEqual(self.search('pilates'), [])
+
+    def test_index_follows_service_changes(self):
+        service = self.make_service(self.provider, title='Piano lessons')
+        service.is_active = False
+        service.save()
+        self.assertEqual(self.search('piano'), [])
+
+        service.is_active = True
+        service.title = 'Violin lessons'
+        service.save()
+        self.assertEqual(self.search('violin'), ['Violin lessons'])
+
+        service.delete()
+        self.assertEqual(self.search('violin'), [])
+
+    def test_rebuild_command(self):
+        self.make_service(self.provider, title='Tax returns')
+        search.rebuild_index(batch_size=1)
+        self.assertEqual(self.search('tax'), ['Tax returns'])
+
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 1 services', out.getvalue())
+        self.assertEqual(self.search('tax'), ['Tax returns'])
+
+
+# --- 3. Proximity search ---
+@FAST_HASHERS
+class ProximitySearchTests(FixturesMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        provider = self.make_user('provider', is_provider=True)
+        places = {
+            'Lagos': (Decimal('6.524379'), Decimal('3.379206')),
+            'Ikeja': (Decimal('6.601838'), Decimal('3.351486')),
+            'Ibadan': (Decimal('7.377535'), Decimal('3.947039')),
+            'London': (Decimal('51.507351'), Decimal('-0.127758')),
+        }
+        for city, (lat, lng) in places.items():
+            location = Location.objects.create(city=city, country='X', latitude=lat, longitude=lng)
+            self.make_service(provider, title=f'Cleaning in {city}', location=location)
+        self.make_service(provider, title='Remote only')
+
+    def near(self, **params):
+        response = self.client.get('/api/services/', {'lat': '6.5244', 'lng': '3.3792', **params})
+        return response
+
+    def test_radius_filter_orders_by_distance(self):
+        response = self.near(radius_km='20')
+        self.assertEqual(response.status_code, 200)
+        titles = [row['title'] for row in response.data['results']]
+        self.assertEqual(titles, ['Cleaning in Lagos', 'Cleaning in Ikeja'])
+        self.assertLess(response.data['results'][0]['distance_km'], 0.1)
+        self.assertAlmostEqual(response.data['results'][1]['distance_km'], 9.0, delta=0.5)
+
+    def test_larger_radius(self):
+        response = self.near(radius_km='150')
+        titles = [row['title'] for row in response.data['results']]
+        self.assertEqual(titles, ['Cleaning in Lagos', 'Cleaning in Ikeja', 'Cleaning in Ibadan'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.near(radius_km='abc').status_code, 400)
+        self.assertEqual(self.near(radius_km='100000').status_code, 400)
+        self.assertEqual(self.client.get('/api/services/', {'lat': '6.5'}).status_code, 400)
+
+    def test_geohash_maintained_on_save(self):
+        location = Location.objects.get(city='London')
+        self.assertEqual(location.geohash[:5], 'gcpvj')
+        location.latitude = None
+        location.save()
+        self.assertEqual(location.geohash, '')
+
+    def test_covering_cells_contain_the_centre(self):
+        box = geo.bounding_box(6.5244, 3.3792, 20)
+        cells = geo.covering_cells(box)
+        self.assertTrue(0 < len(cells) <= 16)
+        centre = geo.encode_geohash(6.5244, 3.3792)
+        self.assertTrue(any(centre.startswith(cell) for cell in cells))
+
+
+# --- 4. Keyset pagination ---
+@FAST_HASHERS
+class KeysetPaginationTests(FixturesMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.provider = self.make_user('provider', is_provider=True)
+        prices = [Decimal('10.00'), None, Decimal('30.00'), Decimal('10.00'), None, Decimal('20.00'), Decimal('5.00')]
+        self.services = [
+            self.make_service(self.provider, title=f'Service {i}', price=price)
+            for i, price in enumerate(prices)
+        ]
+        # Identical timestamps force the id tie-breaker to do its job.
+        Service.objects.filter(pk__in=[s.pk for s in self.services[2:5]]).update(
+            created_at=self.services[2].created_at
+        )
+
+    def walk(self, url, params=None, link='next'):
+        titles, pages = [], 0
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            titles.extend(row['title'] for row in response.data['results'])
+            pages += 1
+            if not response.data[link]:
+                return titles, pages, response
+            response = self.client.get(response.data[link])
+
+    def expected(self, *ordering):
+        return list(Service.objects.order_by(*ordering).values_list('title', flat=True))
+
+    def test_walks_every_row_once_newest_first(self):
+        titles, pages, _ = self.walk('/api/services/', {'page_size': 2})
+        self.assertEqual(titles, self.expected('-created_at', '-id'))
+        self.assertEqual(pages, 4)
+
+    def test_previous_links_walk_back(self):
+        _, _, last = self.walk('/api/services/', {'page_size': 2})
+        titles, pages, _ = self.walk(last.data['previous'], link='previous')
+        forward = self.expected('-created_at', '-id')
+        self.assertEqual(pages, 3)
+        self.assertEqual(sorted(titles), sorted(forward[:6]))
+
+    def test_ordering_param_with_nulls(self):
+        titles, _, _ = self.walk('/api/services/', {'page_size': 2, 'ordering': 'price'})
+        self.assertEqual(len(titles), 7)
+        self.assertEqual(titles[:2], ['Service 1', 'Service 4'])
+        self.assertEqual(titles[2:], ['Service 6', 'Service 0', 'Service 3', 'Service 5', 'Service 2'])
+
+        titles, _, _ = self.walk('/api/services/', {'page_size': 3, 'ordering': '-price'})
+        self.assertEqual(titles, ['Service 2', 'Service 5', 'Service 3', 'Service 0', 'Service 6', 'Service 4', 'Service 1'])
+
+    def test_stable_under_concurrent_inserts(self):
+        first = self.client.get('/api/services/', {'page_size': 3})
+        self.make_service(self.provider, title='Brand new')
+        titles, _, _ = self.walk(first.data['next'])
+        seen = [row['title'] for row in first.data['results']] + titles
+        self.assertNotIn('Brand new', seen)
+        self.assertEqual(seen, self.expected('-created_at', '-id')[1:])
+
+    def test_counts_are_opt_in(self):
+        response = self.client.get('/api/services/')
+        self.assertNotIn('count', response.data)
+
+        response = self.client.get('/api/services/', {'count': 'exact'})
+        self.assertEqual((response.data['count'], response.data['count_is_estimate']), (7, False))
+
+        with self.settings(PAGINATION_COUNT_ESTIMATE_CAP=5):
+            response = self.client.get('/api/services/', {'count': 'estimate'})
+        self.assertEqual((response.data['count'], response.data['count_is_estimate']), (5, True))
+
+    def test_page_size_is_capped_and_cursor_validated(self):
+        response = self.client.get('/api/services/', {'page_size': 10000})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/services/', {'cursor': 'bogus'}).status_code, 404)
+        cursor = base64.urlsafe_b64encode(json.dumps({'v': ['notadate', 'x']}).encode()).decode()
+        self.assertEqual(self.client.get('/api/services/', {'cursor': cursor}).status_code, 404)
+
+    @override_settings(RESPONSE_CACHE_SECONDS=0)
+    def test_deep_pages_cost_the_same_as_page_one(self):
+        first = self.client.get('/api/services/', {'page_size': 1})
+        with CaptureQueriesContext(connection) as page_one:
+            self.client.get('/api/services/', {'page_size': 1})
+        url = first.data['next']
+        for _ in range(4):
+            url = self.client.get(url).data['next']
+        with CaptureQueriesContext(connection) as deep_page:
+            self.client.get(url)
+        self.assertEqual(len(deep_page.captured_queries), len(page_one.captured_queries))
+        self.assertNotIn('OFFSET', deep_page.captured_queries[-2]['sql'].upper())
+
+
+# --- 5. Conversations ---
+@FAST_HASHERS
+class ConversationTests(FixturesMixin, TestCase):
+    def setUp(self):
+        self.alice = self.make_user('alice')
+        self.bob = self.make_user('bob')
+        self.carol = self.make_user('carol')
+        self.client = APIClient()
+
+    def send(self, sender, recipient, text):
+        self.client.force_authenticate(sender)
+        response = self.client.post('/api/messages/', {'recipient_id': recipient.pk, 'text': text})
+        self.assertEqual(response.status_code, 201)
+        return response
+
+    def inbox(self, user):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/conversations/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_inbox_has_one_row_per_counterpart(self):
+        self.send(self.bob, self.alice, 'Hi Alice')
+        self.send(self.carol, self.alice, 'Hello from Carol')
+        self.send(self.bob, self.alice, 'Are you there?')
+
+        rows = self.inbox(self.alice)
+        self.assertEqual([row['counterpart']['username'] for row in rows], ['bob', 'carol'])
+        self.assertEqual(rows[0]['last_message']['text'], 'Are you there?')
+        self.assertEqual([row['unread_count'] for row in rows], [2, 1])
+
+        bob_rows = self.inbox(self.bob)
+        self.assertEqual(len(bob_rows), 1)
+        self.assertEqual(bob_rows[0]['unread_count'], 0)
+
+    def test_reply_and_mark_read(self):
+        self.send(self.bob, self.alice, 'Hi Alice')
+        self.send(self.alice, self.bob, 'Hi Bob')
+        self.assertEqual(self.inbox(self.alice)[0]['unread_count'], 1)
+        self.assertEqual(self.inbox(self.bob)[0]['last_message']['text'], 'Hi Bob')
+
+        self.client.force_authenticate(self.alice)
+        self.client.post(f'/api/conversations/{self.bob.pk}/read/')
+        self.assertEqual(self.inbox(self.alice)[0]['unread_count'], 0)
+
+    def test_thread_messages_are_keyset_paged(self):
+        for i in range(5):
+            self.send(self.bob, self.alice, f'b{i}')
+            self.send(self.alice, self.bob, f'a{i}')
+        self.send(self.carol, self.alice, 'unrelated')
+
+        self.client.force_authenticate(self.alice)
+        url, texts = f'/api/conversations/{self.bob.pk}/messages/?page_size=3', []
+        while url:
+            data = self.client.get(url).data
+            texts.extend(row['text'] for row in data['results'])
+            url = data['next']
+        self.assertEqual(texts, [f'{p}{i}' for i in reversed(range(5)) for p in ('a', 'b')])
+
+    def test_preview_is_truncated(self):
+        self.send(self.bob, self.alice, 'x' * 500)
+        self.assertEqual(len(self.inbox(self.alice)[0]['last_message']['text']), 100)
+
+
+# --- 6. Real-time events ---
+@FAST_HASHERS
+class RealtimeEventTests(FixturesMixin, TransactionTestCase):
+    def setUp(self):
+        self.provider = self.make_user('provider', is_provider=True)
+        self.customer = self.make_user('customer')
+        self.token = Token.objects.create(user=self.customer)
+        self.application = TokenAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    async def connect(self, path):
+        communicator = WebsocketCommunicator(self.application, path)
+        connected, code = await communicator.connect()
+        return communicator, connected, code
+
+    async def test_rejects_anonymous_sockets(self):
+        communicator, connected, code = await self.connect('/ws/events/')
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+    async def test_pushes_messages_and_booking_changes(self):
+        communicator, connected, _ = await self.connect(f'/ws/events/?token={self.token.key}')
+        self.assertTrue(connected)
+
+        await database_sync_to_async(Message.objects.create)(
+            sender=self.provider, recipient=self.customer, text='Your booking is ready'
+        )
+        event = await communicator.receive_json_from()
+        self.assertEqual(event['type'], 'message.created')
+        self.assertEqual(event['data']['text'], 'Your booking is ready')
+
+        @database_sync_to_async
+        def book_and_accept():
+            service = self.make_service(self.provider)
+            booking = Booking.objects.create(client=self.customer, service=service)
+            booking = Booking.objects.get(pk=booking.pk)
+            booking.save()  # unchanged status: no event
+            booking.status = 'accepted'
+            booking.save()
+
+        await book_and_accept()
+        created = await communicator.receive_json_from()
+        changed = await communicator.receive_json_from()
+        self.assertEqual(created['type'], 'booking.created')
+        self.assertEqual((changed['type'], changed['data']['status']), ('booking.status_changed', 'accepted'))
+        self.assertTrue(await communicator.receive_nothing())
+
+        await communicator.send_json_to({'type': 'ping'})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'pong'})
+        await communicator.disconnect()
+
+    async def test_cookie_authentication(self):
+        communicator = WebsocketCommunicator(
+            self.application, '/ws/events/',
+            headers=[(b'cookie', f'csrftoken=x; token={issue_token(self.customer)}'.encode())],
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.disconnect()
+
+
+# --- 7. Provider dashboard rollups ---
+@FAST_HASHERS
+class ProviderDashboardTests(FixturesMixin, TestCase):
+    def setUp(self):
+        self.provider = self.make_user('provider', is_provider=True)
+        self.customer = self.make_user('customer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.provider)
+
+        self.design = self.make_service(self.provider, title='Design')
+        self.writing = self.make_service(self.provider, title='Writing')
+        other = self.make_service(self.make_user('other', is_provider=True), title='Other')
+        Booking.objects.create(client=self.customer, service=other)
+
+        self.bookings = [
+            Booking.objects.create(client=self.customer, service=self.design, status=status)
+            for status in ('pending', 'accepted', 'completed')
+        ]
+        # Spread bookings over two months.
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() - timedelta(days=400)):
+            self.bookings.append(
+                Booking.objects.create(client=self.customer, service=self.design, status='completed')
+            )
+        Booking.objects.create(client=self.customer, service=self.writing)
+
+    def reference(self, **filters):
+        """The aggregate queries the dashboard used to run on every request."""
+        services = Service.objects.filter(provider=self.provider)
+        bookings = Booking.objects.filter(service__in=services, **filters)
+        payments = PaymentTransaction.objects.filter(booking__in=bookings, status='released')
+        reviews = Review.objects.filter(provider=self.provider)
+        return {
+            "total_services": services.count(),
+            "total_bookings": bookings.count(),
+            "total_earnings": payments.aggregate(total=Sum('amount'))['total'] or 0,
+            "average_rating": reviews.aggregate(avg=Avg('rating'))['avg'] or 0,
+            "booking_status_breakdown": sorted(
+                bookings.values('status').annotate(count=Count('id')), key=lambda r: r['status']
+            ),
+            "top_services": list(
+                services.annotate(bookings=Count('booking')).order_by('-bookings')[:5].values('title', 'bookings')
+            ),
+            "monthly_chart_data": list(
+                bookings.annotate(month=TruncMonth('created_at')).values('month')
+                .annotate(count=Count('id')).order_by('month')
+            ),
+        }
+
+    def dashboard(self, **params):
+        response = self.client.get('/api/dashboard/provider/', params)
+        self.assertEqual(response.status_code, 200)
+        data = dict(response.data)
+        data['booking_status_breakdown'] = sorted(data['booking_status_breakdown'], key=lambda r: r['status'])
+        return data
+
+    def assertMatchesReference(self):
+        self.assertEqual(self.dashboard(), self.reference())
+        year = self.bookings[3].created_at.year
+        self.assertEqual(self.dashboard(year=year), self.reference(created_at__year=year))
+        month = self.bookings[0].created_at
+        self.assertEqual(
+            self.dashboard(year=month.year, month=month.month),
+            self.reference(created_at__year=month.year, created_at__month=month.month),
+        )
+
+    def exercise(self):
+        pay = PaymentTransaction.objects.create(booking=self.bookings[2], amount=Decimal('40.00'), status='held')
+        PaymentTransaction.objects.create(booking=self.bookings[3], amount=Decimal('25.50'), status='released')
+        pay.status = 'released'
+        pay.save()
+        pay.amount = Decimal('45.00')
+        pay.save()
+
+        review = Review.objects.create(reviewer=self.customer, provider=self.provider, rating=3)
+        Review.objects.create(reviewer=self.customer, provider=self.provider, rating=5)
+        review.rating = 4
+        review.save()
+
+        booking = Booking.objects.get(pk=self.bookings[0].pk)
+        booking.status = 'cancelled'
+        booking.save()
+        Booking.objects.get(pk=self.bookings[1].pk).delete()
+
+    def test_matches_aggregate_queries(self):
+        self.assertMatchesReference()
+        self.exercise()
+        self.assertMatchesReference()
+
+    def test_service_is_fixed_once_booked(self):
+        PaymentTransaction.objects.create(booking=self.bookings[2], amount=Decimal('40.00'), status='released')
+        other = Service.objects.get(title='Other')
+        self.client.force_authenticate(self.customer)
+        response = self.client.patch(
+            f'/api/bookings/{self.bookings[2].pk}/', {'service_id': other.pk, 'message': 'Moved'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        booking = Booking.objects.get(pk=self.bookings[2].pk)
+        self.assertEqual((booking.service_id, booking.message), (self.design.pk, 'Moved'))
+        self.client.force_authenticate(self.provider)
+        self.assertMatchesReference()
+
+    def test_rebuild_command_restores_rollups(self):
+        self.exercise()
+        expected = self.dashboard()
+        ProviderMonthlyStats.objects.all().delete()
+        Service.objects.update(booking_count=0)
+
+        out = StringIO()
+        call_command('rebuild_provider_stats', '--batch-size', '1', stdout=out)
+        self.assertIn('Rebuilt rollups for 2 providers', out.getvalue())
+        self.assertEqual(self.dashboard(), expected)
+
+    def test_query_count_is_independent_of_bookings(self):
+        with CaptureQueriesContext(connection) as before:
+            self.dashboard()
+        for _ in range(10):
+            Booking.objects.create(client=self.customer, service=self.writing)
+        with CaptureQueriesContext(connection) as after:
+            self.dashboard()
+        self.assertEqual(len(after.captured_queries), len(before.captured_queries))
+
+
+# --- 8. Admin dashboard counters ---
+@FAST_HASHERS
+@override_settings(ADMIN_DASHBOARD_CACHE_SECONDS=0)
+class AdminDashboardTests(FixturesMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = self.make_user('admin', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def reference(self):
+        """The full-table aggregates the dashboard used to run on every request."""
+        return {
+            "total_users": User.objects.count(),
+            "total_providers": User.objects.filter(is_provider=True).count(),
+            "total_services": Service.objects.count(),
+            "total_bookings": Booking.objects.count(),
+            "escrow_held": PaymentTransaction.objects.filter(status='held').aggregate(total=Sum('amount'))['total'] or 0,
+            "escrow_released": PaymentTransaction.objects.filter(status='released').aggregate(total=Sum('amount'))['total'] or 0,
+            "top_providers": list(
+                User.objects.filter(is_provider=True).annotate(num_services=Count('service'))
+                .order_by('-num_services')[:5].values('username', 'num_services')
+            ),
+        }
+
+    def dashboard(self):
+        response = self.client.get('/api/dashboard/admin/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def exercise(self):
+        providers = [self.make_user(f'p{i}', is_provider=True) for i in range(3)]
+        customer = self.make_user('customer')
+        services = [self.make_service(p) for p in providers for _ in range(providers.index(p) + 1)]
+        bookings = [Booking.objects.create(client=customer, service=s) for s in services]
+        held = PaymentTransaction.objects.create(booking=bookings[0], amount=Decimal('30.00'), status='held')
+        PaymentTransaction.objects.create(booking=bookings[1], amount=Decimal('12.50'), status='held')
+        PaymentTransaction.objects.create(booking=bookings[2], amount=Decimal('7.25'), status='initiated')
+        held.status = 'released'
+        held.save()
+
+        customer.is_provider = True
+        customer.save()
+        services[-1].delete()
+        bookings[1].delete()
+        providers[0].delete()
+
+    def test_matches_full_table_aggregates(self):
+        self.exercise()
+        self.assertEqual(self.dashboard(), self.reference())
+
+    def test_rebuild_command(self):
+        self.exercise()
+        PlatformCounter.objects.all().delete()
+        User.objects.update(service_count=0)
+        call_command('rebuild_platform_stats', stdout=StringIO())
+        self.assertEqual(self.dashboard(), self.reference())
+
+    def test_counters_are_sharded(self):
+        with self.settings(PLATFORM_COUNTER_SHARDS=4):
+            for i in range(20):
+                self.make_user(f'u{i}')
+        self.assertGreater(PlatformCounter.objects.filter(name='total_users').count(), 1)
+        self.assertEqual(self.dashboard()['total_users'], 21)
+
+    def test_served_from_cache_within_staleness_bound(self):
+        with self.settings(ADMIN_DASHBOARD_CACHE_SECONDS=60):
+            self.assertEqual(self.dashboard()['total_users'], 1)
+            self.make_user('late')
+            with self.assertNumQueries(0):
+                self.assertEqual(self.dashboard()['total_users'], 1)
+            cache.clear()
+            self.assertEqual(self.dashboard()['total_users'], 2)
+
+
+# --- 9. Provider ratings ---
+@FAST_HASHERS
+class ProviderRatingTests(FixturesMixin, TestCase):
+    def setUp(self):
+        self.provider = self.make_user('provider', is_provider=True)
+        self.customer = self.make_user('customer')
+
+    def review(self, rating):
+        return Review.objects.create(reviewer=self.customer, provider=self.provider, rating=rating)
+
+    def assertRatings(self, rating, count, histogram):
+        profile = Profile.objects.get(user=self.provider)
+        self.assertAlmostEqual(profile.rating, rating)
+        self.assertEqual(profile.rating_count, count)
+        self.assertEqual(profile.rating_histogram, {str(stars): n for stars, n in zip(range(1, 6), histogram)})
+
+    def test_reviews_maintain_rating_and_histogram(self):
+        first, second = self.review(5), self.review(2)
+        self.assertRatings(3.5, 2, [0, 1, 0, 0, 1])
+
+        first.rating = 4
+        first.save()
+        self.assertRatings(3.0, 2, [0, 1, 0, 1, 0])
+
+        second.delete()
+        self.assertRatings(4.0, 1, [0, 0, 0, 1, 0])
+        first.delete()
+        self.assertRatings(0.0, 0, [0, 0, 0, 0, 0])
+
+    def test_moving_a_review_moves_its_rating(self):
+        other = self.make_user('other', is_provider=True)
+        kept, moved = self.review(5), self.review(2)
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        response = client.patch(f'/api/reviews/{moved.pk}/', {'provider_id': other.pk, 'rating': 3}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertRatings(5.0, 1, [0, 0, 0, 0, 1])
+        profile = Profile.objects.get(user=other)
+        self.assertEqual((profile.rating, profile.rating_count, profile.rating_3), (3.0, 1, 1))
+        self.assertEqual(rollups.provider_dashboard(self.provider)['average_rating'], 5)
+        self.assertEqual(rollups.provider_dashboard(other)['average_rating'], 3)
+
+    def test_single_update_per_review(self):
+        self.review(3)
+        with CaptureQueriesContext(connection) as ctx:
+            self.review(4)
+        profile_writes = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "api_profile"')]
+        self.assertEqual(len(profile_writes), 1)
+
+    def test_rebuild_repairs_drift(self):
+        self.review(5), self.review(1), self.review(3)
+        Profile.objects.filter(user=self.provider).update(rating=0, rating_sum=0, rating_count=0, rating_5=7)
+        call_command('rebuild_ratings', batch_size=1, stdout=StringIO())
+        self.assertRatings(3.0, 3, [1, 0, 1, 0, 1])
+
+    def test_profile_exposes_count_and_histogram(self):
+        self.review(4)
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        response = client.get(f'/api/profiles/{self.provider.profile.id}/')
+        self.assertEqual(response.data['rating_count'], 1)
+        self.assertEqual(response.data['rating_histogram'], {'1': 0, '2': 0, '3': 0, '4': 1, '5': 0})
+
+    def test_out_of_range_rating_rejected(self):
+        client = APIClient()
+        client.force_authenticate(self.customer)
+        response = client.post('/api/reviews/', {'provider': self.provider.id, 'rating': 6}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('rating', response.data)
+
+
+# --- 10. Escrow auto-release ---
+@FAST_HASHERS
+class EscrowReleaseTests(FixturesMixin, TestCase):
+    def setUp(self):
+        self.payer = self.make_user('payer')
+        self.receiver = self.make_user('receiver')
+
+    def escrow(self, **extra):
+        return EscrowTransaction.objects.create(
+            payer=self.payer, receiver=self.receiver, amount=Decimal('20.00'), **extra
+        )
+
+    def test_save_only_schedules_release_on_create(self):
+        escrow = self.escrow()
+        scheduled = escrow.released_at
+        self.assertGreater(scheduled, timezone.now() + timedelta(days=6))
+        escrow.description = 'updated'
+        escrow.save()
+        escrow.refresh_from_db()
+        self.assertEqual(escrow.released_at, scheduled)
+
+    def test_saving_a_due_escrow_does_not_release_it(self):
+        escrow = self.escrow(released_at=timezone.now() - timedelta(minutes=1))
+        escrow.refresh_from_db()
+        self.assertEqual(escrow.status, 'pending')
+        self.assertFalse(escrow.released)
+
+    def test_sweeper_releases_due_escrows_in_batches(self):
+        past = timezone.now() - timedelta(hours=1)
+        due = [self.escrow(released_at=past) for _ in range(5)]
+        future = self.escrow()
+        disputed = self.escrow(released_at=past, status='disputed', disputed=True)
+
+        self.assertEqual(release_due_escrows(batch_size=2), 5)
+        for escrow in due:
+            escrow.refresh_from_db()
+            self.assertEqual((escrow.status, escrow.released), ('released', True))
+        future.refresh_from_db()
+        disputed.refresh_from_db()
+        self.assertEqual(future.status, 'pending')
+        self.assertEqual(disputed.status, 'disputed')
+
+        self.assertEqual(release_due_escrows(batch_size=2), 0)
+
+    def test_sweeper_stops_after_max_batches(self):
+        past = timezone.now() - timedelta(hours=1)
+        for _ in range(3):
+            self.escrow(released_at=past)
+        self.assertEqual(release_due_escrows(batch_size=1, max_batches=2), 2)
+        self.assertEqual(EscrowTransaction.objects.filter(status='pending').count(), 1)
+
+
+# --- 11. Email outbox ---
+@FAST_HASHERS
+class EmailOutboxTests(FixturesMixin, TestCase):
+    def signup(self, username):
+        with mock.patch('api.utils.email.flush_outbox.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = APIClient().post('/api/signup/', {
+                    'email': f'{username}@example.com', 'username': username, 'password': 'secret-pass',
+                }, format='json')
+        self.assertEqual(response.status_code, 201)
+        apply_async.assert_called_once_with(retry=False)
+
+    def test_signup_queues_instead_of_sending(self):
+        self.signup('newbie')
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.to), ('queued', ['newbie@example.com']))
+
+        self.assertEqual(flush_outbox(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('/api/verify-email/', mail.outbox[0].body)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('sent', 1))
+
+    def test_batch_reuses_one_connection(self):
+        for i in range(3):
+            self.signup(f'user{i}')
+        with mock.patch('api.tasks.get_connection', wraps=get_connection) as opened:
+            self.assertEqual(flush_outbox(batch_size=10), 3)
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+
+    @override_settings(EMAIL_MAX_ATTEMPTS=2, EMAIL_RETRY_BACKOFF_SECONDS=60)
+    def test_failures_back_off_then_give_up(self):
+        self.signup('unlucky')
+        email = OutboundEmail.objects.get()
+        failing = mock.patch(
+            'django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')
+        )
+        with failing:
+            self.assertEqual(flush_outbox(), 0)
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts, email.last_error), ('queued', 1, 'down'))
+            self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=50))
+
+            # Not due yet, so nothing is retried.
+            self.assertEqual(flush_outbox(), 0)
+            email.refresh_from_db()
+            self.assertEqual(email.attempts, 1)
+
+            OutboundEmail.objects.update(next_attempt_at=timezone.now())
+            flush_outbox()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', 2))
+
+
+# --- 12. Bulk seeding ---
+@FAST_HASHERS
+class SeedCommandTests(TestCase):
+    def seed(self, **options):
+        options = {'users': 8, 'services': 10, 'bookings': 30, 'reviews': 12, 'messages': 15,
+                   'seed': 7, 'batch_size': 4, **options}
+        out = StringIO()
+        call_command('seed_skillswap', stdout=out, **options)
+        return out.getvalue()
+
+    def test_seeds_requested_sizes_and_derived_data(self):
+        output = self.seed()
+        self.assertIn('bookings: 30/30', output)
+        self.assertEqual(User.objects.count(), 8)
+        self.assertEqual(Profile.objects.count(), 8)
+        self.assertEqual(Service.objects.count(), 10)
+        self.assertEqual(Booking.objects.count(), 30)
+        self.assertEqual(Review.objects.count(), 12)
+        self.assertEqual(Message.objects.count(), 15)
+        self.assertTrue(all(Service.skills.through.objects.values_list('service_id', flat=True)))
+        self.assertTrue(User.objects.first().check_password('password123'))
+        self.assertFalse(Location.objects.filter(geohash='').exists())
+
+        # Maintained figures are rebuilt, not left at their defaults.
+        cache.clear()
+        dashboard = stats.admin_dashboard()
+        self.assertEqual((dashboard['total_users'], dashboard['total_bookings']), (8, 30))
+        self.assertEqual(sum(Service.objects.values_list('booking_count', flat=True)), 30)
+        self.assertEqual(sum(Profile.objects.values_list('rating_count', flat=True)), 12)
+        unread = ConversationThread.objects.aggregate(total=Sum('unread_count'))['total']
+        self.assertEqual(unread, 15)
+        title = Service.objects.first().title.split()[0]
+        self.assertTrue(search.search_services(Service.objects.all(), title).exists())
+
+    def test_same_seed_same_data(self):
+        def snapshot():
+            return (
+                list(Service.objects.order_by('id').values_list('title', 'price', 'provider__username')),
+                list(Booking.objects.order_by('id').values_list('status', 'client__username')),
+            )
+        self.seed()
+        first = snapshot()
+        self.seed()
+        self.assertEqual(snapshot(), first)
+        self.seed(seed=8)
+        self.assertNotEqual(snapshot(), first)
+
+    def test_reseed_clears_idempotency_keys(self):
+        self.seed()
+        IdempotencyKey.objects.create(
+            user=User.objects.first(), key='retry', fingerprint='0' * 32, expires_at=timezone.now()
+        )
+        self.seed()
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+# --- 13. Benchmark suite ---
+@FAST_HASHERS
+class BenchmarkCommandTests(TestCase):
+    def test_reports_every_endpoint_and_compares_to_baseline(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = os.path.join(tmp, 'baseline.json')
+            out = StringIO()
+            call_command(
+                'benchmark', seed_data=True, users=12, bookings=20, seed=3, requests=60,
+                save_baseline=baseline, stdout=out,
+            )
+            with open(baseline) as f:
+                results = json.load(f)['endpoints']
+            self.assertEqual(set(results), {s.name for s in benchmark.SCENARIOS} | {'total'})
+            for name, row in results.items():
+                self.assertEqual(row['errors'], 0, name)
+                self.assertLessEqual(row['p50_ms'], row['p95_ms'])
+                self.assertLessEqual(row['p95_ms'], row['p99_ms'])
+                self.assertGreater(row['queries'], 0)
+
+            out = StringIO()
+            call_command('benchmark', only=['admin_dashboard'], requests=5, baseline=baseline, stdout=out)
+            self.assertIn('admin_dashboard', out.getvalue())
+            self.assertIn('baseline', out.getvalue())
+        self.assertFalse(User.objects.get(username=benchmark.BENCH_ADMIN).has_usable_password())
+
+    def test_comparison_flags_regressions(self):
+        before = {'services': {'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0, 'rps': 100.0, 'queries': 3}}
+        after = {'services': {'p50_ms': 10.5, 'p95_ms': 40.0, 'p99_ms': 30.0, 'rps': 95.0, 'queries': 4}}
+        regressed = {
+            metric for _, metric, *_, flag in benchmark.compare(after, before, max_regression=20) if flag
+        }
+        self.assertEqual(regressed, {'p95_ms', 'queries'})
+
+
+# --- 14. Request metrics ---
+@FAST_HASHERS
+@override_settings(METRICS_SAMPLE_RATE=1.0, METRICS_SERVER_TIMING=True)
+class RequestMetricsTests(FixturesMixin, TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.client = APIClient()
+        self.admin = self.make_user('admin', is_staff=True, is_superuser=True)
+        self.client.force_authenticate(self.admin)
+        self.make_service(self.make_user('provider', is_provider=True))
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/services/')
+        timing = dict(
+            part.split(';', 1) for part in (p.strip() for p in response['Server-Timing'].split(','))
+        )
+        self.assertEqual(set(timing), {'app', 'db', 'serializer'})
+        queries = int(re.search(r'desc="(\d+) queries"', timing['db']).group(1))
+        self.assertGreater(queries, 0)
+
+    def test_histograms_in_prometheus_format(self):
+        self.client.get('/api/services/')
+        self.client.get('/api/services/')
+        body = self.client.get('/api/metrics/').content.decode()
+        labels = 'method="GET",view="service-list"'
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 2', body)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', body)
+        self.assertIn(f'http_request_serializer_duration_seconds_count{{{labels}}} 2', body)
+        self.assertIn('# TYPE http_request_db_queries histogram', body)
+
+    @override_settings(METRICS_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_untouched(self):
+        response = self.client.get('/api/services/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(metrics.render().count('_count{'), 0)
+
+    def test_metrics_are_admin_only(self):
+        self.client.force_authenticate(self.make_user('someone'))
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+
+# --- 15. Signed tokens ---
+@FAST_HASHERS
+@override_settings(CORS_ALLOWED_ORIGINS=['http://localhost:3000'])
+class SignedTokenTests(FixturesMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = self.make_user('alice')
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post('/api/login/', {'identifier': 'alice', 'password': 'password123'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def status_with(self, token):
+        return APIClient().get('/api/auth/status/', HTTP_AUTHORIZATION=f'Token {token}').status_code
+
+    def test_login_issues_signed_token_and_cookie(self):
+        response = self.login()
+        token = response.data['token']
+        self.assertEqual(response.cookies['token'].value, token)
+        self.assertFalse(Token.objects.exists())
+        self.assertEqual(self.status_with(token), 200)
+        # The cookie alone authenticates too.
+        self.assertEqual(self.client.get('/api/auth/status/').status_code, 200)
+
+    def test_verified_without_queries(self):
+        token = issue_token(self.user)
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {token}')
+        SignedTokenAuthentication().authenticate(request)  # caches the token version
+        with self.assertNumQueries(0):
+            user, _ = SignedTokenAuthentication().authenticate(request)
+            self.assertTrue(user.is_authenticated)
+            self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(user.username, 'alice')
+
+    def test_logout_revokes_issued_tokens(self):
+        token = self.login().data['token']
+        other = issue_token(self.user)
+        response = self.client.post('/api/logout/', HTTP_AUTHORIZATION=f'Token {token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.status_with(token), 401)
+        self.assertEqual(self.status_with(other), 401)
+        self.user.refresh_from_db()
+        self.assertEqual(self.status_with(issue_token(self.user)), 200)
+
+    def test_rejects_tampered_and_expired_tokens(self):
+        user_id, version, expires, signature = issue_token(self.user).split('.')
+        self.assertEqual(self.status_with(f'{int(user_id) + 1}.{version}.{expires}.{signature}'), 401)
+        self.assertEqual(self.status_with(issue_token(self.user, ttl=-10)), 401)
+
+    def test_inactive_user_rejected_on_use(self):
+        token = issue_token(self.user)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.status_with(token), 401)
+
+    def test_cookie_writes_require_a_trusted_origin(self):
+        self.login()
+        self.assertEqual(self.client.post('/api/logout/', HTTP_ORIGIN='https://evil.example').status_code, 401)
+        self.assertEqual(self.client.post('/api/logout/', HTTP_ORIGIN='http://localhost:3000').status_code, 200)
+
+    def test_database_tokens_still_accepted(self):
+        self.assertEqual(self.status_with(Token.objects.create(user=self.user).key), 200)
+
+
+# --- 16. Facets ---
+@FAST_HASHERS
+class ServiceFacetTests(FixturesMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        provider = self.make_user('provider', is_provider=True)
+        python = self.make_skill('Python', 'Development')
+        django = self.make_skill('Django', 'Development')
+        logo = self.make_skill('Logo design', 'Design')
+        self.make_service(provider, [python, django], price=Decimal('20.00'))
+        self.make_service(provider, [python], price=Decimal('75.00'), payment_type='barter')
+        self.make_service(provider, [logo], price=Decimal('1500.00'), service_type='local')
+        self.make_service(provider, [logo, python], price=None)
+        self.make_service(provider, [logo], is_active=False)
+
+    def facets(self, query=''):
+        response = self.client.get(f'/api/services/?facets=true{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.data['facets']
+
+    def counts(self, entries, key):
+        return {entry[key]: entry['count'] for entry in entries}
+
+    def test_counts_every_dimension(self):
+        facets = self.facets()
+        self.assertEqual(self.counts(facets['service_type'], 'value'), {'digital': 3, 'local': 1})
+        self.assertEqual(self.counts(facets['payment_type'], 'value'), {'escrow': 3, 'postpay': 0, 'barter': 1})
+        self.assertEqual(self.counts(facets['skills'], 'name'), {'Python': 3, 'Django': 1, 'Logo design': 2})
+        # A service with two Development skills counts once for the category.
+        self.assertEqual(self.counts(facets['categories'], 'name'), {'Development': 3, 'Design': 2})
+
+        price = facets['price']
+        self.assertEqual((price['min'], price['max'], price['unpriced']), (Decimal('20.00'), Decimal('1500.00'), 1))
+        buckets = {(b['min'], b['max']): b['count'] for b in price['buckets']}
+        self.assertEqual(buckets[0, 25], 1)
+        self.assertEqual(buckets[50, 100], 1)
+        self.assertEqual(buckets[1000, None], 1)
+
+    def test_counts_follow_filters(self):
+        facets = self.facets('&skill=python&max_price=100')
+        self.assertEqual(self.counts(facets['skills'], 'name'), {'Python': 2, 'Django': 1})
+        self.assertEqual(self.counts(facets['service_type'], 'value'), {'digital': 2, 'local': 0})
+
+        facets = self.facets('&q=logo&ordering=price')
+        self.assertEqual(self.counts(facets['skills'], 'name'), {'Logo design': 2, 'Python': 1})
+
+        category = Category.objects.get(name='Design').pk
+        facets = self.facets(f'&category={category}')
+        self.assertEqual(self.counts(facets['categories'], 'name'), {'Design': 2, 'Development': 1})
+
+    @override_settings(RESPONSE_CACHE_SECONDS=0)
+    def test_query_count_is_fixed(self):
+        self.client.get('/api/services/?facets=true')
+        with CaptureQueriesContext(connection) as plain:
+            self.client.get('/api/services/')
+        with CaptureQueriesContext(connection) as faceted:
+            self.client.get('/api/services/?facets=true')
+        self.assertEqual(len(faceted) - len(plain), 3)
+
+    def test_facets_are_opt_in(self):
+        self.assertNotIn('facets', self.client.get('/api/services/').data)
+
+
+# --- 17. Conditional GETs ---
+class ConditionalGetTests(FixturesMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.skill = self.make_skill('Python', 'Development')
+
+    def test_matching_etag_skips_the_view(self):
+        first = self.client.get('/api/skills/')
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first['ETag'])
+        self.assertIn('Last-Modified', first)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/skills/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], first['ETag'])
+
+        response = self.client.get('/api/skills/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_writes_change_the_etag(self):
+        etag = self.client.get('/api/skills/')['ETag']
+        self.make_skill('Django', 'Development')
+        response = self.client.get('/api/skills/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Skills show their category's name, so a rename changes them too.
+        etag = response['ETag']
+        Category.objects.filter(pk=self.skill.category_id).get().save()
+        self.assertNotEqual(self.client.get('/api/skills/')['ETag'], etag)
+
+    def test_etag_depends_on_the_request(self):
+        self.assertNotEqual(
+            self.client.get('/api/skills/')['ETag'],
+            self.client.get('/api/skills/?page=1')['ETag'],
+        )
+        detail = self.client.get(f'/api/skills/{self.skill.pk}/')
+        self.assertEqual(
+            self.client.get(f'/api/skills/{self.skill.pk}/', HTTP_IF_NONE_MATCH=detail['ETag']).status_code, 304
+        )
+        self.assertEqual(self.client.get('/api/skills/0/').status_code, 404)
+
+    def test_locations(self):
+        etag = self.client.get('/api/locations/')['ETag']
+        self.assertEqual(self.client.get('/api/locations/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Location.objects.create(city='Lisbon', country='Portugal')
+        self.assertEqual(self.client.get('/api/locations/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+# --- 18. Anonymous response cache ---
+@FAST_HASHERS
+class ResponseCacheTests(FixturesMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.provider = self.make_user('provider', is_provider=True)
+        self.python = self.make_skill('Python', 'Development')
+        self.service = self.make_service(self.provider, [self.python])
+
+    def get(self, query=''):
+        return self.client.get(f'/api/services/{query}')
+
+    def test_hits_skip_the_database(self):
+        first = self.get('?ordering=price&service_type=digital')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.get('?service_type=digital&ordering=price')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(self.get('?ordering=-price')['X-Cache'], 'MISS')
+
+    def test_writes_invalidate(self):
+        def changes(write):
+            self.get()
+            write()
+            response = self.get()
+            return response['X-Cache'] == 'MISS'
+
+        self.assertTrue(changes(lambda: Service.objects.filter(pk=self.service.pk).get().save()))
+        self.assertTrue(changes(lambda: self.service.skills.add(self.make_skill('Django'))))
+        self.assertTrue(changes(lambda: self.python.category.save()))
+        location = Location.objects.create(city='Lagos', country='Nigeria', latitude=Decimal('6.52'), longitude=Decimal('3.38'))
+        Service.objects.filter(pk=self.service.pk).update(location=location)
+        near = '?lat=6.52&lng=3.38&radius_km=5'
+        self.assertEqual(len(self.get(near).data['results']), 1)
+        self.assertEqual(self.get(near)['X-Cache'], 'HIT')
+        location.latitude = Decimal('51.5')
+        location.save()
+        response = self.get(near)
+        self.assertEqual((response['X-Cache'], response.data['results']), ('MISS', []))
+
+        self.provider.first_name = 'Ada'
+        self.assertTrue(changes(self.provider.save))
+        self.assertEqual(self.get().data['results'][0]['provider']['first_name'], 'Ada')
+        self.assertFalse(changes(lambda: self.provider.save(update_fields=['last_login'])))
+        self.assertFalse(changes(lambda: self.make_user('client').save()))
+
+    def test_authenticated_requests_bypass_the_cache(self):
+        self.get()
+        self.client.force_authenticate(self.provider)
+        self.assertNotIn('X-Cache', self.get())
+
+    def test_file_backend(self):
+        with tempfile.TemporaryDirectory() as location:
+            responses = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+            with self.settings(CACHES={**django_settings.CACHES, 'responses': responses}):
+                first = self.get('?facets=true')
+                second = self.get('?facets=true')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+
+
+# --- 19. Row serializers ---
+@FAST_HASHERS
+class RowSerializerTests(FixturesMixin, TestCase):
+    def setUp(self):
+        provider = self.make_user('provider', is_provider=True, first_name='Ada')
+        client = self.make_user('client')
+        location = Location.objects.create(city='Lisbon', country='Portugal')
+        python, logo = self.make_skill('Python', 'Development'), self.make_skill('Logo design', 'Design')
+        service = self.make_service(provider, [logo, python], location=location)
+        self.make_service(provider, [], price=None, title='Barter help', payment_type='barter')
+        Booking.objects.create(
+            client=client, service=service, agreed_price=Decimal('45.50'),
+            scheduled_date=timezone.now() + timedelta(days=2), message='See you then',
+        )
+        Booking.objects.create(client=client, service=service, is_barter=True)
+
+    def test_output_matches_the_serializers(self):
+        for name, (queryset, serializer_class) in benchmark.serializer_benchmarks().items():
+            with self.subTest(name):
+                result = benchmark.compare_serializers(queryset, serializer_class, repeat=1)
+                self.assertEqual(result['rows'], 2)
+                self.assertTrue(result['identical'])
+
+    def test_list_endpoints(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(username='client'))
+        booking = client.get('/api/bookings/').data['results'][0]
+        self.assertEqual(booking['service']['provider']['first_name'], 'Ada')
+        self.assertEqual([skill['name'] for skill in booking['service']['skills']], ['Python', 'Logo design'])
+        self.assertEqual(booking['service']['skills'][0]['category']['name'], 'Development')
+
+        # The page, then the skills of every service on it.
+        with self.assertNumQueries(2):
+            services = client.get('/api/services/', {'ordering': 'price'}).data['results']
+        self.assertEqual([s['price'] for s in services], [None, '50.00'])
+
+    def test_unsupported_fields_are_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            RowSerializer(ProfileSerializer)
+
+
+# --- 20. Rendering, compression and streaming ---
+class FastJSONRendererTests(TestCase):
+    data = {
+        'price': Decimal('12.50'),
+        'when': timezone.now(),
+        'local': timezone.localtime(timezone.now(), timezone.get_fixed_timezone(90)),
+        'day': timezone.now().date(),
+        'histogram': {1: 2, 5: 7},
+        'text': 'naïve \u2028 line',
+        'nested': [{'id': 1, 'values': (1.5, None, True)}],
+    }
+
+    def test_output_matches_json_renderer(self):
+        expected = JSONRenderer().render(self.data)
+        self.assertEqual(renderers.FastJSONRenderer().render(self.data), expected)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.FastJSONRenderer().render(self.data), expected)
+        self.assertEqual(
+            renderers.FastJSONRenderer().render(self.data, 'application/json; indent=2'),
+            JSONRenderer().render(self.data, 'application/json; indent=2'),
+        )
+
+    def test_stream_json(self):
+        batches = [[{'id': 1}, {'id': 2}], [], [{'id': 3}]]
+        self.assertEqual(b''.join(renderers.stream_json(batches)), b'[{"id":1},{"id":2},{"id":3}]')
+        self.assertEqual(b''.join(renderers.stream_json([])), b'[]')
+
+
+@FAST_HASHERS
+@override_settings(RESPONSE_CACHE_SECONDS=0, STREAM_BATCH_SIZE=2)
+class CompressionAndStreamingTests(FixturesMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        provider = self.make_user('provider', is_provider=True)
+        skill = self.make_skill('Python', 'Development')
+        for i in range(5):
+            self.make_service(provider, [skill], title=f'Service {i}')
+
+    def test_responses_are_compressed_when_accepted(self):
+        plain = self.client.get('/api/services/')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        response = self.client.get('/api/services/', HTTP_ACCEPT_ENCODING='br;q=1.0, gzip;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+        self.assertNotIn('Content-Encoding', self.client.get('/api/services/', HTTP_ACCEPT_ENCODING='gzip;q=0'))
+        with self.settings(COMPRESSION_MIN_BYTES=len(plain.content) + 1):
+            self.assertNotIn('Content-Encoding', self.client.get('/api/services/', HTTP_ACCEPT_ENCODING='gzip'))
+
+    def test_encoding_negotiation(self):
+        self.assertEqual(middleware.choose_encoding('deflate, gzip'), 'gzip')
+        self.assertIsNone(middleware.choose_encoding('identity'))
+        with mock.patch.object(middleware, 'brotli', object()):
+            self.assertEqual(middleware.choose_encoding('gzip, br'), 'br')
+            self.assertEqual(middleware.choose_encoding('gzip, br;q=0.5'), 'gzip')
+            self.assertEqual(middleware.choose_encoding('*'), 'br')
+
+    def test_streamed_list(self):
+        paged = self.client.get('/api/services/').data['results']
+        response = self.client.get('/api/services/', {'stream': 'true'})
+        self.assertTrue(response.streaming)
+        streamed = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(sorted(streamed, key=lambda s: s['id']), sorted(json.loads(json.dumps(paged)), key=lambda s: s['id']))
+        self.assertEqual(streamed[0]['skills'][0]['name'], 'Python')
+
+        response = self.client.get('/api/services/', {'stream': 'true'}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(b''.join(response.streaming_content))), streamed)
+
+
+# --- 21. Bulk bookings ---
+@FAST_HASHERS
+class BulkBookingTests(FixturesMixin, TestCase):
+    def setUp(self):
+        self.provider = self.make_user('provider', is_provider=True)
+        self.customer = self.make_user('customer')
+        self.service = self.make_service(self.provider)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        self.dashboard = APIClient()
+        self.dashboard.force_authenticate(self.provider)
+
+    def stats(self):
+        return rollups.provider_dashboard(self.provider)
+
+    def test_bulk_create_reports_each_item(self):
+        items = [
+            {'service_id': self.service.pk, 'scheduled_date': (timezone.now() + timedelta(days=i)).isoformat()}
+            for i in range(1, 4)
+        ]
+        items += [{'service_id': 999999}, {'scheduled_date': 'soon', 'service_id': self.service.pk}]
+        response = self.client.post('/api/bookings/bulk/', {'bookings': items}, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.data['succeeded'], response.data['failed']), (3, 2))
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], [201, 201, 201, 400, 400])
+        self.assertIn('service_id', results[3]['errors'])
+        self.assertIn('scheduled_date', results[4]['errors'])
+
+        created = Booking.objects.filter(pk__in=[r['id'] for r in results[:3]])
+        self.assertEqual(created.filter(client=self.customer, status='pending').count(), 3)
+        self.assertEqual(Service.objects.get(pk=self.service.pk).booking_count, 3)
+        self.assertEqual(self.stats()['total_bookings'], 3)
+        self.assertEqual(stats.counters()['total_bookings'], 3)
+
+        response = self.client.post('/api/bookings/bulk/', [{'service_id': self.service.pk}], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.post('/api/bookings/bulk/', {'bookings': []}, format='json').status_code, 400)
+
+    @override_settings(PLATFORM_COUNTER_SHARDS=1)
+    def test_queries_do_not_grow_with_the_batch(self):
+        # One counter shard, so whether a write creates its row doesn't vary.
+        def post(n):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post('/api/bookings/bulk/', [{'service_id': self.service.pk}] * n, format='json')
+            ids = list(Booking.objects.values_list('id', flat=True))
+            with CaptureQueriesContext(connection) as transitions:
+                self.dashboard.post('/api/bookings/bulk-transition/', {'action': 'cancel', 'ids': ids}, format='json')
+            Booking.objects.update(status='pending', version=0)
+            return len(queries), len(transitions)
+
+        post(1)
+        self.assertEqual(post(2), post(20))
+
+    def test_bulk_transitions(self):
+        pending = [Booking.objects.create(client=self.customer, service=self.service) for _ in range(3)]
+        done = Booking.objects.create(client=self.customer, service=self.service, status='completed')
+        ids = [b.pk for b in pending] + [done.pk, 999999]
+
+        # Only the provider may accept.
+        response = self.client.post('/api/bookings/bulk-transition/', {'action': 'accept', 'ids': ids}, format='json')
+        self.assertEqual({r['status'] for r in response.data['results']}, {403, 404})
+
+        response = self.dashboard.post('/api/bookings/bulk-transition/', {'action': 'accept', 'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r['status'] for r in response.data['results']], [200, 200, 200, 409, 404])
+        self.assertEqual(Booking.objects.filter(status='accepted').count(), 3)
+        breakdown = {row['status']: row['count'] for row in self.stats()['booking_status_breakdown']}
+        self.assertEqual(breakdown, {'accepted': 3, 'completed': 1})
+
+        # Clients may cancel their own bookings.
+        response = self.client.post(
+            '/api/bookings/bulk-transition/', {'action': 'cancel', 'ids': [pending[0].pk]}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Booking.objects.get(pk=pending[0].pk).status, 'cancelled')
+
+        bodies = ({'action': 'archive', 'ids': [1]}, {'action': 'start', 'ids': ['1']}, {'action': 'start'}, [1])
+        for body in bodies:
+            with self.subTest(body=body):
+                response = self.dashboard.post('/api/bookings/bulk-transition/', body, format='json')
+                self.assertEqual(response.status_code, 400)
+
+
+# --- 22. Booking transitions ---
+@FAST_HASHERS
+class BookingTransitionTests(FixturesMixin, TestCase):
+    def setUp(self):
+        self.provider = self.make_user('provider', is_provider=True)
+        self.customer = self.make_user('customer')
+        self.booking = Booking.objects.create(client=self.customer, service=self.make_service(self.provider))
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+        self.dashboard = APIClient()
+        self.dashboard.force_authenticate(self.provider)
+
+    def url(self, action):
+        return f'/api/bookings/{self.booking.pk}/{action}/'
+
+    def test_transitions_follow_the_table(self):
+        self.assertEqual(self.client.post(self.url('accept')).status_code, 403)
+        self.assertEqual(self.dashboard.post(self.url('start')).status_code, 409)
+
+        response = self.dashboard.post(self.url('accept'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'id': self.booking.pk, 'status': 'accepted', 'version': 1})
+        self.assertEqual(self.dashboard.post(self.url('start')).data['version'], 2)
+        self.assertEqual(self.dashboard.post(self.url('complete')).data['status'], 'completed')
+
+        response = self.client.post(self.url('cancel'))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['booking_status'], 'completed')
+        self.assertEqual(response.data['version'], 3)
+        self.assertEqual(self.client.post('/api/bookings/999999/cancel/').status_code, 404)
+
+    def test_stale_version_is_a_conflict(self):
+        self.dashboard.post(self.url('accept'))
+        # Cancelling still applies to an accepted booking, but not to the
+        # version the client saw.
+        response = self.client.post(self.url('cancel'), {'version': 0}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual((response.data['booking_status'], response.data['version']), ('accepted', 1))
+        self.assertEqual(self.client.post(self.url('cancel'), {'version': 1}, format='json').status_code, 200)
+        self.assertEqual(self.client.post(self.url('cancel'), {'version': 'x'}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(self.url('cancel'), [], format='json').status_code, 400)
+
+    def test_lost_update_is_a_conflict(self):
+        # The provider's accept lands between the client's read and write.
+        read = bookings.booking_rows
+
+        def read_then_accept(queryset):
+            row = read(queryset).first()
+            Booking.objects.filter(pk=self.booking.pk).update(status='accepted', version=1)
+            return mock.Mock(first=mock.Mock(return_value=row))
+
+        with mock.patch.object(bookings, 'booking_rows', side_effect=read_then_accept):
+            response = self.client.post(self.url('cancel'))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual((response.data['booking_status'], response.data['version']), ('accepted', 1))
+
+    def test_status_is_not_writable(self):
+        response = self.client.patch(
+            f'/api/bookings/{self.booking.pk}/', {'status': 'completed', 'message': 'Bring tools'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.booking.refresh_from_db()
+        self.assertEqual((self.booking.status, self.booking.message), ('pending', 'Bring tools'))
+
+    def test_saved_status_changes_bump_the_version(self):
+        self.booking.status = 'accepted'
+        self.booking.save()
+        self.booking.message = 'See you then'
+        self.booking.save()
+        self.assertEqual(Booking.objects.get(pk=self.booking.pk).version, 1)
+
+
+@FAST_HASHERS
+class BookingTransitionStressTests(FixturesMixin, TransactionTestCase):
+    """Many clients and providers moving the same booking at once."""
+
+    def test_concurrent_transitions_apply_once_each(self):
+        provider = self.make_user('provider', is_provider=True)
+        customer = self.make_user('customer')
+        booking = Booking.objects.create(client=customer, service=self.make_service(provider))
+        attempts = [(provider, 'accept'), (customer, 'cancel'), (provider, 'cancel')] * 8
+        barrier = threading.Barrier(len(attempts))
+        responses = []
+
+        def attempt(user, action):
+            # The view is called directly: the test client reports any
+            # thread's request exception to every client.
+            view = BookingViewSet.as_view({'post': action})
+            try:
+                barrier.wait()
+                while True:
+                    request = APIRequestFactory().post(f'/api/bookings/{booking.pk}/{action}/')
+                    force_authenticate(request, user)
+                    try:
+                        response = view(request, pk=str(booking.pk))
+                    except OperationalError as error:
+                        # Connections to the in-memory test database share one
+                        # cache, where meeting another writer's lock fails at
+                        # once instead of waiting; the request rolled back, so
+                        # it is simply sent again.
+                        if 'locked' not in str(error):
+                            raise
+                        continue
+                    responses.append((action, response))
+                    break
+            finally:
+                connections.close_all()
+
+        read = bookings.booking_rows
+
+        def read_slowly(queryset):
+            # Hold every request between its read and its write, so they
+            # all race from the same version.
+            rows = list(read(queryset))
+            time.sleep(0.05)
+            return mock.Mock(first=mock.Mock(return_value=rows[0] if rows else None))
+
+        threads = [threading.Thread(target=attempt, args=pair) for pair in attempts]
+        with mock.patch.object(bookings, 'booking_rows', side_effect=read_slowly):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(responses), len(attempts))
+        self.assertEqual({response.status_code for _, response in responses} - {200, 409}, set())
+        succeeded = [action for action, response in responses if response.status_code == 200]
+        # One request wins each version: accept and/or a single cancel.
+        self.assertIn(sorted(succeeded), (['accept'], ['cancel'], ['accept', 'cancel']))
+
+        final = 'cancelled' if 'cancel' in succeeded else 'accepted'
+        booking.refresh_from_db()
+        self.assertEqual((booking.status, booking.version), (final, len(succeeded)))
+        dashboard = rollups.provider_dashboard(provider)
+        self.assertEqual({row['status']: row['count'] for row in dashboard['booking_status_breakdown']}, {final: 1})
+
+
+# --- 23. Idempotency keys ---
+@FAST_HASHERS
+class IdempotencyKeyTests(FixturesMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.provider = self.make_user('provider', is_provider=True)
+        self.customer = self.make_user('customer')
+        self.booking = Booking.objects.create(client=self.customer, service=self.make_service(self.provider))
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def pay(self, key, amount='50.00'):
+        return self.client.post(
+            '/api/transactions/', {'booking_id': self.booking.pk, 'amount': amount, 'status': 'held'},
+            format='json', HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retries_replay_the_first_response(self):
+        first = self.pay('pay-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        with self.assertNumQueries(0):
+            retry = self.pay('pay-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(PaymentTransaction.objects.count(), 1)
+
+        # Without the cache the stored row answers.
+        cache.clear()
+        self.assertEqual(self.pay('pay-1').json(), first.json())
+        self.assertEqual(self.pay('pay-1', amount='60.00').status_code, 422)
+
+    def test_keys_belong_to_one_user(self):
+        self.pay('pay-1')
+        other = APIClient()
+        other.force_authenticate(self.provider)
+        booking = Booking.objects.create(client=self.provider, service=self.booking.service)
+        response = other.post(
+            '/api/transactions/', {'booking_id': booking.pk, 'amount': '50.00', 'status': 'held'},
+            format='json', HTTP_IDEMPOTENCY_KEY='pay-1',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_release_retry(self):
+        payment = PaymentTransaction.objects.create(booking=self.booking, amount=Decimal('50.00'), status='held')
+        url = f'/api/transactions/{payment.pk}/release/'
+        self.assertEqual(self.client.post(url, HTTP_IDEMPOTENCY_KEY='release-1').status_code, 200)
+        retry = self.client.post(url, HTTP_IDEMPOTENCY_KEY='release-1')
+        self.assertEqual((retry.status_code, retry['Idempotent-Replayed']), (200, 'true'))
+        # A new key runs the release again, which no longer applies.
+        self.assertEqual(self.client.post(url, HTTP_IDEMPOTENCY_KEY='release-2').status_code, 400)
+        self.assertEqual(self.client.post(url, HTTP_IDEMPOTENCY_KEY='x' * 256).status_code, 400)
+
+    def test_duplicate_waits_for_the_request_in_flight(self):
+        first = self.pay('pay-1')
+        # Put the key back in flight, as if the first request were still running.
+        stored = IdempotencyKey.objects.get(key='pay-1')
+        IdempotencyKey.objects.filter(pk=stored.pk).update(status_code=None)
+        cache.clear()
+
+        def finish(seconds):
+            IdempotencyKey.objects.filter(pk=stored.pk).update(status_code=201)
+
+        with mock.patch.object(idempotency.time, 'sleep', side_effect=finish) as sleep:
+            retry = self.pay('pay-1')
+        sleep.assert_called_once()
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+
+        IdempotencyKey.objects.filter(pk=stored.pk).update(status_code=None)
+        cache.clear()
+        with override_settings(IDEMPOTENCY_WAIT_SECONDS=0):
+            self.assertEqual(self.pay('pay-1').status_code, 409)
+        self.assertEqual(PaymentTransaction.objects.count(), 1)
+
+    def test_failed_requests_release_the_key(self):
+        self.assertEqual(self.pay('pay-1', amount='not a number').status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.pay('pay-1').status_code, 201)
+
+    def test_expired_keys_are_reclaimed_and_purged(self):
+        self.pay('pay-1')
+        PaymentTransaction.objects.all().delete()
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        cache.clear()
+        response = self.pay('pay-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+        IdempotencyKey.objects.create(
+            user=self.customer, key='old', fingerprint='', expires_at=timezone.now() - timedelta(days=1)
+        )
+        self.assertEqual(purge_idempotency_keys(), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['pay-1'])
+
+    def test_escrow_create(self):
+        admin = self.make_user('admin', is_staff=True)
+        self.client.force_authenticate(admin)
+        body = {'payer': self.customer.pk, 'receiver': self.provider.pk, 'amount': '20.00'}
+        for _ in range(2):
+            response = self.client.post('/api/escrows/', body, format='json', HTTP_IDEMPOTENCY_KEY='escrow-1')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(EscrowTransaction.objects.count(), 1)
+
+
+# --- 24. Finance exports ---
+@FAST_HASHERS
+class ExportTests(FixturesMixin, TestCase):
+    def setUp(self):
+        self.provider = self.make_user('provider', is_provider=True)
+        self.customer = self.make_user('customer')
+        self.service = self.make_service(self.provider)
+        self.bookings = [
+            Booking.objects.create(client=self.customer, service=self.service, agreed_price=Decimal('10.10') * i)
+            for i in range(1, 6)
+        ]
+        Booking.objects.filter(pk=self.bookings[0].pk).update(created_at=timezone.now() - timedelta(days=40))
+        self.client = APIClient()
+        self.client.force_authenticate(self.make_user('admin', is_staff=True))
+
+    def export(self, name, **params):
+        response = self.client.get(f'/api/exports/{name}/', params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        response, body = self.export('bookings')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertRegex(response['Content-Disposition'], r'attachment; filename="bookings-\d{8}\.csv"')
+        rows = list(csv.DictReader(StringIO(body)))
+        self.assertEqual([int(row['id']) for row in rows], [b.pk for b in self.bookings])
+        self.assertEqual(rows[1]['agreed_price'], '20.20')
+        self.assertEqual(rows[1]['client_username'], 'customer')
+        self.assertEqual(rows[1]['service_provider_username'], 'provider')
+        self.assertEqual(rows[1]['scheduled_date'], '')
+
+    def test_csv_text_cannot_run_as_formulas(self):
+        Service.objects.filter(pk=self.service.pk).update(title='=HYPERLINK("http://x")')
+        Booking.objects.filter(pk=self.bookings[0].pk).update(location='-2+3')
+        User.objects.filter(pk=self.customer.pk).update(username='+cmd')
+        rows = list(csv.DictReader(StringIO(self.export('bookings')[1])))
+        self.assertEqual(rows[0]['service_title'], '\'=HYPERLINK("http://x")')
+        self.assertEqual((rows[0]['location'], rows[0]['client_username']), ("'-2+3", "'+cmd"))
+        self.assertEqual(rows[1]['agreed_price'], '20.20')
+        jsonl = self.export('bookings', file_type='jsonl')[1]
+        self.assertEqual(json.loads(jsonl.splitlines()[0])['location'], '-2+3')
+
+    def test_jsonl_and_date_range(self):
+        PaymentTransaction.objects.create(booking=self.bookings[1], amount=Decimal('20.20'), status='held')
+        response, body = self.export('transactions', file_type='jsonl')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        [row] = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual((row['amount'], row['booking_client_username']), ('20.20', 'customer'))
+
+        today = timezone.localdate().isoformat()
+        _, body = self.export('bookings', start=today, end=today)
+        self.assertEqual(len(body.splitlines()), 1 + 4)
+        _, body = self.export('bookings', end=(timezone.now() - timedelta(days=1)).isoformat())
+        self.assertEqual(len(body.splitlines()), 1 + 1)
+        _, body = self.export('escrows')
+        self.assertEqual(body.splitlines(), [body.splitlines()[0]])
+
+    @override_settings(STREAM_BATCH_SIZE=2)
+    def test_rows_are_written_in_batches(self):
+        response = self.client.get('/api/exports/bookings/')
+        chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(b''.join(chunks).count(b'\n'), 1 + 5)
+
+    def test_rejected_requests(self):
+        self.assertEqual(self.client.get('/api/exports/users/').status_code, 404)
+        self.assertEqual(self.client.get('/api/exports/bookings/', {'file_type': 'xlsx'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/exports/bookings/', {'start': 'yesterday'}).status_code, 400)
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get('/api/exports/bookings/').status_code, 403)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export', 'bookings', '--file-type', 'jsonl', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 5)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bookings.csv')
+            call_command('export', 'bookings', '--output', path, stderr=StringIO())
+            with open(path, newline='') as exported:
+                self.assertEqual(len(list(csv.reader(exported))), 1 + 5)
+
+
+# --- 25. Admin changelists ---
+@FAST_HASHERS
+class AdminChangelistTests(FixturesMixin, TestCase):
+    def setUp(self):
+        self.provider = self.make_user('provider', is_provider=True)
+        self.customer = self.make_user('customer')
+        self.service = self.make_service(self.provider)
+        self.admin = self.make_user('admin', is_staff=True, is_superuser=True)
+        self.client.force_login(self.admin)
+
+    def add_bookings(self, count):
+        return Booking.objects.bulk_create(
+            Booking(client=self.customer, service=self.service) for _ in range(count)
+        )
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        urls = ['/admin/api/booking/', '/admin/api/paymenttransaction/', '/admin/api/review/',
+                '/admin/api/message/', '/admin/api/escrowtransaction/']
+        self.add_bookings(2)
+        few = [self.changelist_queries(url) for url in urls]
+        for booking in self.add_bookings(30):
+            PaymentTransaction.objects.create(booking=booking, amount=Decimal('5.00'), status='held')
+            EscrowTransaction.objects.create(payer=self.customer, receiver=self.provider, amount=Decimal('5.00'))
+        self.assertEqual([self.changelist_queries(url) for url in urls], few)
+
+    @override_settings(PAGINATION_COUNT_ESTIMATE_CAP=10)
+    def test_pages_past_the_estimate_are_reachable(self):
+        self.add_bookings(30)
+
+        def page(number):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/admin/api/booking/', {'p': number})
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('COUNT(*)' in q['sql'] and 'LIMIT' not in q['sql'] for q in queries))
+            changelist = response.context['cl']
+            return len(changelist.result_list), changelist.paginator.num_pages
+
+        with mock.patch.object(BookingAdmin, 'list_per_page', 5):
+            # Each full page offers the next one, up to the last.
+            self.assertEqual(page(1), (5, 2))
+            self.assertEqual(page(2), (5, 3))
+            self.assertEqual(page(4), (5, 5))
+            self.assertEqual(page(6), (5, 6))
+            self.assertEqual(self.client.get('/admin/api/booking/', {'p': 7}).status_code, 302)
+
+    def test_booking_transition_action(self):
+        pending, accepted = self.add_bookings(2)
+        Booking.objects.filter(pk=accepted.pk).update(status='accepted')
+        response = self.client.post('/admin/api/booking/', {
+            'action': 'accept_bookings', '_selected_action': [pending.pk, accepted.pk],
+        }, follow=True)
+        self.assertContains(response, '1 of 2 bookings moved to accepted.')
+        pending.refresh_from_db()
+        self.assertEqual((pending.status, pending.version), ('accepted', 1))
+
+    def test_booked_service_is_read_only(self):
+        booking, = self.add_bookings(1)
+        response = self.client.get(f'/admin/api/booking/{booking.pk}/change/')
+        self.assertNotIn('service', response.context['adminform'].form.fields)
+        response = self.client.get('/admin/api/booking/add/')
+        self.assertIn('service', response.context['adminform'].form.fields)
+
+    def test_release_payments_action(self):
+        held, released = [
+            PaymentTransaction.objects.create(booking=booking, amount=Decimal('25.00'), status=status)
+            for booking, status in zip(self.add_bookings(2), ('held', 'released'))
+        ]
+        self.client.post('/admin/api/paymenttransaction/', {
+            'action': 'release_selected', '_selected_action': [held.pk, released.pk],
+        })
+        self.assertEqual(PaymentTransaction.objects.filter(status='released').count(), 2)
+        self.assertEqual(rollups.provider_dashboard(self.provider)['total_earnings'], Decimal('50.00'))
+        counters = stats.counters()
+        self.assertEqual((counters['escrow_held'], counters['escrow_released']), (0, Decimal('50.00')))
+
+    def test_escrow_actions_only_touch_pending(self):
+        pending, done = [
+            EscrowTransaction.objects.create(payer=self.customer, receiver=self.provider, amount=Decimal('5.00'))
+            for _ in range(2)
+        ]
+        EscrowTransaction.objects.filter(pk=done.pk).update(status='released', released=True)
+        self.client.post('/admin/api/escrowtransaction/', {
+            'action': 'release_selected', '_selected_action': [pending.pk],
+        })
+        released = EscrowTransaction.objects.get(pk=pending.pk)
+        self.assertEqual((released.status, released.released), ('released', True))
+        self.assertAlmostEqual(released.released_at, timezone.now(), delta=timedelta(minutes=1))
+        EscrowTransaction.objects.filter(pk=pending.pk).update(status='pending', released=False, released_at=None)
+
+        for action, status in [('refund_selected', 'refunded'), ('release_selected', 'refunded')]:
+            self.client.post('/admin/api/escrowtransaction/', {
+                'action': action, '_selected_action': [pending.pk, done.pk],
+            })
+            self.assertEqual(
+                dict(EscrowTransaction.objects.values_list('pk', 'status')),
+                {pending.pk: status, done.pk: 'released'},
+            )
+        self.assertIsNotNone(EscrowTransaction.objects.get(pk=pending.pk).refunded_at)
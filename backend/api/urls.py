@@ -6,7 +6,8 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     UserViewSet, ProfileViewSet, SkillViewSet, CategoryViewSet, ServiceViewSet,
     BookingViewSet, ReviewViewSet, TrustBadgeViewSet, MessageViewSet, PaymentTransactionViewSet,
-    ProviderDashboardView, AdminDashboardView, CustomerDashboardView,
+    EscrowTransactionViewSet, ConversationViewSet,
+    ProviderDashboardView, AdminDashboardView, CustomerDashboardView, MetricsView, ExportView,
     LocationListView, LoginView, LogoutView, SignupView,
     VerifyEmailView, ResendVerificationView, AuthStatusView
 )
@@ -21,7 +22,9 @@ router.register(r'bookings', BookingViewSet)
 router.register(r'reviews', ReviewViewSet)
 router.register(r'badges', TrustBadgeViewSet)
 router.register(r'messages', MessageViewSet)
+router.register(r'conversations', ConversationViewSet, basename='conversation')
 router.register(r'transactions', PaymentTransactionViewSet)
+router.register(r'escrows', EscrowTransactionViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -39,6 +42,12 @@ urlpatterns = [
     path('dashboard/admin/', AdminDashboardView.as_view(), name='admin-dashboard'),
     path('dashboard/customer/', CustomerDashboardView.as_view(), name='customer-dashboard'),
 
+    # Metrics (Prometheus)
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+
+    # Finance exports (CSV / JSON Lines, streamed)
+    path('exports/<str:name>/', ExportView.as_view(), name='export'),
+
     # Locations
     path("locations/", LocationListView.as_view(), name="location-list"),
 
@@ -1,11 +1,40 @@
-import os
-from django.core.mail import EmailMultiAlternatives
+import logging
+
 from django.contrib.auth.tokens import default_token_generator
+from django.db import transaction
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.urls import reverse
 from decouple import config
 
+from ..models import OutboundEmail
+from ..tasks import flush_outbox
+
+logger = logging.getLogger(__name__)
+
+
+def queue_email(subject, text, to, html='', from_email=None):
+    """Store an email in the outbox and wake a worker once the transaction commits.
+
+    Delivery happens in ``api.tasks.flush_outbox``; if the broker can't be
+    reached the periodic flush still picks the message up.
+    """
+    email = OutboundEmail.objects.create(
+        subject=subject, body=text, html_body=html, from_email=from_email or '', to=list(to)
+    )
+
+    def wake_worker():
+        # No publish retries: a down broker fails fast instead of holding up
+        # the response, and the periodic flush delivers the message later.
+        try:
+            flush_outbox.apply_async(retry=False)
+        except Exception as e:
+            logger.warning(f"Could not schedule outbox flush for email #{email.pk}: {e}")
+
+    transaction.on_commit(wake_worker)
+    return email
+
+
 def send_verification_email(user, request):
     uid = urlsafe_base64_encode(force_bytes(user.pk))
     token = default_token_generator.make_token(user)
@@ -25,6 +54,4 @@ def send_verification_email(user, request):
         </html>
     """
 
-    email = EmailMultiAlternatives(subject, text, config("EMAIL_HOST_USER"), [user.email])
-    email.attach_alternative(html, "text/html")
-    email.send()
+    return queue_email(subject, text, [user.email], html=html, from_email=config("EMAIL_HOST_USER"))
@@ -0,0 +1,104 @@
+"""Geohash helpers for proximity search without a spatial database.
+
+Locations store the geohash of their coordinates in an indexed column. A
+radius query first narrows candidates to the handful of geohash cells that
+cover the radius' bounding box (an index range scan per cell), then computes
+the exact haversine distance only for those rows.
+"""
+import math
+
+from django.db.models import FloatField
+from django.db.models.functions import ASin, Cast, Cos, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+GEOHASH_PRECISION = 9
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    latitude, longitude = float(latitude), float(longitude)
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Return the ``(lat, lng)`` size in degrees of a geohash cell."""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """Return ``(min_lat, max_lat, min_lng, max_lng)`` enclosing the radius.
+
+    Longitude bounds are ``None`` when the box touches a pole or crosses the
+    antimeridian, where a simple longitude range can't describe it.
+    """
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    min_lat, max_lat = latitude - dlat, latitude + dlat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), None, None
+
+    dlng = radius_km / (KM_PER_DEGREE_LAT * math.cos(math.radians(latitude)))
+    min_lng, max_lng = longitude - dlng, longitude + dlng
+    if min_lng < -180 or max_lng > 180:
+        return min_lat, max_lat, None, None
+    return min_lat, max_lat, min_lng, max_lng
+
+
+def covering_cells(box, max_cells=16):
+    """Return the geohash prefixes covering ``box``, as fine as ``max_cells`` allows.
+
+    An empty list means the box is too large to be worth prefiltering by cell.
+    """
+    min_lat, max_lat, min_lng, max_lng = box
+    if min_lng is None:
+        return []
+
+    cells = []
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        lat_size, lng_size = cell_size(precision)
+        rows = range(math.floor((min_lat + 90) / lat_size), math.floor((max_lat + 90) / lat_size) + 1)
+        cols = range(math.floor((min_lng + 180) / lng_size), math.floor((max_lng + 180) / lng_size) + 1)
+        if len(rows) * len(cols) > max_cells:
+            break
+        cells = sorted({
+            encode_geohash(
+                min((row + 0.5) * lat_size - 90, 90.0),
+                min((col + 0.5) * lng_size - 180, 180.0),
+                precision,
+            )
+            for row in rows for col in cols
+        })
+    return cells
+
+
+def haversine_km(latitude_field, longitude_field, latitude, longitude):
+    """Database expression for the great-circle distance in km to a point."""
+    lat = Radians(Cast(latitude_field, FloatField()))
+    lng = Radians(Cast(longitude_field, FloatField()))
+    origin_lat, origin_lng = math.radians(latitude), math.radians(longitude)
+    a = (
+        Power(Sin((lat - origin_lat) / 2), 2)
+        + math.cos(origin_lat) * Cos(lat) * Power(Sin((lng - origin_lng) / 2), 2)
+    )
+    return 2 * EARTH_RADIUS_KM * ASin(Sqrt(a), output_field=FloatField())
+
@@ -0,0 +1,106 @@
+"""Per-table version counters and conditional GETs built on them.
+
+Every write to a versioned table bumps its ``TableVersion`` row (see the
+receivers in ``api.signals``). ``VersionedETagMixin`` derives a view's ETag
+and Last-Modified from the versions of the tables its output depends on, so
+a matching ``If-None-Match`` is answered with ``304 Not Modified`` before
+the queryset or serializer runs. Versions are cached for
+``TABLE_VERSION_CACHE_SECONDS``, which bounds how stale other processes can
+be when the cache isn't shared.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.http import HttpResponseNotModified
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from .models import TableVersion
+
+
+def cache_key(name):
+    return f'table-version:{name}'
+
+
+def bump(*names):
+    """Record a write to each table in ``names``."""
+    now = timezone.now()
+    for name in names:
+        rows = TableVersion.objects.filter(name=name)
+        if not rows.update(version=F('version') + 1, updated_at=now):
+            try:
+                with transaction.atomic():
+                    TableVersion.objects.create(name=name, version=1, updated_at=now)
+            except IntegrityError:
+                rows.update(version=F('version') + 1, updated_at=now)
+        cache.delete(cache_key(name))
+        # A reader between the bump and the commit may have cached the old row.
+        transaction.on_commit(lambda name=name: cache.delete(cache_key(name)))
+
+
+def current(names):
+    """Return ``{name: (version, updated_at timestamp)}``; unknown tables are at 0."""
+    keys = {cache_key(name): name for name in names}
+    found = {keys[key]: value for key, value in cache.get_many(keys).items()}
+    missing = [name for name in names if name not in found]
+    if missing:
+        rows = {
+            name: (version, updated_at.timestamp())
+            for name, version, updated_at in TableVersion.objects.filter(name__in=missing)
+            .values_list('name', 'version', 'updated_at')
+        }
+        fetched = {name: rows.get(name, (0, None)) for name in missing}
+        cache.set_many(
+            {cache_key(name): value for name, value in fetched.items()},
+            settings.TABLE_VERSION_CACHE_SECONDS,
+        )
+        found.update(fetched)
+    return found
+
+
+class VersionedETagMixin:
+    """ETag/Last-Modified for list and detail GETs from ``versioned_tables``.
+
+    The ETag also covers the path, query string and response format, since
+    each of those changes the body for the same table versions.
+    """
+    versioned_tables = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, super().retrieve, *args, **kwargs)
+
+    def conditional(self, request, handler, *args, **kwargs):
+        versions = current(self.versioned_tables)
+        variant = f'{request.get_full_path()}|{request.accepted_renderer.format}'
+        digest = hashlib.md5(variant.encode(), usedforsecurity=False).hexdigest()[:12]
+        etag = quote_etag('-'.join(
+            [f'{name}.{versions[name][0]}' for name in self.versioned_tables] + [digest]
+        ))
+        stamps = [stamp for _, stamp in versions.values() if stamp is not None]
+        last_modified = int(max(stamps)) if stamps else None
+
+        if self.not_modified(request, etag, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    def not_modified(self, request, etag, last_modified):
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or f'W/{etag}' in tags
+        since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        return since is not None and last_modified is not None and last_modified <= since
@@ -6,14 +6,15 @@ from django.contrib.auth import authenticate, get_user_model
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.tokens import default_token_generator
 from django.core.mail import EmailMultiAlternatives, send_mail
-from django.db.models import Count, Sum, Avg, Q
-from django.db.models.functions import TruncMonth
+from django.db import transaction
+from django.db.models import Sum, Q, Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import redirect
 
 from django.utils.encoding import force_str
 from django.utils.http import  urlsafe_base64_decode
 
-from rest_framework import viewsets, generics, permissions, status, filters
+from rest_framework import viewsets, generics, mixins, permissions, status, filters
 from rest_framework.decorators import action, permission_classes, api_view
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -26,21 +27,39 @@ from django_filters.rest_framework import DjangoFilterBackend
 from .models import (
     User, Profile, Skill, Category, Service, Booking,
     Review, TrustBadge, Message, PaymentTransaction,
-    EscrowTransaction, Location
+    EscrowTransaction, Location, ConversationThread
 )
 from .serializers import (
     UserSerializer, ProfileSerializer, SkillSerializer,
     CategorySerializer, ServiceSerializer, BookingSerializer,
     ReviewSerializer, TrustBadgeSerializer, MessageSerializer,
     PaymentTransactionSerializer, EscrowTransactionSerializer,
-    LocationSerializer, SignupSerializer
+    LocationSerializer, SignupSerializer, ConversationSerializer
 )
-from .filters import ServiceFilter
+from .filters import ServiceFilter, FullTextSearchFilter, ProximityFilter
+from .idempotency import idempotent
+from .authentication import issue_token, revoke_tokens
+from .metrics import SerializerTimingMixin
+from .response_cache import AnonymousListCacheMixin
+from .row_serializers import RowListMixin
 from .utils.email import send_verification_email
+from .versions import VersionedETagMixin
+from . import bookings, exports, facets, metrics, rollups, stats
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+# Relation-loading plans shared by the viewsets below. Each one mirrors the
+# nesting of the matching serializer so a list page costs a fixed number of
+# queries no matter how many rows it returns.
+SKILLS_WITH_CATEGORY = Skill.objects.select_related('category')
+
+
+def service_prefetch(prefix=''):
+    """Prefetch ``<prefix>skills`` with their categories for ServiceSerializer (in id order,
+    as the row serializers list them)."""
+    return Prefetch(f'{prefix}skills', queryset=SKILLS_WITH_CATEGORY.order_by('pk'))
+
 # --- API Views ---
 # --- 1. UserViewSet ---
 class AuthStatusView(APIView):
@@ -56,7 +75,7 @@ class AuthStatusView(APIView):
             }
         })
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
@@ -65,58 +84,145 @@ class UserViewSet(viewsets.ModelViewSet):
             return [permissions.AllowAny()]
         return [permissions.IsAuthenticated()]
 # --- 2. ProfileViewSet ---
-class ProfileViewSet(viewsets.ModelViewSet):
-    queryset = Profile.objects.all()
+class ProfileViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
+    queryset = Profile.objects.select_related('user').prefetch_related('skills')
     serializer_class = ProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 # --- 3. SkillViewSet ---
-class SkillViewSet(viewsets.ModelViewSet):
-    queryset = Skill.objects.all()
+class SkillViewSet(VersionedETagMixin, SerializerTimingMixin, viewsets.ModelViewSet):
+    queryset = SKILLS_WITH_CATEGORY
     serializer_class = SkillSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    versioned_tables = ('skill', 'category')
 
 # --- 4. CategoryViewSet ---
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(VersionedETagMixin, SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    versioned_tables = ('category',)
 
 # --- 5. ServiceViewSet ---
 
-class ServiceViewSet(viewsets.ModelViewSet):
-    queryset = Service.objects.filter(is_active=True)
+class ServiceViewSet(AnonymousListCacheMixin, RowListMixin, SerializerTimingMixin, viewsets.ModelViewSet):
+    queryset = (
+        Service.objects.filter(is_active=True)
+        .select_related('provider')
+        .prefetch_related(service_prefetch())
+    )
     serializer_class = ServiceSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [
+        DjangoFilterBackend, SearchFilter, FullTextSearchFilter, ProximityFilter, OrderingFilter
+    ]
     filterset_class = ServiceFilter
     search_fields = ['title', 'description']
     ordering_fields = ['price', 'created_at']
+    # Services are listed with their skills (and their categories) and provider,
+    # and filtered and ordered by their location's coordinates.
+    cached_tables = ('service', 'skill', 'category', 'location')
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_list(request, self.list_with_facets, *args, **kwargs)
+
+    def list_with_facets(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        response = self.list_rows(queryset)
+
+        # ?facets=true adds counts per type, skill, category and price bucket
+        if not response.streaming and request.query_params.get('facets', '').lower() in ('1', 'true', 'yes'):
+            response.data['facets'] = facets.facet_counts(queryset)
+        return response
 
     def perform_create(self, serializer):
         serializer.save(provider=self.request.user)
 
+def bulk_size_error(items):
+    if not isinstance(items, list) or not items:
+        return 'Send a non-empty list.'
+    if len(items) > settings.BULK_MAX_ITEMS:
+        return f'At most {settings.BULK_MAX_ITEMS} items per request.'
+    return None
+
+
+def bulk_response(results, success_status):
+    """Per-item results; 207 Multi-Status unless every item succeeded."""
+    failed = sum(1 for result in results if result['status'] >= 400)
+    return Response(
+        {'succeeded': len(results) - failed, 'failed': failed, 'results': results},
+        status=status.HTTP_207_MULTI_STATUS if failed else success_status,
+    )
+
 # --- 6. BookingViewSet ---
-class BookingViewSet(viewsets.ModelViewSet):
-    queryset = Booking.objects.all()
+class BookingViewSet(RowListMixin, SerializerTimingMixin, viewsets.ModelViewSet):
+    queryset = (
+        Booking.objects.select_related('client', 'service__provider')
+        .prefetch_related(service_prefetch('service__'))
+    )
     serializer_class = BookingSerializer
     permission_classes = [permissions.IsAuthenticated]
+    lookup_value_regex = r'\d+'
 
     def perform_create(self, serializer):
         serializer.save(client=self.request.user)
 
+    def transition(self, request, pk, action_name):
+        """Apply a ``BOOKING_TRANSITIONS`` action; 409 if the booking changed meanwhile.
+
+        An optional ``{"version": n}`` makes any change since version ``n`` a
+        conflict.
+        """
+        if not isinstance(request.data, dict):
+            return Response({'error': 'Expected an object'}, status=400)
+        version = request.data.get('version')
+        if version is not None and (not isinstance(version, int) or isinstance(version, bool)):
+            return Response({'error': 'version must be an integer'}, status=400)
+        return Response(bookings.transition_booking(request.user, int(pk), action_name, version))
+
+    @action(detail=True, methods=['post'])
+    def accept(self, request, pk=None):
+        return self.transition(request, pk, 'accept')
+
+    @action(detail=True, methods=['post'])
+    def start(self, request, pk=None):
+        return self.transition(request, pk, 'start')
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        return self.transition(request, pk, 'complete')
+
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
-        booking = self.get_object()
-        if booking.status in ['pending', 'accepted']:
-            booking.status = 'cancelled'
-            booking.save()
-            return Response({'status': 'Booking cancelled'})
-        return Response({'error': 'Cannot cancel at this stage'}, status=400)
+        return self.transition(request, pk, 'cancel')
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """Create many bookings: ``{"bookings": [{"service_id": ..., ...}, ...]}``."""
+        items = request.data.get('bookings') if isinstance(request.data, dict) else request.data
+        error = bulk_size_error(items)
+        if error:
+            return Response({'error': error}, status=400)
+        return bulk_response(bookings.create_bookings(request.user, items), status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='bulk-transition')
+    def bulk_transition(self, request):
+        """Move many bookings on: ``{"action": "accept", "ids": [...]}``."""
+        if not isinstance(request.data, dict):
+            return Response({'error': 'Expected an object with action and ids'}, status=400)
+        action_name, ids = request.data.get('action'), request.data.get('ids')
+        if action_name not in bookings.TRANSITIONS:
+            return Response(
+                {'error': f"action must be one of: {', '.join(bookings.TRANSITIONS)}"}, status=400
+            )
+        error = bulk_size_error(ids)
+        if error or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids):
+            return Response({'error': error or 'ids must be a list of booking ids'}, status=400)
+        return bulk_response(bookings.transition_bookings(request.user, action_name, ids), status.HTTP_200_OK)
 
 # --- 7. ReviewViewSet ---
-class ReviewViewSet(viewsets.ModelViewSet):
-    queryset = Review.objects.all()
+class ReviewViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
+    queryset = Review.objects.select_related('reviewer', 'provider')
     serializer_class = ReviewSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -124,27 +230,70 @@ class ReviewViewSet(viewsets.ModelViewSet):
         serializer.save(reviewer=self.request.user)
 
 # --- 8. TrustBadgeViewSet ---
-class TrustBadgeViewSet(viewsets.ModelViewSet):
-    queryset = TrustBadge.objects.all()
+class TrustBadgeViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
+    queryset = TrustBadge.objects.select_related('user')
     serializer_class = TrustBadgeSerializer
     permission_classes = [permissions.IsAuthenticated]
 
 # --- 9. MessageViewSet ---
-class MessageViewSet(viewsets.ModelViewSet):
-    queryset = Message.objects.all()
+class MessageViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
+    queryset = Message.objects.select_related('sender', 'recipient')
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def perform_create(self, serializer):
-        serializer.save(sender=self.request.user)
+        with transaction.atomic():
+            message = serializer.save(sender=self.request.user)
+            ConversationThread.record(message)
+
+# --- 9b. ConversationViewSet ---
+class ConversationViewSet(SerializerTimingMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """The signed-in user's inbox: one row per counterpart, most recent first.
+
+    ``{id}`` in the detail routes is the counterpart's user id.
+    """
+    serializer_class = ConversationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    lookup_value_regex = r'\d+'
+
+    def get_queryset(self):
+        return (
+            ConversationThread.objects.filter(owner=self.request.user)
+            .select_related('counterpart', 'last_message')
+            .order_by('-last_message_at', '-id')
+        )
+
+    @action(detail=True, methods=['get'])
+    def messages(self, request, pk=None):
+        me = request.user
+        queryset = Message.objects.filter(
+            Q(sender=me, recipient_id=pk) | Q(sender_id=pk, recipient=me)
+        ).select_related('sender', 'recipient')
+        page = self.paginate_queryset(queryset)
+        serializer = MessageSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        ConversationThread.objects.filter(owner=request.user, counterpart_id=pk).update(unread_count=0)
+        return Response({'status': 'Conversation marked as read'})
 
 # --- 10. PaymentTransactionViewSet ---
-class PaymentTransactionViewSet(viewsets.ModelViewSet):
-    queryset = PaymentTransaction.objects.all()
+class PaymentTransactionViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
+    queryset = (
+        PaymentTransaction.objects
+        .select_related('booking__client', 'booking__service__provider')
+        .prefetch_related(service_prefetch('booking__service__'))
+    )
     serializer_class = PaymentTransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     @action(detail=True, methods=['post'])
+    @idempotent
     def release(self, request, pk=None):
         transaction = self.get_object()
         if transaction.status == 'held':
@@ -153,11 +302,15 @@ class PaymentTransactionViewSet(viewsets.ModelViewSet):
             return Response({'status': 'Escrow released'})
         return Response({'error': 'Invalid state'}, status=400)
 
-class EscrowTransactionViewSet(viewsets.ModelViewSet):
+class EscrowTransactionViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = EscrowTransaction.objects.all()
     serializer_class = EscrowTransactionSerializer
     permission_classes = [IsAdminUser]
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
 # --- 11. Dashboard Views ---
 class ProviderDashboardView(APIView):
     permission_classes = [IsAuthenticated]
@@ -169,35 +322,9 @@ class ProviderDashboardView(APIView):
 
         year = request.query_params.get('year')
         month = request.query_params.get('month')
-        filters = {}
-
-        if year:
-            filters['created_at__year'] = int(year)
-        if month:
-            filters['created_at__month'] = int(month)
-
-        services = Service.objects.filter(provider=user)
-        bookings = Booking.objects.filter(service__in=services, **filters)
-        payments = PaymentTransaction.objects.filter(booking__in=bookings, status='released')
-        reviews = Review.objects.filter(provider=user)
-
-        # Chart data: bookings per month
-        monthly_data = (
-            bookings.annotate(month=TruncMonth('created_at'))
-            .values('month')
-            .annotate(count=Count('id'))
-            .order_by('month')
+        data = rollups.provider_dashboard(
+            user, year=int(year) if year else None, month=int(month) if month else None
         )
-
-        data = {
-            "total_services": services.count(),
-            "total_bookings": bookings.count(),
-            "total_earnings": payments.aggregate(total=Sum('amount'))['total'] or 0,
-            "average_rating": reviews.aggregate(avg=Avg('rating'))['avg'] or 0,
-            "booking_status_breakdown": bookings.values('status').annotate(count=Count('id')),
-            "top_services": services.annotate(bookings=Count('booking')).order_by('-bookings')[:5].values('title', 'bookings'),
-            "monthly_chart_data": list(monthly_data),
-        }
         return Response(data)
 
 # --- 12. Admin Dashboard View ---
@@ -205,26 +332,41 @@ class AdminDashboardView(APIView):
     permission_classes = [IsAdminUser]
 
     def get(self, request):
-        total_users = User.objects.count()
-        total_providers = User.objects.filter(is_provider=True).count()
-        total_services = Service.objects.count()
-        total_bookings = Booking.objects.count()
-        escrow_held = PaymentTransaction.objects.filter(status='held').aggregate(total=Sum('amount'))['total'] or 0
-        escrow_released = PaymentTransaction.objects.filter(status='released').aggregate(total=Sum('amount'))['total'] or 0
+        return Response(stats.admin_dashboard())
 
-        data = {
-            "total_users": total_users,
-            "total_providers": total_providers,
-            "total_services": total_services,
-            "total_bookings": total_bookings,
-            "escrow_held": escrow_held,
-            "escrow_released": escrow_released,
-            "top_providers": User.objects.filter(is_provider=True)
-                .annotate(num_services=Count('service'))
-                .order_by('-num_services')[:5]
-                .values('username', 'num_services')
-        }
-        return Response(data)
+# --- 12b. Metrics View ---
+class MetricsView(APIView):
+    """Request latency histograms in the Prometheus text exposition format."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# --- 12c. Export View ---
+class ExportView(APIView):
+    """Stream an export (``api.exports``) as a file download.
+
+    ``?file_type=csv`` (the default) or ``jsonl``; ``?start=`` and ``?end=``
+    (ISO 8601 dates or datetimes) limit the rows by ``created_at``.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, name):
+        if name not in exports.EXPORTS:
+            return Response({'error': f"Unknown export; one of: {', '.join(exports.EXPORTS)}"}, status=404)
+        file_type = request.query_params.get('file_type', 'csv')
+        if file_type not in exports.FILE_TYPES:
+            return Response({'error': f"file_type must be one of: {', '.join(exports.FILE_TYPES)}"}, status=400)
+        try:
+            lookups = exports.created_between(request.query_params.get('start'), request.query_params.get('end'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+
+        response = StreamingHttpResponse(
+            exports.stream(name, file_type, lookups), content_type=exports.FILE_TYPES[file_type]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{exports.filename(name, file_type)}"'
+        return response
 
 # --- 13. Customer Dashboard view ---
 class CustomerDashboardView(APIView):
@@ -233,8 +375,8 @@ class CustomerDashboardView(APIView):
     def get(self, request):
         user = request.user
 
-        bookings = Booking.objects.filter(customer=user)
-        reviews = Review.objects.filter(customer=user)
+        bookings = Booking.objects.filter(client=user)
+        reviews = Review.objects.filter(reviewer=user)
         payments = PaymentTransaction.objects.filter(booking__in=bookings)
 
         data = {
@@ -247,9 +389,10 @@ class CustomerDashboardView(APIView):
         return Response(data)
     
 
-class LocationListView(generics.ListAPIView):
+class LocationListView(VersionedETagMixin, SerializerTimingMixin, generics.ListAPIView):
     queryset = Location.objects.all()
     serializer_class = LocationSerializer
+    versioned_tables = ('location',)
     filter_backends = [filters.SearchFilter, DjangoFilterBackend]
     search_fields = ['city', 'state', 'country']
     filterset_fields = ['city', 'state', 'country']
@@ -273,9 +416,9 @@ class LoginView(APIView):
         user = authenticate(request, username=identifier, password=password)
 
         if user is not None:
-            token, _ = Token.objects.get_or_create(user=user)
+            token = issue_token(user)
             response = Response({
-                "token": token.key,
+                "token": token,
                 "user_id": user.id,
                 "username": user.username,
                 "email": user.email,
@@ -284,11 +427,11 @@ class LoginView(APIView):
             # Set token as HTTP-only cookie
             response.set_cookie(
                 "token",
-                token.key,
+                token,
                 httponly=True,
                 secure=False,  # Change to True in production with HTTPS
                 samesite="Lax",
-                max_age=60 * 60 * 24 * 7  # 1 week
+                max_age=settings.AUTH_TOKEN_TTL_SECONDS
             )
             return response
 
@@ -298,11 +441,9 @@ class LogoutView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        try:
-            # Delete the token from database
-            request.user.auth_token.delete()
-        except Exception:
-            pass  # In case token was already deleted
+        # Revoke every signed token, and delete any old-style database token
+        revoke_tokens(request.user)
+        Token.objects.filter(user_id=request.user.pk).delete()
 
         # Clear the cookie
         response = Response({"message": "Successfully logged out."}, status=status.HTTP_200_OK)
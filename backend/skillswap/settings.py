@@ -4,6 +4,7 @@ Generated by 'django-admin startproject' using Django 4.2.23.
 
 import os
 from pathlib import Path
+from corsheaders.defaults import default_headers
 from decouple import config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -35,9 +36,12 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework.authtoken',    
     'corsheaders',
+    'channels',
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',  # first, so it times the whole stack
+    'api.middleware.CompressionMiddleware',  # brotli/gzip; sees the final response body
     'corsheaders.middleware.CorsMiddleware',  # CORS for APIs
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -66,7 +70,7 @@ TEMPLATES = [
     },
 ]
 
-# ASGI_APPLICATION = 'skillswap.asgi.application'  # Uncomment if using ASGI
+ASGI_APPLICATION = 'skillswap.asgi.application'
 WSGI_APPLICATION = 'skillswap.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -100,7 +104,14 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Render API JSON with orjson (when installed) instead of the standard library
+FAST_JSON_RENDERER = config('FAST_JSON_RENDERER', default=False, cast=bool)
+
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer' if FAST_JSON_RENDERER else 'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter',
@@ -108,20 +119,96 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         # 'rest_framework.authentication.SessionAuthentication',
+        'api.authentication.SignedTokenAuthentication',
+        # Tokens issued before signed tokens; no longer handed out by LoginView
         'rest_framework.authentication.TokenAuthentication',
         'rest_framework.authentication.BasicAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         # 'rest_framework.permissions.IsAuthenticatedOrReadOnly',
         'rest_framework.permissions.AllowAny',
-    ]
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
+    'PAGE_SIZE': config('PAGE_SIZE', default=20, cast=int),
+}
+
+# Signed API tokens (api.authentication): lifetime, and how long a user's token
+# version is cached (a logout takes at most this long to reach other processes
+# unless the cache is shared; only raise it with a shared CACHE_BACKEND)
+AUTH_TOKEN_TTL_SECONDS = config('AUTH_TOKEN_TTL_SECONDS', default=60 * 60 * 24 * 7, cast=int)
+AUTH_TOKEN_VERSION_CACHE_SECONDS = config('AUTH_TOKEN_VERSION_CACHE_SECONDS', default=5, cast=int)
+
+# Pagination counts: 'none' (skip), 'estimate' or 'exact' unless ?count= says otherwise
+PAGINATION_DEFAULT_COUNT = config('PAGINATION_DEFAULT_COUNT', default='none')
+PAGINATION_COUNT_ESTIMATE_CAP = config('PAGINATION_COUNT_ESTIMATE_CAP', default=1000, cast=int)
+
+# Full-text search: maximum number of ranked matches returned for ?q=
+SEARCH_MAX_RESULTS = config('SEARCH_MAX_RESULTS', default=500, cast=int)
+
+# Proximity search (?lat=&lng=&radius_km=) on services
+GEO_DEFAULT_RADIUS_KM = config('GEO_DEFAULT_RADIUS_KM', default=25, cast=float)
+GEO_MAX_RADIUS_KM = config('GEO_MAX_RADIUS_KM', default=500, cast=float)
+
+# Lower bounds of the price histogram returned with /api/services/?facets=true
+SERVICE_PRICE_BUCKETS = config(
+    'SERVICE_PRICE_BUCKETS', default='0,25,50,100,250,500,1000',
+    cast=lambda value: [int(bound) for bound in value.split(',')]
+)
+
+# How long table versions (the ETags of the skill, category and location
+# lists) are cached; other processes may serve a stale ETag for this long
+# unless the cache is shared
+TABLE_VERSION_CACHE_SECONDS = config('TABLE_VERSION_CACHE_SECONDS', default=5, cast=int)
+
+# Cache (locmem by default; point CACHE_BACKEND/CACHE_LOCATION at Redis etc. in production)
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='skillswap'),
+    },
+    # Anonymous service list responses (api.response_cache); may be a
+    # different backend, e.g. FileBasedCache with a directory as location
+    'responses': {
+        'BACKEND': config('RESPONSE_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('RESPONSE_CACHE_LOCATION', default='skillswap-responses'),
+    },
 }
 
+# How long anonymous service list responses are cached (0 disables); writes
+# invalidate them sooner through the table versions
+RESPONSE_CACHE_SECONDS = config('RESPONSE_CACHE_SECONDS', default=300, cast=int)
+
+# Admin dashboard: maintained counters, served from cache at most this stale
+ADMIN_DASHBOARD_CACHE_SECONDS = config('ADMIN_DASHBOARD_CACHE_SECONDS', default=30, cast=int)
+PLATFORM_COUNTER_SHARDS = config('PLATFORM_COUNTER_SHARDS', default=8, cast=int)
+
+# Request metrics: share of requests timed (0 disables) and whether timed responses
+# carry a Server-Timing header; histograms are served to admins at /api/metrics/
+METRICS_SAMPLE_RATE = config('METRICS_SAMPLE_RATE', default=1.0 if DEBUG else 0.05, cast=float)
+METRICS_SERVER_TIMING = config('METRICS_SERVER_TIMING', default=True, cast=bool)
+
+# Responses smaller than this aren't compressed (api.middleware.CompressionMiddleware)
+COMPRESSION_MIN_BYTES = config('COMPRESSION_MIN_BYTES', default=1024, cast=int)
+
+# Rows serialized and sent per chunk when a list is streamed (?stream=true)
+STREAM_BATCH_SIZE = config('STREAM_BATCH_SIZE', default=500, cast=int)
+
+# Most items in one bulk request (/api/bookings/bulk/, /api/bookings/bulk-transition/)
+BULK_MAX_ITEMS = config('BULK_MAX_ITEMS', default=500, cast=int)
+
+# Idempotency-Key on payment and escrow POSTs (api.idempotency): how long a
+# response is replayed, how long a request in flight holds its key, and how
+# long a concurrent duplicate waits for it
+IDEMPOTENCY_KEY_SECONDS = config('IDEMPOTENCY_KEY_SECONDS', default=24 * 60 * 60, cast=int)
+IDEMPOTENCY_LOCK_SECONDS = config('IDEMPOTENCY_LOCK_SECONDS', default=60, cast=int)
+IDEMPOTENCY_WAIT_SECONDS = config('IDEMPOTENCY_WAIT_SECONDS', default=10, cast=int)
+
 # CORS settings
 CORS_ALLOW_CREDENTIALS = True  # if you need to allow cookies or HTTP authentication
 # In production, better to use:
 CORS_ALLOWED_ORIGINS = config("CORS_ALLOWED_ORIGINS", "").split(",")
+# Let browsers send the Idempotency-Key header (api.idempotency)
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
 # Custom User Model
 AUTH_USER_MODEL = 'api.User'
 
@@ -138,17 +225,50 @@ CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = "UTC"
 
-# Email backend: console in DEV, SMTP in PROD
-# if config("DEBUG", cast=bool, default=True):
-#     EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
-# else:
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+# Escrows past their release time are released by a periodic sweep (celery beat).
+ESCROW_RELEASE_INTERVAL_SECONDS = config("ESCROW_RELEASE_INTERVAL_SECONDS", default=60, cast=int)
+ESCROW_RELEASE_BATCH_SIZE = config("ESCROW_RELEASE_BATCH_SIZE", default=500, cast=int)
+CELERY_BEAT_SCHEDULE = {
+    "release-due-escrows": {
+        "task": "api.tasks.release_due_escrows",
+        "schedule": ESCROW_RELEASE_INTERVAL_SECONDS,
+    },
+    "flush-email-outbox": {
+        "task": "api.tasks.flush_outbox",
+        "schedule": config("EMAIL_FLUSH_INTERVAL_SECONDS", default=30, cast=int),
+    },
+    "purge-idempotency-keys": {
+        "task": "api.tasks.purge_idempotency_keys",
+        "schedule": config("IDEMPOTENCY_PURGE_INTERVAL_SECONDS", default=60 * 60, cast=int),
+    },
+}
+# Run tasks inline instead of through the broker (local runs without Redis).
+CELERY_TASK_ALWAYS_EAGER = config("CELERY_TASK_ALWAYS_EAGER", default=False, cast=bool)
+
+# Channel layer for WebSocket events. The in-memory layer only reaches sockets
+# in the same process; use channels_redis.core.RedisChannelLayer across nodes.
+CHANNEL_LAYER_BACKEND = config("CHANNEL_LAYER_BACKEND", default="channels.layers.InMemoryChannelLayer")
+CHANNEL_LAYERS = {"default": {"BACKEND": CHANNEL_LAYER_BACKEND}}
+if CHANNEL_LAYER_BACKEND != "channels.layers.InMemoryChannelLayer":
+    CHANNEL_LAYERS["default"]["CONFIG"] = {"hosts": [config("CHANNEL_LAYER_URL", default=CELERY_BROKER_URL)]}
+
+# Email backend: console in DEV, SMTP in PROD (tests always use locmem).
+# Mail is queued in api.OutboundEmail and sent by the flush_outbox task.
+EMAIL_BACKEND = config(
+    "EMAIL_BACKEND",
+    default="django.core.mail.backends.console.EmailBackend" if DEBUG
+    else "django.core.mail.backends.smtp.EmailBackend",
+)
 EMAIL_HOST = config("EMAIL_HOST", default="smtp.gmail.com")
 EMAIL_PORT = config("EMAIL_PORT", cast=int, default=587)
 EMAIL_USE_TLS = config("EMAIL_USE_TLS", cast=bool, default=True)
 EMAIL_HOST_USER = config("EMAIL_HOST_USER")
 EMAIL_HOST_PASSWORD = config("EMAIL_HOST_PASSWORD")
 DEFAULT_FROM_EMAIL = config("DEFAULT_FROM_EMAIL", default="SkillSwap <no-reply@skillswap.com>")
+EMAIL_BATCH_SIZE = config("EMAIL_BATCH_SIZE", default=50, cast=int)
+EMAIL_MAX_ATTEMPTS = config("EMAIL_MAX_ATTEMPTS", default=5, cast=int)
+EMAIL_RETRY_BACKOFF_SECONDS = config("EMAIL_RETRY_BACKOFF_SECONDS", default=60, cast=int)
+EMAIL_SEND_LEASE_SECONDS = config("EMAIL_SEND_LEASE_SECONDS", default=300, cast=int)
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/